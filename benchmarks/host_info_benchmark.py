@@ -0,0 +1,86 @@
+"""
+Compare HostInfo and CompactHostInfo on per host memory and construction time.
+
+Run from the project root with the environment variables of .env set:
+
+    python -m benchmarks.host_info_benchmark --hosts 100000
+"""
+from __future__ import annotations
+
+import argparse
+import gc
+import json
+import time
+import tracemalloc
+from dataclasses import asdict
+
+from data_normalizer import CompactHostInfo
+from data_normalizer import HostInfo
+
+
+def host_kwargs(index: int) -> dict[str, str]:
+    """
+    Build the constructor arguments of a host the way normalize_qualys_data passes them,
+    with created/first_seen and last_seen/updated sharing one string each.
+    """
+    modified = f'2024-{index % 12 + 1:02d}-{index % 28 + 1:02d}T10:{index % 60:02d}:00.000Z'
+    created = f'2023-{index % 12 + 1:02d}-01T08:00:00.000Z'
+    return {
+        'host_id': str(index),
+        'hostname': f'host-{index}.example.com',
+        'ip_address': f'10.0.{index // 256 % 256}.{index % 256}',
+        'mac_address': '00:11:22:33:44:55',
+        'os': 'Linux',
+        'os_version': 'Ubuntu 22.04',
+        'last_seen': modified,
+        'manufacturer': 'Dell Inc.',
+        'model': 'PowerEdge R640',
+        'location': 'Kathmandu, Bagmati Nepal',
+        'agent_version': '6.1.0.28',
+        'status': 'STATUS_ACTIVE',
+        'created': created,
+        'updated': modified,
+        'cloud_provider': 'AWS',
+        'first_seen': created,
+    }
+
+
+def measure(host_class: type, arguments: list[dict[str, str]]) -> dict[str, float]:
+    """
+    Measure the construction time and the memory retained per host of the given class.
+    """
+    gc.collect()
+    start = time.perf_counter()
+    hosts = [host_class(**kwargs) for kwargs in arguments]
+    elapsed = time.perf_counter() - start
+    del hosts
+
+    gc.collect()
+    tracemalloc.start()
+    hosts = [host_class(**kwargs) for kwargs in arguments]
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del hosts
+    return {
+        'construction_us_per_host': elapsed / len(arguments) * 1e6,
+        'retained_bytes_per_host': retained / len(arguments),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--hosts', type=int, default=100000)
+    args = parser.parse_args()
+
+    arguments = [host_kwargs(index) for index in range(args.hosts)]
+    assert asdict(HostInfo(**arguments[0])) == asdict(CompactHostInfo(**arguments[0]))
+    results = {
+        'hosts': args.hosts,
+        'HostInfo': measure(HostInfo, arguments),
+        'CompactHostInfo': measure(CompactHostInfo, arguments),
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
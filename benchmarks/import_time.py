@@ -0,0 +1,113 @@
+"""
+Check the cold start of the pipeline entry point against an import time budget with `-X importtime`.
+
+`import main` is run in fresh interpreters and the median cumulative import time of `main` is compared
+with the budget. The check also fails when importing `main` loads one of the modules which must only be
+loaded on first use (the visualization stack, pyarrow and requests), creates the MongoClient or opens
+the log file. Exits with status 1 on any violation, so it can gate the container image build.
+
+Run from the project root with the environment variables of .env set:
+
+    python -m benchmarks.import_time --budget-ms 500
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+# Modules importing main must not load, they are imported on first use
+LAZY_MODULES = ('pandas', 'numpy', 'pyarrow', 'matplotlib', 'plotly', 'pycountry', 'requests')
+# Median cumulative import time of main allowed, in milliseconds
+BUDGET_MS = 500.0
+
+# Reports the state of the interpreter once the module is imported, on the last line of stdout
+PROBE = '''
+import json
+import sys
+
+import {module}
+from logger import logger
+from resources import resources
+
+print(json.dumps({{
+    'lazy_modules': sorted(name for name in {lazy_modules!r} if name in sys.modules),
+    'mongo_client': resources._mongo_client is not None,
+    'log_file_open': any(getattr(handler, 'stream', None) is not None and hasattr(handler, 'baseFilename') for handler in logger.logger.handlers),
+}}))
+'''
+
+
+def parse_importtime(stderr: str) -> dict[str, int]:
+    """
+    Return the cumulative import time in microseconds of every module of the `-X importtime` output.
+    """
+    cumulative = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, self_time, total, name = (part.strip() for part in line.replace('import time:', '|', 1).split('|'))
+        cumulative.setdefault(name, int(total))
+    return cumulative
+
+
+def measure(module: str) -> tuple[int, dict[str, int], dict[str, object]]:
+    """
+    Import the module in a fresh interpreter. Returns its cumulative import time in microseconds,
+    the cumulative time of every imported module and the state reported by the probe.
+    """
+    completed = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', PROBE.format(module=module, lazy_modules=LAZY_MODULES)],
+        capture_output=True, text=True, check=True,
+    )
+    cumulative = parse_importtime(completed.stderr)
+    return cumulative[module], cumulative, json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--module', default='main')
+    parser.add_argument('--budget-ms', type=float, default=BUDGET_MS, help='median cumulative import time allowed')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=10, help='slowest top level imports to report')
+    args = parser.parse_args()
+
+    # The first run warms the bytecode cache and is not counted
+    measure(args.module)
+    timings = []
+    for _ in range(max(1, args.runs)):
+        total, cumulative, state = measure(args.module)
+        timings.append(total)
+    median_ms = statistics.median(timings) / 1000
+
+    violations = []
+    if median_ms > args.budget_ms:
+        violations.append(f'importing {args.module} took {median_ms:.1f} ms, over the budget of {args.budget_ms:.1f} ms')
+    if state['lazy_modules']:
+        violations.append(f'importing {args.module} loaded {state["lazy_modules"]}')
+    if state['mongo_client']:
+        violations.append(f'importing {args.module} created the MongoClient')
+    if state['log_file_open']:
+        violations.append(f'importing {args.module} opened the log file')
+
+    slowest = sorted(
+        ((name, total) for name, total in cumulative.items() if '.' not in name and name != args.module),
+        key=lambda item: item[1], reverse=True,
+    )[:args.top]
+    print(json.dumps({
+        'module': args.module,
+        'budget_ms': args.budget_ms,
+        'median_ms': round(median_ms, 1),
+        'runs_ms': [round(timing / 1000, 1) for timing in timings],
+        'slowest_ms': {name: round(total / 1000, 1) for name, total in slowest},
+        **state,
+        'violations': violations,
+    }, indent=2))
+    if violations:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
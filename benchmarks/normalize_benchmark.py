@@ -0,0 +1,94 @@
+"""
+Compare serial normalization with the process pool of normalize_source on a synthetic fleet.
+Reports the wall time of each, the time the parent spends pickling the raw chunks and unpickling
+the HostInfo objects, and the speedup of every worker count over the serial path. The first call of
+a pool also starts its workers, so it is reported separately from the warm calls.
+
+Enable the pool with NORMALIZE_WORKERS only on hosts where this shows a speedup above 1.
+
+Run from the project root with the environment variables of .env set:
+
+    python -m benchmarks.normalize_benchmark --hosts 30000 200000 --workers 2 4
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import pickle
+import statistics
+import time
+
+import data_normalizer as normalizer_module
+from benchmarks.synthetic import generate_fleet
+from data_normalizer import DataNormalizer
+from data_normalizer import normalize_chunk
+
+
+def best_time(function, repeat: int) -> float:
+    """
+    Return the median wall time of `repeat` calls of the function.
+    """
+    timings = []
+    for _ in range(repeat):
+        started_at = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started_at)
+    return statistics.median(timings)
+
+
+def pickling_time(records: list, chunk_size: int) -> float:
+    """
+    Return the time the parent spends pickling the chunks sent to the pool and unpickling the hosts sent back.
+    """
+    chunks = [records[start:start + chunk_size] for start in range(0, len(records), chunk_size)]
+    hosts = [pickle.dumps(normalize_chunk('qualys', chunk)) for chunk in chunks]
+    started_at = time.perf_counter()
+    for chunk in chunks:
+        pickle.dumps(chunk)
+    for payload in hosts:
+        pickle.loads(payload)
+    return time.perf_counter() - started_at
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--hosts', type=int, nargs='+', default=[30000, 200000])
+    parser.add_argument('--workers', type=int, nargs='+', default=[2, 4])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    results = []
+    for hosts in args.hosts:
+        qualys_data, _ = generate_fleet(hosts * 2, duplicate_ratio=0)
+        normalizer = DataNormalizer()
+        normalizer.workers = 1
+        serial = best_time(lambda: normalizer.normalize_source('qualys', qualys_data), args.repeat)
+        result = {
+            'hosts': len(qualys_data),
+            'cpu_count': os.cpu_count(),
+            'serial_seconds': round(serial, 3),
+            'pickling_seconds': round(pickling_time(qualys_data, normalizer.chunk_size), 3),
+            'pools': [],
+        }
+        for workers in args.workers:
+            normalizer.workers = workers
+            normalizer.parallel_threshold = 0
+            started_at = time.perf_counter()
+            normalizer.normalize_source('qualys', qualys_data)
+            first_call = time.perf_counter() - started_at
+            warm = best_time(lambda: normalizer.normalize_source('qualys', qualys_data), args.repeat)
+            result['pools'].append({
+                'workers': workers,
+                'first_call_seconds': round(first_call, 3),
+                'warm_seconds': round(warm, 3),
+                'speedup': round(serial / warm, 2),
+            })
+            normalizer_module.get_process_pool(workers).shutdown()
+            normalizer_module._process_pool = None
+        results.append(result)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,239 @@
+"""
+Time the stages of the pipeline on synthetic fleets served by the local stand-in APIs:
+fetch, geo_enrich, normalize, remove_duplicates, insert_data_operations and generate_diagram.
+The results are written as JSON so runs can be compared over time.
+
+The insert scenarios use the `<MONGO_DB_NAME>_benchmark` database and are skipped when MongoDB
+is not reachable. generate_diagram then draws from a DataFrame of the normalized hosts instead
+of the database aggregation.
+
+Run from the project root with the environment variables of .env set:
+
+    python -m benchmarks.pipeline_benchmark --hosts 10000 100000 1000000
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import tempfile
+import time
+from collections.abc import Callable
+from datetime import datetime
+from typing import Any
+
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+
+from benchmarks.stand_in import serve
+from chart_data import CHART_COLUMNS
+from chart_data import DataFrameChartData
+from chart_data import load_chart_dataframe
+from chart_renderer import chart_renderer
+from config import settings
+from data_fetcher import data_fetcher
+from data_normalizer import data_normalizer
+from data_visualizer import DataVisualizationHandler
+from databases import mongo_db
+from geo_enricher import geo_enricher
+from location_cache import location_cache
+from resources import resources
+
+
+def timed(results: list[dict[str, Any]], scenario: str, hosts: int, function: Callable[[], Any], records: Callable[[Any], int] = len, **details: Any) -> Any:
+    """
+    Run the scenario once, append its wall time, throughput and peak RSS to the results and return its output.
+    """
+    started_at = time.perf_counter()
+    output = function()
+    seconds = time.perf_counter() - started_at
+    count = records(output)
+    result = {
+        'scenario': scenario,
+        'hosts': hosts,
+        'records': count,
+        'seconds': round(seconds, 4),
+        'records_per_second': round(count / seconds, 1) if seconds else None,
+        # ru_maxrss is in kilobytes on Linux
+        'peak_rss_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        **details,
+    }
+    print(json.dumps(result))
+    results.append(result)
+    return output
+
+
+def load_operations(load_results: list[dict[str, Any]]) -> int:
+    """
+    Return the number of operations written by insert_data_operations.
+    """
+    return sum(result['operations'] for result in load_results)
+
+
+def mongo_available() -> bool:
+    """
+    Check whether the MongoDB server answers a ping.
+    """
+    client = MongoClient(
+        settings.MONGO_DB_HOST, settings.MONGO_DB_PORT, serverSelectionTimeoutMS=2000,
+    )
+    try:
+        client.admin.command('ping')
+        return True
+    except PyMongoError:
+        return False
+    finally:
+        client.close()
+
+
+def start_stand_in(args: argparse.Namespace, hosts: int) -> multiprocessing.Process:
+    """
+    Start the stand-in APIs serving the fleet of `hosts` in a child process,
+    so serving the pages does not compete with the pipeline for the event loop.
+    """
+    ready = multiprocessing.Event()
+    process = multiprocessing.Process(
+        target=serve,
+        args=(hosts, args.duplicate_ratio, args.seed, args.latency, args.geo_latency, args.port, ready),
+        daemon=True,
+    )
+    process.start()
+    if not ready.wait(timeout=600):
+        process.terminate()
+        raise RuntimeError('The stand-in APIs did not start')
+    return process
+
+
+def run_scenarios(args: argparse.Namespace, hosts: int, use_mongo: bool, results: list[dict[str, Any]]):
+    """
+    Run every scenario on a fleet of `hosts`.
+    """
+    base_url = f'http://127.0.0.1:{args.port}'
+    data_fetcher.qualys_url = f'{base_url}/qualys'
+    data_fetcher.crowdstrike_url = f'{base_url}/crowdstrike'
+    data_fetcher.paginated = True
+    data_fetcher.skip = 0
+    data_fetcher.limit = args.page_size
+    geo_enricher.url = f'{base_url}/ip/{{ip_address}}/json/'
+    # Every run resolves all the IP addresses against the stand-in
+    location_cache.enabled = False
+
+    stand_in = start_stand_in(args, hosts)
+    try:
+        qualys_data, crowdstrike_data = timed(
+            results, 'fetch', hosts,
+            lambda: resources.run(data_fetcher.fetch_all_data()),
+            records=lambda output: len(output[0]) + len(output[1]),
+            page_size=args.page_size, latency=args.latency,
+        )
+        locations = timed(
+            results, 'geo_enrich', hosts,
+            lambda: resources.run(geo_enricher.enrich_crowdstrike_data(crowdstrike_data)),
+            geo_latency=args.geo_latency,
+        )
+    finally:
+        stand_in.terminate()
+        stand_in.join()
+
+    normalized_data = timed(
+        results, 'normalize', hosts,
+        lambda: [
+            *data_normalizer.normalize_source('qualys', qualys_data),
+            *data_normalizer.normalize_source('crowdstrike', crowdstrike_data, locations=locations),
+        ],
+        workers=data_normalizer.workers,
+    )
+    # Release the raw payloads and the normalized hosts once they are not needed anymore
+    qualys_data = crowdstrike_data = None
+    unique_data = timed(
+        results, 'remove_duplicates', hosts,
+        lambda: data_normalizer.remove_duplicates(normalized_data),
+        duplicate_ratio=args.duplicate_ratio,
+    )
+    normalized_data = None
+
+    if use_mongo:
+        mongo_db.collection.drop()
+        mongo_db.ensure_indexes()
+        timed(
+            results, 'insert_data_operations', hosts,
+            lambda: mongo_db.insert_data_operations(unique_data),
+            records=load_operations, collection='empty',
+        )
+        timed(
+            results, 'insert_data_operations', hosts,
+            lambda: mongo_db.insert_data_operations(unique_data),
+            records=load_operations, collection='unchanged',
+        )
+
+    visualizer = DataVisualizationHandler()
+    if not use_mongo:
+        dataframe = load_chart_dataframe(
+            ({column: getattr(host, column) for column in CHART_COLUMNS} for host in unique_data),
+            mongo_db.batch_size,
+        )
+        visualizer.chart_data = DataFrameChartData(lambda: dataframe)
+    # Render every diagram instead of skipping the unchanged ones
+    chart_renderer.cache_enabled = False
+    working_directory = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            timed(
+                results, 'generate_diagram', hosts, visualizer,
+                records=lambda output: len(unique_data),
+                source='aggregate' if use_mongo else 'dataframe',
+            )
+        finally:
+            os.chdir(working_directory)
+    if use_mongo:
+        mongo_db.collection.drop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--hosts', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--duplicate-ratio', type=float, default=0.1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--page-size', type=int, default=1000)
+    parser.add_argument('--latency', type=float, default=0.02, help='seconds per page request')
+    parser.add_argument('--geo-latency', type=float, default=0.02, help='seconds per IP address request')
+    parser.add_argument('--port', type=int, default=8799)
+    parser.add_argument('--output', help='JSON file to write, benchmarks/results/pipeline-<time>.json by default')
+    args = parser.parse_args()
+
+    use_mongo = mongo_available()
+    if use_mongo:
+        mongo_db.collection = resources.mongo_client[f'{settings.MONGO_DB_NAME}_benchmark']['hosts']
+    else:
+        print('MongoDB is not reachable, skipping the insert_data_operations scenarios')
+
+    started_at = datetime.now()
+    results: list[dict[str, Any]] = []
+    for hosts in args.hosts:
+        run_scenarios(args, hosts, use_mongo, results)
+
+    report = {
+        'started_at': started_at.isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'mongo': use_mongo,
+        'arguments': vars(args),
+        'results': results,
+    }
+    output = args.output or os.path.join(
+        'benchmarks', 'results', f'pipeline-{started_at:%Y-%m-%dT%H-%M-%S}.json',
+    )
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as report_file:
+        json.dump(report, report_file, indent=2)
+    print(f'Wrote the results to {output}')
+    resources.close()
+
+
+if __name__ == '__main__':
+    main()
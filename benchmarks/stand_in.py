@@ -0,0 +1,93 @@
+"""
+Local aiohttp stand-in for the Qualys, CrowdStrike and IP address APIs serving a synthetic fleet,
+with a configurable latency per request.
+
+Run from the project root:
+
+    python -m benchmarks.stand_in --hosts 100000 --latency 0.02 --port 8799
+
+and point QUALYS_API_URL, CROWDSTRIKE_API_URL and IP_ADDRESS_API_URL at
+http://127.0.0.1:8799/qualys, http://127.0.0.1:8799/crowdstrike and
+http://127.0.0.1:8799/ip/{ip_address}/json/
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+from typing import Any
+
+from aiohttp import web
+
+from benchmarks.synthetic import generate_fleet
+from benchmarks.synthetic import location_of
+
+
+def create_app(qualys: list[dict[str, Any]], crowdstrike: list[dict[str, Any]], latency: float = 0.0, geo_latency: float = 0.0) -> web.Application:
+    """
+    Build the application serving the skip/limit pages of both payloads and the location of any IP address.
+    """
+    def page_handler(records: list[dict[str, Any]]):
+        async def handler(request: web.Request) -> web.Response:
+            skip = int(request.query.get('skip', 0))
+            limit = int(request.query.get('limit', 1))
+            await asyncio.sleep(latency)
+            return web.Response(
+                body=json.dumps(records[skip:skip + limit]).encode('utf-8'),
+                content_type='application/json',
+            )
+        return handler
+
+    async def location_handler(request: web.Request) -> web.Response:
+        await asyncio.sleep(geo_latency)
+        city, region, country = location_of(request.match_info['ip_address'])
+        return web.json_response(
+            {'city': city, 'region': region, 'country_name': country},
+        )
+
+    app = web.Application()
+    app.router.add_post('/qualys', page_handler(qualys))
+    app.router.add_post('/crowdstrike', page_handler(crowdstrike))
+    app.router.add_post('/ip/{ip_address}/json/', location_handler)
+    return app
+
+
+def serve(hosts: int, duplicate_ratio: float, seed: int, latency: float, geo_latency: float, port: int, ready: Any = None):
+    """
+    Generate the fleet and serve it until the process is stopped.
+    `ready` is set once the server accepts connections, when it runs in a child process.
+    """
+    qualys, crowdstrike = generate_fleet(hosts, duplicate_ratio, seed=seed)
+    app = create_app(qualys, crowdstrike, latency, geo_latency)
+
+    async def run():
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, '127.0.0.1', port).start()
+        if ready is not None:
+            ready.set()
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await runner.cleanup()
+
+    asyncio.run(run())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--hosts', type=int, default=100000)
+    parser.add_argument('--duplicate-ratio', type=float, default=0.1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--latency', type=float, default=0.02, help='seconds per page request')
+    parser.add_argument('--geo-latency', type=float, default=0.02, help='seconds per IP address request')
+    parser.add_argument('--port', type=int, default=8799)
+    args = parser.parse_args()
+    serve(
+        args.hosts, args.duplicate_ratio, args.seed,
+        args.latency, args.geo_latency, args.port,
+    )
+
+
+if __name__ == '__main__':
+    main()
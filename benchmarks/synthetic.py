@@ -0,0 +1,136 @@
+"""
+Generate synthetic Qualys and CrowdStrike payloads in the shapes the API responses have,
+so normalize_qualys_data and normalize_crowdstrike_data consume them unchanged.
+
+The same arguments always generate the same fleet, so the stand-in server and the benchmark
+can build it independently.
+"""
+from __future__ import annotations
+
+import random
+from datetime import datetime
+from datetime import timedelta
+from typing import Any
+
+OPERATING_SYSTEMS = [
+    ('Linux', 'Ubuntu 22.04'), ('Windows', 'Windows Server 2019'), ('Mac', 'macOS 14.4'),
+]
+AGENT_STATUSES = ['STATUS_ACTIVE', 'STATUS_INACTIVE']
+DEVICE_STATUSES = ['normal', 'containment_pending']
+CLOUD_PROVIDERS = ['AWS', 'Azure', 'GCP', None]
+LOCATIONS = [
+    ('Kathmandu', 'Bagmati', 'Nepal'), ('Berlin', 'Berlin', 'Germany'),
+    ('Austin', 'Texas', 'United States'), ('Pune', 'Maharashtra', 'India'),
+    ('Osaka', 'Osaka', 'Japan'),
+]
+EPOCH = datetime(2024, 1, 1)
+
+
+def timestamp(moment: datetime) -> str:
+    """
+    Format the moment the way both APIs do.
+    """
+    return moment.strftime('%Y-%m-%dT%H:%M:%S.000Z')
+
+
+def external_ip(index: int) -> str:
+    """
+    Return the external IP address of the index-th NAT gateway.
+    """
+    return f'203.0.{index // 256 % 256}.{index % 256}'
+
+
+def location_of(ip_address: str) -> tuple[str, str, str]:
+    """
+    Return the city, region and country the IP address is located in.
+    """
+    return LOCATIONS[sum(map(int, ip_address.split('.'))) % len(LOCATIONS)]
+
+
+def qualys_record(index: int, version: int) -> dict[str, Any]:
+    """
+    Build a Qualys host record. Later versions of a host are modified later.
+    """
+    platform, os_version = OPERATING_SYSTEMS[index % len(OPERATING_SYSTEMS)]
+    created = EPOCH - timedelta(days=index * 7919 % (5 * 365))
+    modified = EPOCH + timedelta(days=index % 300, hours=version)
+    city, region, country = LOCATIONS[index % len(LOCATIONS)]
+    return {
+        '_id': index,
+        'dnsHostName': f'qualys-{index}.example.com',
+        'address': f'10.{index // 65536 % 256}.{index // 256 % 256}.{index % 256}',
+        'os': os_version,
+        'modified': timestamp(modified),
+        'created': timestamp(created),
+        'manufacturer': 'Dell Inc.',
+        'model': 'PowerEdge R640',
+        'cloudProvider': CLOUD_PROVIDERS[index % len(CLOUD_PROVIDERS)],
+        'agentInfo': {
+            'platform': platform,
+            'location': f'{city}, {region} {country}',
+            'agentVersion': f'{index % 7}.{index % 3}.0.{index % 50}',
+            'status': AGENT_STATUSES[index % len(AGENT_STATUSES)],
+        },
+        'networkInterface': {
+            'list': [
+                {'HostAssetInterface': {'macAddress': f'00:16:3e:{index // 65536 % 256:02x}:{index // 256 % 256:02x}:{index % 256:02x}'}},
+            ],
+        },
+    }
+
+
+def crowdstrike_record(index: int, version: int, gateways: int) -> dict[str, Any]:
+    """
+    Build a CrowdStrike device record behind one of `gateways` NAT gateways.
+    Later versions of a device are last seen later.
+    """
+    platform, os_version = OPERATING_SYSTEMS[index % len(OPERATING_SYSTEMS)]
+    first_seen = EPOCH - timedelta(days=index * 7919 % (5 * 365))
+    last_seen = EPOCH + timedelta(days=index % 300, hours=version)
+    return {
+        'device_id': f'{index:032x}',
+        'hostname': f'crowdstrike-{index}',
+        'local_ip': f'172.16.{index // 256 % 256}.{index % 256}',
+        'mac_address': f'02-42-ac-{index // 65536 % 256:02x}-{index // 256 % 256:02x}-{index % 256:02x}',
+        'platform_name': platform,
+        'os_version': os_version,
+        'last_seen': timestamp(last_seen),
+        'system_manufacturer': 'Amazon EC2',
+        'system_product_name': 't3.large',
+        'external_ip': external_ip(index % gateways),
+        'agent_version': f'{index % 7}.{index % 11}.{index % 5}',
+        'status': DEVICE_STATUSES[index % len(DEVICE_STATUSES)],
+        'first_seen': timestamp(first_seen),
+        'service_provider': CLOUD_PROVIDERS[index % len(CLOUD_PROVIDERS)],
+    }
+
+
+def generate_fleet(hosts: int, duplicate_ratio: float = 0.1, gateways: int | None = None, seed: int = 0) -> tuple[list[dict[str, Any]], list[dict[str, Any]]]:
+    """
+    Generate `hosts` records split evenly between Qualys and CrowdStrike.
+    `duplicate_ratio` of the records of each source are newer versions of a host already in the payload,
+    the way a host shows up twice when it changes while the pages are walked.
+    The CrowdStrike devices share `gateways` external IP addresses, one per 50 devices by default.
+    The duplicated hosts are picked with a random generator seeded with `seed`.
+    """
+    rng = random.Random(seed)
+    qualys_hosts = hosts // 2
+    crowdstrike_hosts = hosts - qualys_hosts
+    gateways = gateways or max(1, crowdstrike_hosts // 50)
+
+    def records(count: int, build) -> list[dict[str, Any]]:
+        unique = max(1, round(count * (1 - duplicate_ratio)))
+        versions = [0] * unique
+        built = []
+        for position in range(count):
+            index = position if position < unique else rng.randrange(unique)
+            versions[index] += 1
+            built.append(build(index, versions[index]))
+        return built
+
+    qualys = records(qualys_hosts, qualys_record)
+    crowdstrike = records(
+        crowdstrike_hosts,
+        lambda index, version: crowdstrike_record(index, version, gateways),
+    )
+    return qualys, crowdstrike
@@ -0,0 +1,137 @@
+"""
+Compare the previous full DataFrame load and row-wise chart counts with the projected,
+categorical DataFrame load and vectorized chart counts on synthetic documents.
+Reports the peak traced memory and the CPU time of each path.
+
+Run from the project root with the environment variables of .env set:
+
+    python -m benchmarks.visualizer_benchmark --hosts 200000
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import time
+import tracemalloc
+from datetime import datetime
+from datetime import timedelta
+
+import pandas as pd
+import pycountry
+
+from chart_data import CHART_COLUMNS
+from chart_data import DataFrameChartData
+from chart_data import load_chart_dataframe
+
+CHARTS = [
+    'os_counts', 'status_counts', 'host_age_counts',
+    'agent_version_counts', 'created_year_counts', 'country_counts',
+]
+
+
+def synthetic_documents(hosts: int) -> list[dict]:
+    """
+    Build documents shaped like the ones stored by insert_data_operations.
+    """
+    countries = ['Nepal', 'Germany', 'United States', 'India', 'Japan']
+    documents = []
+    for index in range(hosts):
+        documents.append({
+            '_id': f'{index:024x}',
+            'host_id': str(index),
+            'hostname': f'host-{index}.example.com',
+            'ip_address': f'10.0.{index // 256 % 256}.{index % 256}',
+            'mac_address': '00:11:22:33:44:55',
+            'os': ['Linux', 'Windows', 'macOS'][index % 3],
+            'os_version': 'Ubuntu 22.04',
+            'last_seen': datetime(2024, 1, 1) + timedelta(days=index % 900),
+            'manufacturer': 'Dell Inc.',
+            'model': 'PowerEdge R640',
+            'location': f'City, Region {countries[index % len(countries)]}',
+            'agent_version': f'{index % 7}.{index % 3}.0',
+            'status': ['STATUS_ACTIVE', 'normal', 'STATUS_INACTIVE'][index % 3],
+            'created': datetime(2019 + index % 6, 1, 1),
+            'updated': datetime(2024, 1, 1),
+            'cloud_provider': 'AWS',
+            'first_seen': datetime(2019 + index % 6, 1, 1),
+        })
+    return documents
+
+
+def legacy_chart_counts(documents: list[dict]) -> dict[str, pd.Series]:
+    """
+    The chart counts as DataVisualizationHandler computed them before: every field of every
+    document in object columns and row-wise lambdas.
+    """
+    dataframe = pd.DataFrame(list(documents))
+    counts = {}
+    counts['os_counts'] = dataframe['os'].value_counts()
+    counts['status_counts'] = dataframe['status'].value_counts()
+    cutoff_date = datetime.now() - timedelta(days=30)
+    dataframe['host_age'] = dataframe['last_seen'].apply(
+        lambda x: 'Old' if x < cutoff_date else 'New',
+    )
+    counts['host_age_counts'] = dataframe['host_age'].value_counts()
+    dataframe['agent_version_major'] = dataframe['agent_version'].str.split(
+        '.', expand=True,
+    )[0]
+    counts['agent_version_counts'] = dataframe['agent_version_major'].value_counts()
+    dataframe['created_year'] = dataframe['created'].dt.year
+    counts['created_year_counts'] = dataframe['created_year'].value_counts().sort_index()
+    countries = {}
+    for country in pycountry.countries:
+        countries[country.name] = country.alpha_2
+    dataframe['country'] = dataframe['location'].str.split(',').str[-1]
+    dataframe['country'] = dataframe['country'].apply(lambda x: countries.get(x, x))
+    counts['country_counts'] = dataframe['country'].value_counts()
+    return counts
+
+
+def project(documents: list[dict]) -> list[dict]:
+    """
+    Keep only the chart columns of the documents, as the Mongo projection does on the server.
+    """
+    return [
+        {column: document.get(column) for column in CHART_COLUMNS}
+        for document in documents
+    ]
+
+
+def lean_chart_counts(documents: list[dict]) -> dict[str, pd.Series]:
+    """
+    The chart counts from the projected, categorical DataFrame with vectorized operations.
+    """
+    dataframe = load_chart_dataframe(iter(documents), 1000)
+    chart_data = DataFrameChartData(lambda: dataframe)
+    return {chart: getattr(chart_data, chart)() for chart in CHARTS}
+
+
+def measure(function, documents: list[dict]) -> tuple[dict[str, float], dict[str, pd.Series]]:
+    """
+    Measure the CPU time and, in a second traced run, the peak memory of computing the chart counts.
+    """
+    start = time.process_time()
+    counts = function(documents)
+    cpu_seconds = time.process_time() - start
+    tracemalloc.start()
+    function(documents)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'cpu_seconds': cpu_seconds, 'peak_mib': peak / 2 ** 20}, counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--hosts', type=int, default=200000)
+    args = parser.parse_args()
+
+    documents = synthetic_documents(args.hosts)
+    legacy, legacy_counts = measure(legacy_chart_counts, documents)
+    lean, lean_counts = measure(lean_chart_counts, project(documents))
+    for chart in CHARTS:
+        assert dict(legacy_counts[chart]) == dict(lean_counts[chart]), chart
+    print(json.dumps({'hosts': args.hosts, 'before': legacy, 'after': lean}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
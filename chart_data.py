@@ -0,0 +1,239 @@
+from __future__ import annotations
+
+from collections.abc import Callable
+from collections.abc import Iterable
+from datetime import datetime
+from datetime import timedelta
+from functools import lru_cache
+from typing import Any
+
+import numpy as np
+import pandas as pd
+import pycountry
+from pandas.api.types import is_datetime64_any_dtype
+from pandas.api.types import union_categoricals
+
+from databases import chunked
+from databases import MongoDBHandler
+
+# Columns of the collection the diagrams are drawn from
+CATEGORY_COLUMNS = ['os', 'status', 'agent_version', 'location']
+DATETIME_COLUMNS = ['created', 'last_seen']
+CHART_COLUMNS = CATEGORY_COLUMNS + DATETIME_COLUMNS
+
+
+@lru_cache(maxsize=None)
+def country_code_lookup() -> dict[str, str]:
+    """
+    Return the mapping of country name to its alpha 2 code.
+    The mapping is built once per process.
+    """
+    countries = {}
+    for country in pycountry.countries:
+        countries[country.name] = country.alpha_2
+    return countries
+
+
+def object_categorical(series: pd.Series) -> pd.Series:
+    """
+    Convert the series to a categorical whose categories are always of object dtype, so the categoricals
+    of all the batches can be unioned. A column missing from every document of a batch is all NaN,
+    whose inferred categories would be float64.
+    """
+    values = series.astype(object)
+    categories = pd.Index(values.dropna().unique(), dtype=object)
+    return values.astype(pd.CategoricalDtype(categories))
+
+
+def load_chart_dataframe(documents: Iterable[dict[str, Any]], batch_size: int) -> pd.DataFrame:
+    """
+    Build the DataFrame of the chart columns from the documents, `batch_size` documents at a time.
+    String columns are stored as categoricals and date columns as datetime64, so only one
+    small batch of documents is held as Python objects at any time.
+    """
+    frames = []
+    for batch in chunked(documents, batch_size):
+        frame = pd.DataFrame.from_records(batch, columns=CHART_COLUMNS)
+        for column in CATEGORY_COLUMNS:
+            frame[column] = object_categorical(frame[column])
+        for column in DATETIME_COLUMNS:
+            if not is_datetime64_any_dtype(frame[column]):
+                frame[column] = pd.to_datetime(frame[column], errors='coerce')
+        frames.append(frame)
+    if not frames:
+        return pd.DataFrame(columns=CHART_COLUMNS)
+    return pd.DataFrame({
+        **{
+            column: union_categoricals([frame[column] for frame in frames])
+            for column in CATEGORY_COLUMNS
+        },
+        **{
+            column: pd.concat([frame[column] for frame in frames], ignore_index=True)
+            for column in DATETIME_COLUMNS
+        },
+    })
+
+
+def count_values(series: pd.Series) -> pd.Series:
+    """
+    Count the values of the series, most frequent first, without the categories that do not occur.
+    """
+    counts = series.value_counts()
+    counts = counts[counts > 0]
+    counts.index = counts.index.astype(object)
+    return counts
+
+
+def regroup_counts(counts: pd.Series, key: Callable[[Any], Any]) -> pd.Series:
+    """
+    Map the values of the counts with the key and add up the counts of the values mapped together.
+    """
+    counts = counts.copy()
+    counts.index = [key(value) for value in counts.index]
+    return counts.groupby(level=0).sum().sort_values(ascending=False)
+
+
+def country_code(location: str) -> str:
+    """
+    Return the alpha 2 code of the country at the end of the location, or the raw name when it is unknown.
+    """
+    country = location.split(',')[-1]
+    return country_code_lookup().get(country, country)
+
+
+class DataFrameChartData:
+    """
+    Class to compute the host counts of the diagrams from the DataFrame of the collection.
+    """
+
+    def __init__(self, dataframe: Callable[[], pd.DataFrame]):
+        """
+        Initializing the DataFrameChartData class with a callable returning the DataFrame of the collection.
+        """
+        self._dataframe = dataframe
+
+    @property
+    def dataframe(self) -> pd.DataFrame:
+        """
+        Return the DataFrame of the collection.
+        """
+        return self._dataframe()
+
+    def os_counts(self) -> pd.Series:
+        """
+        Return the counts of hosts by operating system.
+        """
+        return count_values(self.dataframe['os'])
+
+    def status_counts(self) -> pd.Series:
+        """
+        Return the counts of hosts by status.
+        """
+        return count_values(self.dataframe['status'])
+
+    def host_age_counts(self) -> pd.Series:
+        """
+        Return the counts of old hosts, last seen more than 30 days ago, vs new hosts.
+        """
+        cutoff_date = datetime.now() - timedelta(days=30)
+        last_seen = pd.to_datetime(self.dataframe['last_seen'], errors='coerce')
+        host_age = pd.Series(
+            np.where(last_seen < cutoff_date, 'Old', 'New'), index=last_seen.index,
+        )
+        return count_values(host_age)
+
+    def agent_version_counts(self) -> pd.Series:
+        """
+        Return the counts of hosts by agent version major.
+        """
+        return regroup_counts(
+            count_values(self.dataframe['agent_version']),
+            lambda agent_version: agent_version.split('.')[0],
+        )
+
+    def created_year_counts(self) -> pd.Series:
+        """
+        Return the counts of hosts by year created, sorted by year.
+        """
+        created = pd.to_datetime(self.dataframe['created'], errors='coerce')
+        return count_values(created.dt.year).sort_index()
+
+    def country_counts(self) -> pd.Series:
+        """
+        Return the counts of hosts by country, using the alpha 2 code of the known country names.
+        """
+        return regroup_counts(count_values(self.dataframe['location']), country_code)
+
+
+class AggregationChartData:
+    """
+    Class to compute the host counts of the diagrams with a Mongo aggregation on the database server.
+    Only the grouped counts are transferred instead of the whole collection.
+    """
+
+    def __init__(self, mongo_handler: MongoDBHandler):
+        """
+        Initializing the AggregationChartData class with mongo db handler.
+        """
+        self.mongo_handler = mongo_handler
+        self._counts = None
+
+    @property
+    def counts(self) -> dict[str, list[dict]]:
+        """
+        Run the aggregation once and keep its result for all the diagrams.
+        """
+        if self._counts is None:
+            cutoff_date = datetime.now() - timedelta(days=30)
+            self._counts = self.mongo_handler.get_chart_counts(cutoff_date)
+        return self._counts
+
+    def series(self, name: str) -> pd.Series:
+        """
+        Return the counts of the given facet as a Series indexed by the grouped value.
+        """
+        documents = self.counts.get(name, [])
+        return pd.Series(
+            [document['count'] for document in documents],
+            index=[document['_id'] for document in documents],
+            name='count', dtype='int64',
+        )
+
+    def os_counts(self) -> pd.Series:
+        """
+        Return the counts of hosts by operating system.
+        """
+        return self.series('os')
+
+    def status_counts(self) -> pd.Series:
+        """
+        Return the counts of hosts by status.
+        """
+        return self.series('status')
+
+    def host_age_counts(self) -> pd.Series:
+        """
+        Return the counts of old hosts, last seen more than 30 days ago, vs new hosts.
+        """
+        return self.series('host_age')
+
+    def agent_version_counts(self) -> pd.Series:
+        """
+        Return the counts of hosts by agent version major.
+        """
+        return self.series('agent_version_major')
+
+    def created_year_counts(self) -> pd.Series:
+        """
+        Return the counts of hosts by year created, sorted by year.
+        """
+        return self.series('created_year').sort_index()
+
+    def country_counts(self) -> pd.Series:
+        """
+        Return the counts of hosts by country, using the alpha 2 code of the known country names.
+        """
+        return regroup_counts(
+            self.series('country'),
+            lambda country: country_code_lookup().get(country, country),
+        )
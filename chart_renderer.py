@@ -0,0 +1,236 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict
+from dataclasses import dataclass
+from typing import Any
+
+from config import settings
+from logger import Logger
+from metrics import metrics
+
+logger = Logger().get_logger()
+
+# File inside the diagram directory holding the content hash of every rendered diagram
+RENDER_CACHE_FILE = '.render_cache.json'
+
+
+@dataclass(frozen=True)
+class BarChart:
+    """
+    BarChart class to hold the data and labels of a bar plot diagram.
+    """
+    title: str
+    x_label: str
+    y_label: str
+    x_data: tuple[Any, ...]
+    y_data: tuple[int, ...]
+    x_ticks: tuple[Any, ...] | None = None
+
+
+@dataclass(frozen=True)
+class ChoroplethChart:
+    """
+    ChoroplethChart class to hold the data of a choropleth map of host counts by country.
+    """
+    title: str
+    countries: tuple[str, ...]
+    counts: tuple[int, ...]
+
+
+def render_bar(chart: BarChart, path: str):
+    """
+    Draw the bar plot on a Figure which is not registered with pyplot, so nothing keeps
+    a reference to it and it is released as soon as it has been saved.
+    """
+    from matplotlib.figure import Figure
+
+    figure = Figure(figsize=(8, 6))
+    axes = figure.subplots()
+    axes.bar(chart.x_data, chart.y_data)
+    axes.set_xlabel(chart.x_label)
+    axes.set_ylabel(chart.y_label)
+    axes.set_title(chart.title)
+    if chart.x_ticks is not None:
+        axes.set_xticks(chart.x_ticks)
+    figure.savefig(path)
+    figure.clear()
+
+
+def render_choropleth(chart: ChoroplethChart, path: str):
+    """
+    Draw the choropleth map and export it with the kaleido scope of the process,
+    which is started on the first export and reused afterwards.
+    """
+    import pandas as pd
+    import plotly.express as px
+
+    country_counts = pd.DataFrame(
+        {'country': chart.countries, 'count': chart.counts},
+    )
+    figure = px.choropleth(
+        country_counts,
+        locations='country',
+        locationmode='country names',
+        color='count',
+        color_continuous_scale=px.colors.sequential.Plasma,
+        title=chart.title,
+    )
+    figure.write_image(path)
+
+
+def chart_fingerprint(chart: BarChart | ChoroplethChart) -> str:
+    """
+    Return the content hash of the chart type, title, labels and data.
+    """
+    content = json.dumps(
+        [type(chart).__name__, asdict(chart)], sort_keys=True, default=str,
+    )
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def render_chart(chart: BarChart | ChoroplethChart, directory: str) -> str:
+    """
+    Render the chart to the directory with the title as file name in jpeg format.
+    The chart is drawn to a temporary file first which then atomically replaces the previous diagram.
+    Defined at module level so it can run in the worker processes of the renderer.
+    """
+    path = os.path.join(directory, f'{chart.title}.jpeg')
+    temporary_path = os.path.join(directory, f'.{chart.title}.{os.getpid()}.jpeg')
+    try:
+        if isinstance(chart, BarChart):
+            render_bar(chart, temporary_path)
+        else:
+            render_choropleth(chart, temporary_path)
+        os.replace(temporary_path, path)
+    finally:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+    return path
+
+
+def initialize_worker():
+    """
+    Select the non-interactive Agg backend in the worker processes before anything is drawn.
+    """
+    import matplotlib
+
+    matplotlib.use('Agg')
+
+
+class ChartRenderer:
+    """
+    Class to render the charts concurrently in long lived worker processes.
+    """
+
+    def __init__(self):
+        """
+        Initializing the ChartRenderer class with the number of worker processes.
+        The pool is created on first use and kept for the lifetime of the process.
+        """
+        self.workers = settings.RENDER_WORKERS
+        self.cache_enabled = settings.RENDER_CACHE_ENABLED
+        self._pool = None
+
+    @property
+    def pool(self) -> ProcessPoolExecutor:
+        """
+        Return the pool of worker processes, creating it on first use.
+        """
+        if self._pool is None:
+            # Fresh interpreters, so the workers inherit neither the Mongo client threads nor any pyplot state
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=initialize_worker,
+            )
+        return self._pool
+
+    def load_render_cache(self, directory: str) -> dict[str, str]:
+        """
+        Return the content hash of every diagram last rendered to the directory, by title.
+        """
+        try:
+            with open(os.path.join(directory, RENDER_CACHE_FILE)) as cache_file:
+                return json.load(cache_file)
+        except (OSError, ValueError):
+            return {}
+
+    def save_render_cache(self, directory: str, render_cache: dict[str, str]):
+        """
+        Atomically replace the render cache of the directory.
+        """
+        path = os.path.join(directory, RENDER_CACHE_FILE)
+        temporary_path = f'{path}.{os.getpid()}.tmp'
+        with open(temporary_path, 'w') as cache_file:
+            json.dump(render_cache, cache_file, indent=2, sort_keys=True)
+        os.replace(temporary_path, path)
+
+    def render(self, charts: list[BarChart | ChoroplethChart], directory: str) -> list[str]:
+        """
+        Render the charts to the directory and return the paths of the saved files.
+        Charts whose content hash matches the last rendered diagram are skipped.
+        Without worker processes configured the charts are rendered in this process.
+        A chart which fails to render is logged and does not stop the others.
+        """
+        # The worker processes keep the working directory they were started in
+        directory = os.path.abspath(directory)
+        render_cache = self.load_render_cache(directory) if self.cache_enabled else {}
+        fingerprints = {chart.title: chart_fingerprint(chart) for chart in charts}
+        skipped = [
+            chart.title for chart in charts
+            if render_cache.get(chart.title) == fingerprints[chart.title]
+            and os.path.exists(os.path.join(directory, f'{chart.title}.jpeg'))
+        ]
+        if skipped:
+            logger.info(f'Skipped rendering the unchanged diagrams: {skipped}')
+        charts = [chart for chart in charts if chart.title not in skipped]
+        if self.cache_enabled:
+            metrics.add_cache_lookups('render', len(skipped), len(charts))
+        if self.workers <= 0:
+            initialize_worker()
+            outcomes = []
+            for chart in charts:
+                try:
+                    outcomes.append((chart, render_chart(chart, directory), None))
+                except Exception as e:
+                    outcomes.append((chart, None, e))
+        else:
+            futures = [
+                (chart, self.pool.submit(render_chart, chart, directory))
+                for chart in charts
+            ]
+            outcomes = []
+            for chart, future in futures:
+                try:
+                    outcomes.append((chart, future.result(), None))
+                except Exception as e:
+                    outcomes.append((chart, None, e))
+        paths = []
+        for chart, path, error in outcomes:
+            if error is not None:
+                logger.error(
+                    f'Error during rendering the diagram {chart.title} due to reason: {error}',
+                )
+                continue
+            logger.info(f'Completed saving the diagram with file name {path}')
+            paths.append(path)
+            render_cache[chart.title] = fingerprints[chart.title]
+        if self.cache_enabled and paths:
+            self.save_render_cache(directory, render_cache)
+        return paths
+
+    def shutdown(self):
+        """
+        Stop the worker processes.
+        """
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+
+chart_renderer = ChartRenderer()
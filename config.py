@@ -16,13 +16,71 @@ class Settings:
     QUALYS_API_URL: str = os.getenv('QUALYS_API_URL')
     CROWDSTRIKE_API_URL: str = os.getenv('CROWDSTRIKE_API_URL')
     IP_ADDRESS_API_URL: str = os.getenv('IP_ADDRESS_API_URL')
+    GEO_CONCURRENCY: int = int(os.getenv('GEO_CONCURRENCY', '20'))
+    GEO_REQUEST_TIMEOUT: int = int(os.getenv('GEO_REQUEST_TIMEOUT', '10'))
+    GEO_CACHE_ENABLED: bool = os.getenv('GEO_CACHE_ENABLED', 'true').lower() == 'true'
+    GEO_CACHE_PATH: str = os.getenv('GEO_CACHE_PATH', 'cache/geo_locations.sqlite3')
+    GEO_CACHE_TTL: int = int(os.getenv('GEO_CACHE_TTL', '604800'))
+    GEO_CACHE_NEGATIVE_TTL: int = int(os.getenv('GEO_CACHE_NEGATIVE_TTL', '900'))
+    GEO_CACHE_MAX_SIZE: int = int(os.getenv('GEO_CACHE_MAX_SIZE', '1000000'))
+    GEO_CACHE_MEMORY_SIZE: int = int(os.getenv('GEO_CACHE_MEMORY_SIZE', '100000'))
     LOGGING_DIR: str = os.getenv('LOGGING_DIR', 'logging')
     SKIP: int = int(os.getenv('SKIP'))
     LIMIT: int = int(os.getenv('LIMIT'))
+    FETCH_PAGINATED: bool = os.getenv('FETCH_PAGINATED', 'false').lower() == 'true'
+    FETCH_PAGE_CONCURRENCY: int = int(os.getenv('FETCH_PAGE_CONCURRENCY', '4'))
+    FETCH_MAX_CONCURRENCY: int = int(os.getenv('FETCH_MAX_CONCURRENCY', '16'))
+    FETCH_LATENCY_TARGET: float = float(os.getenv('FETCH_LATENCY_TARGET', '5'))
+    FETCH_MAX_RETRIES: int = int(os.getenv('FETCH_MAX_RETRIES', '5'))
+    FETCH_BACKOFF_BASE: float = float(os.getenv('FETCH_BACKOFF_BASE', '0.5'))
+    FETCH_BACKOFF_MAX: float = float(os.getenv('FETCH_BACKOFF_MAX', '30'))
+    FETCH_TYPED_DECODE: bool = os.getenv('FETCH_TYPED_DECODE', 'true').lower() == 'true'
+    SPOOL_ENABLED: bool = os.getenv('SPOOL_ENABLED', 'false').lower() == 'true'
+    SPOOL_DIR: str = os.getenv('SPOOL_DIR', 'spool')
+    SPOOL_SEGMENT_RECORDS: int = int(os.getenv('SPOOL_SEGMENT_RECORDS', '50000'))
+    SPOOL_KEEP_RUNS: int = int(os.getenv('SPOOL_KEEP_RUNS', '10'))
+    REPLAY_RUN: str = os.getenv('REPLAY_RUN', '')
+    PIPELINE_MODE: str = os.getenv('PIPELINE_MODE', 'batch')
+    STREAM_QUEUE_SIZE: int = int(os.getenv('STREAM_QUEUE_SIZE', '8'))
+    COMPACT_HOST_INFO: bool = os.getenv('COMPACT_HOST_INFO', 'true').lower() == 'true'
+    NORMALIZE_WORKERS: int = int(os.getenv('NORMALIZE_WORKERS', '1'))
+    NORMALIZE_CHUNK_SIZE: int = int(os.getenv('NORMALIZE_CHUNK_SIZE', '5000'))
+    NORMALIZE_PARALLEL_THRESHOLD: int = int(os.getenv('NORMALIZE_PARALLEL_THRESHOLD', '20000'))
+    SOURCE_ADAPTERS_PATH: str = os.getenv('SOURCE_ADAPTERS_PATH', '')
+    INCREMENTAL_SYNC: bool = os.getenv('INCREMENTAL_SYNC', 'false').lower() == 'true'
+    FULL_SYNC_INTERVAL: int = int(os.getenv('FULL_SYNC_INTERVAL', '3600'))
+    SCHEDULER_MODE: str = os.getenv('SCHEDULER_MODE', 'schedule')
+    SCHEDULE_INTERVAL: int = int(os.getenv('SCHEDULE_INTERVAL', '30'))
+    SCHEDULE_MAX_INTERVAL: int = int(os.getenv('SCHEDULE_MAX_INTERVAL', '600'))
+    SCHEDULE_JITTER: float = float(os.getenv('SCHEDULE_JITTER', '0.1'))
+    SCHEDULE_ADAPTIVE: bool = os.getenv('SCHEDULE_ADAPTIVE', 'true').lower() == 'true'
+    SNAPSHOT_ENABLED: bool = os.getenv('SNAPSHOT_ENABLED', 'false').lower() == 'true'
+    SNAPSHOT_DIR: str = os.getenv('SNAPSHOT_DIR', 'snapshots')
+    VISUALIZER_SOURCE: str = os.getenv('VISUALIZER_SOURCE', 'aggregate')
+    RENDER_WORKERS: int = int(os.getenv('RENDER_WORKERS', '2'))
+    RENDER_CACHE_ENABLED: bool = os.getenv('RENDER_CACHE_ENABLED', 'true').lower() == 'true'
+    HTTP_POOL_LIMIT: int = int(os.getenv('HTTP_POOL_LIMIT', '100'))
+    HTTP_DNS_CACHE_TTL: int = int(os.getenv('HTTP_DNS_CACHE_TTL', '300'))
+    HTTP_KEEPALIVE_TIMEOUT: int = int(os.getenv('HTTP_KEEPALIVE_TIMEOUT', '60'))
+    METRICS_PATH: str = os.getenv('METRICS_PATH', 'metrics/pipeline.prom')
+    PROFILE_MODE: str = os.getenv('PROFILE_MODE', '')
+    PROFILE_DIR: str = os.getenv('PROFILE_DIR', 'profiles')
     MONGO_DB_PORT: int = int(os.getenv('MONGO_DB_PORT'))
     MONGO_DB_HOST: str = str(os.getenv('MONGO_DB_HOST'))
     MONGO_DB_NAME: str = str(os.getenv('MONGO_DB_NAME'))
     MONGO_DB_COLLECTION_NAME: str = str(os.getenv('MONGO_DB_COLLECTION_NAME'))
+    MONGO_DB_SYNC_STATE_COLLECTION_NAME: str = os.getenv('MONGO_DB_SYNC_STATE_COLLECTION_NAME', 'sync_state')
+    MONGO_MAX_POOL_SIZE: int = int(os.getenv('MONGO_MAX_POOL_SIZE', '100'))
+    MONGO_BATCH_SIZE: int = int(os.getenv('MONGO_BATCH_SIZE', '1000'))
+    MONGO_WRITE_WORKERS: int = int(os.getenv('MONGO_WRITE_WORKERS', '4'))
+    WORK_QUEUE_PATH: str = os.getenv('WORK_QUEUE_PATH', 'queue/work.sqlite3')
+    WORK_PARTITIONS: int = int(os.getenv('WORK_PARTITIONS', '64'))
+    WORK_UNIT_RECORDS: int = int(os.getenv('WORK_UNIT_RECORDS', '5000'))
+    WORK_LEASE_SECONDS: int = int(os.getenv('WORK_LEASE_SECONDS', '300'))
+    WORK_MAX_ATTEMPTS: int = int(os.getenv('WORK_MAX_ATTEMPTS', '5'))
+    WORK_POLL_INTERVAL: float = float(os.getenv('WORK_POLL_INTERVAL', '1'))
+    WORK_STALL_LEASES: int = int(os.getenv('WORK_STALL_LEASES', '3'))
+    LAST_SEEN_REFRESH_INTERVAL: int = int(os.getenv('LAST_SEEN_REFRESH_INTERVAL', '86400'))
 
 
 settings = Settings()
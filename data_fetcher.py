@@ -1,12 +1,24 @@
 from __future__ import annotations
 
 import asyncio
+from collections import deque
+from collections.abc import AsyncIterator
+from contextlib import aclosing
+from datetime import datetime
 from typing import Any
 
 import aiohttp
+from dateutil.parser import isoparse
 
 from config import settings
 from logger import Logger
+from metrics import metrics
+from payload_decoder import payload_decoder
+from request_controller import request_controller
+from request_controller import THROTTLE_STATUSES
+from resources import resources
+from source_adapters import source_adapters
+from spool import payload_spool
 
 logger = Logger().get_logger()
 
@@ -25,52 +37,323 @@ class DataFetcher:
         self.crowdstrike_url = settings.CROWDSTRIKE_API_URL
         self.skip = settings.SKIP
         self.limit = settings.LIMIT
+        self.paginated = settings.FETCH_PAGINATED
+        self.page_concurrency = max(1, settings.FETCH_PAGE_CONCURRENCY)
+        # The connection pool of a source fits the most requests its adaptive limit lets in flight
+        self.connection_limit = request_controller.max_concurrency
+
+    @property
+    def sources(self) -> dict[str, str]:
+        """
+        Return the mapping of source name to its API url, including the sources added through
+        the source adapters configuration.
+        """
+        return {
+            'qualys': self.qualys_url,
+            'crowdstrike': self.crowdstrike_url,
+            **source_adapters.configured_sources(),
+        }
+
+    def record_timestamp(self, source: str, record: dict[str, Any]) -> datetime | None:
+        """
+        Return the time the raw record of the source was last updated at, without timezone information.
+        """
+        value = source_adapters[source].accessor('updated')(record)
+        try:
+            return isoparse(value).replace(tzinfo=None)
+        except (TypeError, ValueError):
+            return None
+
+    def filter_since(self, source: str, records: list[dict[str, Any]] | None, watermark: datetime | None) -> list[dict[str, Any]] | None:
+        """
+        Keep only the raw records of the source which were updated after the watermark.
+        Records without a readable timestamp are kept so they are never skipped silently.
+        """
+        if not records or watermark is None:
+            return records
+        newer_records = []
+        for record in records:
+            timestamp = self.record_timestamp(source, record)
+            if timestamp is None or timestamp > watermark:
+                newer_records.append(record)
+        logger.info(
+            f'Kept {len(newer_records)} of {len(records)} {source} records newer than {watermark}',
+        )
+        return newer_records
+
+    def latest_timestamp(self, source: str, records: list[dict[str, Any]] | None) -> datetime | None:
+        """
+        Return the newest update time among the raw records of the source.
+        """
+        timestamps = (
+            self.record_timestamp(source, record) for record in records or []
+        )
+        return max((timestamp for timestamp in timestamps if timestamp), default=None)
+
+    def source_of(self, url: str) -> str:
+        """
+        Return the name of the source with the given API url.
+        """
+        return next(
+            (name for name, source_url in self.sources.items() if source_url == url), url,
+        )
 
     async def fetch_data(self, session: aiohttp.ClientSession, url: str, params: dict[str, Any]) -> dict[str, Any] | None:
         """
         Fetches data from the given URL using the provided session and parameters.
         Returns JSON response if status code is 200 else None value is written
+        The records are decoded against the schema of the source, keeping only the fields the normalizers read.
+        Throttled, server error and connection error responses are retried with backoff, honoring
+        the Retry-After header, and the requests in flight to the source are bounded by its adaptive limit.
+        The latency reported to the limiter starts once the request got its connection, so waiting for
+        a free connection of the pool is not taken for a slow upstream.
         """
-        async with session.post(
-            url, headers={'token': self.api_key},
-            params=params,
-        ) as response:
-            if response.status == 200:
-                data = await response.json()
-                return data
-            else:
-                error_message = await response.content.read()
+        source = self.source_of(url)
+        limiter = request_controller.limiter(source)
+        loop = asyncio.get_running_loop()
+        attempt = 0
+        while True:
+            status = None
+            retry_after = None
+            await limiter.acquire()
+            started_at = loop.time()
+            timing: dict[str, float] = {}
+            try:
+                async with session.post(
+                    url, headers={'token': self.api_key},
+                    params=params, trace_request_ctx=timing,
+                ) as response:
+                    status = response.status
+                    if status == 200:
+                        body = await response.read()
+                    else:
+                        retry_after = response.headers.get('Retry-After')
+                        error_message = await response.content.read()
+                        error_reason = {
+                            'url': str(
+                                response.url,
+                            ), 'status_code': status, 'error': error_message.decode('utf-8', 'replace'),
+                        }
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                # Also when the connection broke while reading the body of a 200 response
+                status = None
                 error_reason = {
-                    'url': str(
-                        response.url,
-                    ), 'status_code': response.status, 'error': error_message.decode('utf-8'),
+                    'url': url, 'params': params, 'error': f'Request failed: {e!r}',
                 }
+            finally:
+                await limiter.release(
+                    loop.time() - timing.get('connected_at', started_at), throttled=status in THROTTLE_STATUSES,
+                )
+            if status == 200:
+                metrics.add_fetched_bytes(source, len(body))
+                if payload_spool.spooling:
+                    # The spool keeps every field of the raw pages
+                    return payload_decoder.any_decoder.decode(body)
+                return payload_decoder.decode_page(source, body)
+            if not request_controller.should_retry(status, attempt):
                 logger.error(error_reason)
                 return None
+            delay = request_controller.retry_delay(attempt, retry_after)
+            attempt += 1
+            logger.info(
+                f'Retrying {source} request {params} in {delay:.2f} seconds, attempt {attempt} after {error_reason}',
+            )
+            await asyncio.sleep(delay)
 
-    async def fetch_all_data(self) -> tuple[dict[str, Any] | None, dict[str, Any] | None]:
+    async def fetch_pages(self, session: aiohttp.ClientSession, url: str, incomplete: set[str] | None = None) -> AsyncIterator[list[dict[str, Any]]]:
+        """
+        Walks the skip/limit pagination of the given URL and yields every page in order.
+        As many page requests are kept in flight as the adaptive limit of the source allows,
+        starting at `page_concurrency`.
+        The walk stops at the first empty, short or failed page and the outstanding
+        requests beyond it are cancelled. A page which failed after its retries adds the source
+        to `incomplete`, since the records of the pages after it were not fetched.
+        """
+        source = self.source_of(url)
+        limiter = request_controller.limiter(source)
+        in_flight: deque[asyncio.Task] = deque()
+        next_skip = self.skip
+        try:
+            while True:
+                while len(in_flight) < limiter.concurrency:
+                    params = {'skip': next_skip, 'limit': self.limit}
+                    in_flight.append(
+                        asyncio.create_task(
+                            self.fetch_data(session, url, params=params),
+                        ),
+                    )
+                    next_skip += self.limit
+                skip = next_skip - len(in_flight) * self.limit
+                page = await in_flight.popleft()
+                if page is None:
+                    logger.error(
+                        f'Stopped walking the {source} pages at skip {skip} after a failed page, '
+                        'the records from there on are missing from this run',
+                    )
+                    if incomplete is not None:
+                        incomplete.add(source)
+                    break
+                if not page:
+                    break
+                yield page
+                if len(page) < self.limit:
+                    break
+        finally:
+            for task in in_flight:
+                task.cancel()
+            await asyncio.gather(*in_flight, return_exceptions=True)
+
+    async def stream_api_pages(self, incomplete: set[str] | None = None) -> AsyncIterator[tuple[str, list[dict[str, Any]]]]:
+        """
+        Walks the pagination of both Qualys and CrowdStrike APIs concurrently over the pooled session
+        of each source and yields (source, page) tuples as soon as each page arrives.
+        The sources whose walk stopped at a failed page are added to `incomplete`.
+        """
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.page_concurrency * 2)
+        done = object()
+
+        async def pump(session: aiohttp.ClientSession, source: str, url: str):
+            try:
+                async with aclosing(self.fetch_pages(session, url, incomplete)) as pages:
+                    async for page in pages:
+                        await queue.put((source, page))
+            except Exception:
+                await queue.put((source, done))
+                raise
+            await queue.put((source, done))
+
+        tasks = [
+            asyncio.create_task(
+                pump(
+                    resources.http_session(source, limit=self.connection_limit),
+                    source, url,
+                ),
+            )
+            for source, url in self.sources.items()
+        ]
+        try:
+            remaining = len(tasks)
+            while remaining:
+                source, page = await queue.get()
+                if page is done:
+                    remaining -= 1
+                    continue
+                yield source, page
+            # Surface any exception raised while walking the pages
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def replay_pages(self) -> AsyncIterator[tuple[str, list[dict[str, Any]]]]:
+        """
+        Reads the pages of both sources from the replayed spool run and yields (source, page) tuples
+        of `limit` records. The segments are read in a worker thread to keep the event loop responsive.
+        """
+        for source in self.sources:
+            pages = payload_spool.iter_pages(source, self.limit)
+            while (page := await asyncio.to_thread(next, pages, None)) is not None:
+                yield source, page
+
+    async def stream_all_pages(self, incomplete: set[str] | None = None) -> AsyncIterator[tuple[str, list[dict[str, Any]]]]:
+        """
+        Yields the (source, page) tuples of both sources from the APIs, or from disk when a spooled run is replayed.
+        With spooling enabled every page fetched from the APIs is written to the spool before it is yielded.
+        The sources which could not be fetched completely are added to `incomplete`, and then the spooled
+        run is left incomplete so it is never replayed as a whole inventory.
+        """
+        if payload_spool.replaying:
+            async for source, page in self.replay_pages():
+                yield source, page
+            return
+        incomplete = set() if incomplete is None else incomplete
+        spool_writer = payload_spool.start_run()
+        completed = False
+        try:
+            async with aclosing(self.stream_api_pages(incomplete)) as pages:
+                async for source, page in pages:
+                    if spool_writer is not None:
+                        await asyncio.to_thread(spool_writer.write_page, source, page)
+                    yield source, page
+            completed = not incomplete
+        finally:
+            if spool_writer is not None:
+                if completed:
+                    spool_writer.close()
+                else:
+                    spool_writer.abort()
+
+    async def fetch_all_pages(self, incomplete: set[str] | None = None) -> tuple[list[dict[str, Any]], list[dict[str, Any]]]:
+        """
+        Collects every page of both Qualys and CrowdStrike APIs into one list per source.
+        The sources which could not be fetched completely are added to `incomplete`.
+        """
+        collected: dict[str, list[dict[str, Any]]] = {
+            source: [] for source in self.sources
+        }
+        async for source, page in self.stream_all_pages(incomplete):
+            collected[source].extend(page)
+        logger.info(
+            f'Fetched {len(collected["qualys"])} Qualys and {len(collected["crowdstrike"])} CrowdStrike records',
+        )
+        for source in collected.keys() - {'qualys', 'crowdstrike'}:
+            logger.error(
+                f'Dropped {len(collected[source])} {source} records, the sources added through the source adapters '
+                'configuration are processed in the streaming pipeline and the coordinator/worker mode',
+            )
+        return collected['qualys'], collected['crowdstrike']
+
+    async def fetch_all_data(self, since: dict[str, datetime] | None = None, incomplete: set[str] | None = None) -> tuple[dict[str, Any] | None, dict[str, Any] | None]:
         """
         Fetches data from both Qualys and CrowdStrike APIs concurrently with respective url and query params
         Recieves the qualys data and crowdstrike data to the respective variables.
+        In paginated mode every page of both sources is fetched instead of a single skip/limit window.
+        When a spooled run is replayed, all its records are read from disk instead of the APIs.
+        In incremental mode, when the per source watermarks are given, only the records newer than them are returned.
+        The sources whose request or one of whose pages failed after the retries are added to `incomplete`.
         """
-        query_params = {
-            'skip': self.skip,
-            'limit': self.limit,
-        }
-        async with aiohttp.ClientSession() as session:
+        if self.paginated or payload_spool.replaying:
+            qualys_data, crowdstrike_data = await self.fetch_all_pages(incomplete)
+        else:
+            query_params = {
+                'skip': self.skip,
+                'limit': self.limit,
+            }
             qualys_task = asyncio.create_task(
                 self.fetch_data(
-                    session, self.qualys_url, params=query_params,
+                    resources.http_session('qualys', limit=self.connection_limit), self.qualys_url, params=query_params,
                 ),
             )
             crowdstrike_task = asyncio.create_task(
                 self.fetch_data(
-                    session, self.crowdstrike_url, params=query_params,
+                    resources.http_session('crowdstrike', limit=self.connection_limit), self.crowdstrike_url, params=query_params,
                 ),
             )
             qualys_data = await qualys_task
             crowdstrike_data = await crowdstrike_task
-            return qualys_data, crowdstrike_data
+            if incomplete is not None:
+                incomplete.update(
+                    source for source, data in (('qualys', qualys_data), ('crowdstrike', crowdstrike_data))
+                    if data is None
+                )
+            spool_writer = payload_spool.start_run()
+            if spool_writer is not None:
+                for source, data in (('qualys', qualys_data), ('crowdstrike', crowdstrike_data)):
+                    if data:
+                        spool_writer.write_page(source, data)
+                if qualys_data is None or crowdstrike_data is None:
+                    spool_writer.abort()
+                else:
+                    spool_writer.close()
+        if since is not None:
+            qualys_data = self.filter_since(
+                'qualys', qualys_data, since.get('qualys'),
+            )
+            crowdstrike_data = self.filter_since(
+                'crowdstrike', crowdstrike_data, since.get('crowdstrike'),
+            )
+        return qualys_data, crowdstrike_data
 
 
 data_fetcher = DataFetcher()
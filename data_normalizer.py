@@ -1,13 +1,21 @@
 from __future__ import annotations
 
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass
+from dataclasses import fields
+from datetime import datetime
+from itertools import repeat
 from typing import Any
 
-import requests
 from dateutil.parser import isoparse
 
 from config import settings
+from location_cache import location_cache
 from logger import Logger
+from resources import resources
+from source_adapters import source_adapters
 
 logger = Logger().get_logger()
 
@@ -48,13 +56,74 @@ class HostInfo:
             self.first_seen = isoparse(self.first_seen).replace(tzinfo=None)
 
 
+def parse_timestamp(value: str) -> datetime:
+    """
+    Parse an ISO 8601 timestamp into a datetime without timezone information.
+    The C implemented datetime.fromisoformat is tried first and dateutil isoparse
+    is kept as fallback for the formats it does not understand.
+    """
+    try:
+        parsed = datetime.fromisoformat(
+            value[:-1] + '+00:00' if value.endswith('Z') else value,
+        )
+    except ValueError:
+        parsed = isoparse(value)
+    return parsed.replace(tzinfo=None)
+
+
+@dataclass(slots=True)
+class CompactHostInfo:
+    """
+    Slotted variant of HostInfo without a per instance __dict__.
+    Each distinct timestamp string of a host is parsed only once.
+    """
+    host_id: str
+    hostname: str
+    ip_address: str
+    mac_address: str
+    os: str
+    os_version: str
+    last_seen: str
+    manufacturer: str
+    model: str
+    location: str
+    agent_version: str
+    status: str
+    created: str
+    updated: str
+    cloud_provider: str
+    first_seen: str
+
+    def __post_init__(self):
+        """
+        Converts string date attributes to datetime objects without timezone information.
+        created/first_seen and last_seen/updated usually come from the same field, so
+        the parsed value of a repeated string is reused.
+        """
+        parsed = {}
+        for name in ('last_seen', 'created', 'updated', 'first_seen'):
+            value = getattr(self, name)
+            if isinstance(value, str):
+                if value not in parsed:
+                    parsed[value] = parse_timestamp(value)
+                setattr(self, name, parsed[value])
+
+
 class DataNormalizer:
     """
     Class to normalize data from different sources.
     """
 
     def __init__(self):
-        pass
+        """
+        Initializing the DataNormalizer class with the class used to hold the host information.
+        Normalization is serial by default, NORMALIZE_WORKERS=0 uses one process per CPU.
+        """
+        self.host_class = CompactHostInfo if settings.COMPACT_HOST_INFO else HostInfo
+        self.field_names = tuple(field.name for field in fields(self.host_class))
+        self.workers = settings.NORMALIZE_WORKERS or os.cpu_count() or 1
+        self.chunk_size = max(1, settings.NORMALIZE_CHUNK_SIZE)
+        self.parallel_threshold = settings.NORMALIZE_PARALLEL_THRESHOLD
 
     def get_nested(self, data: dict[str, Any] | list[dict[str, Any]], keys: list[Any],  default: Any = '') -> Any:
         """
@@ -73,111 +142,131 @@ class DataNormalizer:
                 return default
         return data
 
+    def address_from_response(self, data: Any, url: str, status_code: int) -> str:
+        """
+        Extracting the address from the IP address API response.
+        On sucessful response, city, region and country_name are joined
+        On error response, or a response which is not a JSON object, empty string is passed back
+        """
+        if not isinstance(data, dict):
+            error_reason = {
+                'url': url,
+                'status_code': status_code,
+                'error': f'Unexpected response {type(data).__name__}, expected a JSON object',
+            }
+            logger.error(
+                f'Error during fetching address from IP address due to reason: {error_reason}',
+            )
+            return ''
+        if data.get('error', False):
+            error_reason = {
+                'url': url,
+                'status_code': status_code,
+                'error': data.get('reason', 'Unknown error'),
+            }
+            logger.error(
+                f'Error during fetching address from IP address due to reason: {error_reason}',
+            )
+            return ''
+        return f'{data.get("city", "Unknown")}, {data.get("region", "Unknown")} {data.get("country_name", "Unknown")}'
+
     def fetch_address_from_ip(self, ip_address: str) -> str | None:
         """
         Fetching the address from the IP address.
         On sucessful response, city, region and country_name are extracted
         On error response, empty string is passed back
+        Addresses are served from the location cache when they were resolved recently.
         """
+        cached_address = location_cache.get(ip_address)
+        if cached_address is not None:
+            return cached_address
+        import requests
+
         logger.info('Starting to fetch the address from the IP address')
         url = settings.IP_ADDRESS_API_URL.format(ip_address=ip_address)
         try:
-            response = requests.Session().post(url)
+            response = resources.requests_session.post(url)
             # Raises a HTTPError if the HTTP request returned an unsuccessful status code
             response.raise_for_status()
-            data = response.json()
-            if data.get('error', False):
-                error_reason = {
-                    'url': response.url,
-                    'status_code': response.status_code,
-                    'error': data.get('reason', 'Unknown error'),
-                }
-                logger.error(
-                    f'Error during fetching address from IP address due to reason: {error_reason}',
-                )
-                return ''
-            full_address = f'{data.get("city", "Unknown")}, {data.get("region", "Unknown")} {data.get("country_name", "Unknown")}'
+            full_address = self.address_from_response(
+                response.json(), response.url, response.status_code,
+            )
             logger.info('Finished fetching the address from the IP address')
-            return full_address
         except requests.RequestException as e:
             error_reason = {
-                'url': response.url,
+                'url': url,
                 'error': f'Request failed: {e}',
             }
             logger.error(
                 f'Error during fetching address from IP address due to reason: {error_reason}',
             )
-            return ''
+            full_address = ''
+        location_cache.set(ip_address, full_address)
+        return full_address
+
+    def normalize_records(self, source: str, data: list[dict[str, Any]], locations: dict[str, str] | None = None) -> list[HostInfo]:
+        """
+        Normalizing the data of the given source into HostInfo objects with the compiled extractor of its adapter.
+        For sources whose location is resolved from an IP address, the locations already resolved are
+        looked up from the given mapping instead of calling the IP address API per host.
+        """
+        adapter = source_adapters[source]
+        extract = adapter.host_extractor(self.field_names)
+        if adapter.geo is None:
+            location_of = None
+        elif locations is None:
+            location_of = self.fetch_address_from_ip
+        else:
+            def location_of(ip_address: str | None) -> str:
+                return locations.get(ip_address, '')
+        logger.info(f'Starting to normalize {adapter.label} data into HostInfo objects')
+        host_class = self.host_class
+        normalized_data = [extract(item, host_class, location_of) for item in data]
+        logger.info(f'Completed normalizing {adapter.label} data into HostInfo objects')
+        return normalized_data
 
     def normalize_qualys_data(self, data: list[dict[str, Any]]) -> list[HostInfo]:
         """
         Normalizing Qualys data into HostInfo objects
         """
-        normalized_data = []
-        logger.info('Starting to normalize Qualys data into HostInfo objects')
-        for item in data:
-            normalized_item = HostInfo(
-                host_id=str(item['_id']),
-                hostname=item.get('dnsHostName', ''),
-                ip_address=item.get('address', ''),
-                mac_address=self.get_nested(
-                    item, [
-                        'networkInterface', 'list', 0,
-                        'HostAssetInterface', 'macAddress',
-                    ],
-                ),
-                os_version=item.get('os', ''),
-                os=self.get_nested(item, ['agentInfo', 'platform']),
-                last_seen=item.get('modified', ''),
-                manufacturer=item.get('manufacturer', ''),
-                model=item.get('model', ''),
-                location=self.get_nested(item, ['agentInfo', 'location']),
-                agent_version=self.get_nested(
-                    item, ['agentInfo', 'agentVersion'],
-                ),
-                status=self.get_nested(item, ['agentInfo', 'status']),
-                created=item.get('created', ''),
-                updated=item.get('modified', ''),
-                cloud_provider=item.get('cloudProvider'),
-                first_seen=item.get('created', ''),
-            )
-            normalized_data.append(normalized_item)
-        logger.info('Completed normalizing Qualys data into HostInfo objects')
-        return normalized_data
+        return self.normalize_records('qualys', data)
 
-    def normalize_crowdstrike_data(self, data: list[dict[str, Any]]) -> list[HostInfo]:
+    def normalize_crowdstrike_data(self, data: list[dict[str, Any]], locations: dict[str, str] | None = None) -> list[HostInfo]:
         """
         Normalizing CrowdStrike data into HostInfo objects
+        When the locations of the external IP addresses are already resolved, they are
+        looked up from the given mapping instead of calling the IP address API per host.
         """
-        normalized_data = []
-        logger.info(
-            'Starting to normalize CrowdStrike data into HostInfo objects',
-        )
-        for item in data:
-            normalized_item = HostInfo(
-                host_id=item.get('device_id', ''),
-                hostname=item.get('hostname', ''),
-                ip_address=item.get('local_ip', ''),
-                mac_address=item.get('mac_address'),
-                os=item.get('platform_name', ''),
-                os_version=item.get('os_version'),
-                last_seen=item.get('last_seen', ''),
-                manufacturer=item.get('system_manufacturer'),
-                model=item.get('system_product_name'),
-                location=self.fetch_address_from_ip(
-                    ip_address=item.get('external_ip'),
-                ),
-                agent_version=item.get('agent_version'),
-                status=item.get('status', ''),
-                created=item.get('first_seen', ''),
-                updated=item.get('last_seen', ''),
-                cloud_provider=item.get('service_provider'),
-                first_seen=item.get('first_seen', ''),
-            )
-            normalized_data.append(normalized_item)
+        return self.normalize_records('crowdstrike', data, locations=locations)
+
+    def normalize_source(self, source: str, data: list[dict[str, Any]], locations: dict[str, str] | None = None) -> list[HostInfo]:
+        """
+        Normalizing the data of the given source into HostInfo objects.
+        Payloads of at least `parallel_threshold` records are split into chunks of `chunk_size`
+        and normalized in the process pool, smaller ones stay in this process.
+        The output is in the same order as the serial path.
+        """
+        if self.workers <= 1 or len(data) < self.parallel_threshold:
+            return normalize_chunk(source, data, locations)
         logger.info(
-            'Completed normalizing CrowdStrike data into HostInfo objects',
+            f'Starting to normalize {len(data)} {source} records in {self.workers} processes',
         )
+        chunks = [
+            data[start:start + self.chunk_size]
+            for start in range(0, len(data), self.chunk_size)
+        ]
+        ip_address_of = source_adapters[source].accessor('geo') if source_adapters[source].geo else None
+        chunk_locations = [
+            None if locations is None else {
+                ip_address_of(item): locations.get(ip_address_of(item), '')
+                for item in chunk
+            }
+            for chunk in chunks
+        ] if ip_address_of else repeat(None)
+        normalized_data = []
+        for hosts in get_process_pool(self.workers).map(normalize_chunk, repeat(source), chunks, chunk_locations):
+            normalized_data.extend(hosts)
+        logger.info(f'Completed normalizing {source} records in the process pool')
         return normalized_data
 
     def remove_duplicates(self, final_normalized_data: list[HostInfo]) -> list[HostInfo]:
@@ -203,4 +292,31 @@ class DataNormalizer:
         return list(unique_hosts.values())
 
 
+_process_pool: ProcessPoolExecutor | None = None
+
+
+def get_process_pool(workers: int) -> ProcessPoolExecutor:
+    """
+    Return the process pool used for parallel normalization.
+    The pool is created on first use and kept for the lifetime of the process
+    so the worker start up cost is paid once. The workers are spawned instead of forked, since the pool
+    is created from a worker thread of a process which already runs the pymongo monitor threads
+    and holds SQLite and aiohttp state.
+    """
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+        )
+    return _process_pool
+
+
+def normalize_chunk(source: str, chunk: list[dict[str, Any]], locations: dict[str, str] | None = None) -> list[HostInfo]:
+    """
+    Normalizing one chunk of raw records of the given source.
+    Defined at module level so it can run in the worker processes of the pool.
+    """
+    return DataNormalizer().normalize_records(source, chunk, locations=locations)
+
+
 data_normalizer = DataNormalizer()
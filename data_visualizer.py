@@ -1,15 +1,18 @@
 from __future__ import annotations
 
 import os
-from datetime import datetime
-from datetime import timedelta
 
-import matplotlib.pyplot as plt
 import pandas as pd
-import plotly.express as px
-import pycountry
 
-from databases import MongoDBHandler
+from chart_data import AggregationChartData
+from chart_data import CHART_COLUMNS
+from chart_data import DataFrameChartData
+from chart_data import load_chart_dataframe
+from chart_renderer import BarChart
+from chart_renderer import chart_renderer
+from chart_renderer import ChoroplethChart
+from config import settings
+from databases import mongo_db
 from logger import Logger
 
 logger = Logger().get_logger()
@@ -24,8 +27,12 @@ class DataVisualizationHandler:
         """
         Initializing the DataVisualizationHandler class with mongo db handler and dataframe.
         """
-        self.mongo_handler = MongoDBHandler()
+        self.mongo_handler = mongo_db
         self._dataframe = None
+        if settings.VISUALIZER_SOURCE == 'aggregate':
+            self.chart_data = AggregationChartData(self.mongo_handler)
+        else:
+            self.chart_data = DataFrameChartData(lambda: self.dataframe)
 
     def __call__(self):
         """
@@ -41,148 +48,135 @@ class DataVisualizationHandler:
     @property
     def dataframe(self) -> pd.DataFrame:
         """
-        Check if dataframe exists or not. If not, then generate the dataframe via fetching the data from mongodb
-        and use pandas libraries to generate the dataframe type data.
+        Check if dataframe exists or not. If not, then generate the dataframe via streaming the columns
+        used by the diagrams from mongodb in batches into categorical and datetime columns.
+        With VISUALIZER_SOURCE=snapshot the columns are read from the Parquet snapshot instead,
+        falling back to mongodb when there is no complete snapshot.
+        The snapshot module is only imported in that case.
         """
+        if self._dataframe is None and settings.VISUALIZER_SOURCE == 'snapshot':
+            from snapshot import inventory_snapshot
+
+            try:
+                self._dataframe = inventory_snapshot.read(CHART_COLUMNS)
+            except (OSError, ValueError) as e:
+                logger.error(f'Error during reading the snapshot due to reason: {e!r}, reading mongodb instead')
         if self._dataframe is None:
-            data = self.mongo_handler.get_all_data()
-            self._dataframe = pd.DataFrame(data)
+            documents = self.mongo_handler.iter_documents(
+                CHART_COLUMNS, self.mongo_handler.batch_size,
+            )
+            self._dataframe = load_chart_dataframe(
+                documents, self.mongo_handler.batch_size,
+            )
         return self._dataframe
 
-    def plot_bar(self, x_data: pd.Index, y_data: pd.Series, x_label: str, y_label: str, title: str, x_ticks: pd.Series | None = None):
+    def plot_bar(self, x_data: pd.Index, y_data: pd.Series, x_label: str, y_label: str, title: str, x_ticks: pd.Series | None = None) -> BarChart:
         """
-        Common function to generate the bar plot diagram and save to the provided directory
-        with the title as file name in jpeg format.
+        Common function to build the bar plot diagram which is saved to the provided directory
+        with the title as file name in jpeg format when rendered.
         """
-        plt.figure(figsize=(8, 6))
-        plt.bar(x_data, y_data)
-        plt.xlabel(x_label)
-        plt.ylabel(y_label)
-        plt.title(title)
-        if x_ticks is not None and isinstance(x_ticks, pd.Series):
-            plt.xticks(x_ticks.index)
-        plt.savefig(f'visualized_diagram/{title}.jpeg')
-        logger.info(
-            f'Completed saving the bar plot diagram with file name {title}.jpeg',
+        return BarChart(
+            title=title,
+            x_label=x_label,
+            y_label=y_label,
+            x_data=tuple(pd.Index(x_data).tolist()),
+            y_data=tuple(int(value) for value in y_data),
+            x_ticks=tuple(x_ticks.index.tolist()) if isinstance(x_ticks, pd.Series) else None,
         )
 
     def visualization_by_operating_system(self):
         """
-        Generate the bar plot visualizing the counts of different host by OS.
+        Build the bar plot visualizing the counts of different host by OS.
         """
         logger.info(
             'Starting to generate the bar plot diagram by operating systems',
         )
-        os_counts = self.dataframe['os'].value_counts()
-        self.plot_bar(
+        os_counts = self.chart_data.os_counts()
+        return self.plot_bar(
             os_counts.index, os_counts.values, 'Operating System',
             'Count', 'Distribution of Operating Systems',
         )
 
     def visualization_by_old_host_vs_new_host(self):
         """
-        Generate the bar plot visualizing the counts of old host vs new hosts.
+        Build the bar plot visualizing the counts of old host vs new hosts.
         """
         logger.info(
             'Starting to generate the bar plot diagram of old host vs new hosts',
         )
-        cutoff_date = datetime.now() - timedelta(days=30)
-        self.dataframe['host_age'] = self.dataframe['last_seen'].apply(
-            lambda x: 'Old' if x < cutoff_date else 'New',
-        )
-        host_age_counts = self.dataframe['host_age'].value_counts()
-        self.plot_bar(
+        host_age_counts = self.chart_data.host_age_counts()
+        return self.plot_bar(
             host_age_counts.index, host_age_counts.values,
             'Host Age', 'Count', 'Distribution of Old vs New Hosts',
         )
 
     def visualization_by_agent_version(self):
         """
-        Generate the bar plot visualizing the counts by agent version.
+        Build the bar plot visualizing the counts by agent version.
         """
         logger.info(
             'Starting to generate the bar plot diagram by agent version',
         )
-        self.dataframe['agent_version_major'] = self.dataframe['agent_version'].str.split(
-            '.', expand=True,
-        )[0]
-        agent_version_counts = self.dataframe['agent_version_major'].value_counts(
-        )
-        self.plot_bar(
+        agent_version_counts = self.chart_data.agent_version_counts()
+        return self.plot_bar(
             agent_version_counts.index, agent_version_counts.values,
             'Agent Version (Major)', 'Count', 'Distribution of Agent Versions',
         )
 
     def visualization_by_host_year_created(self):
         """
-        Generate the bar plot visualizing the counts of different host by year created.
+        Build the bar plot visualizing the counts of different host by year created.
         """
         logger.info(
             'Starting to generate the bar plot diagram by host year created',
         )
-        self.dataframe['created_year'] = self.dataframe['created'].dt.year
-        created_year_counts = self.dataframe['created_year'].value_counts(
-        ).sort_index()
-        self.plot_bar(
+        created_year_counts = self.chart_data.created_year_counts()
+        return self.plot_bar(
             created_year_counts.index, created_year_counts.values, 'Year Created',
             'Count', 'Distribution of Hosts by Year Created', x_ticks=created_year_counts,
         )
 
     def visualization_by_host_status(self):
         """
-        Generates a bar plot visualizing the counts of different host statuses
+        Builds a bar plot visualizing the counts of different host statuses
         """
         logger.info('Starting to generate the bar plot diagram by host status')
-        status_counts = self.dataframe['status'].value_counts()
-        self.plot_bar(
+        status_counts = self.chart_data.status_counts()
+        return self.plot_bar(
             status_counts.index, status_counts.values,
             'Status', 'Count', 'Status Counts',
         )
 
     def visualization_by_countries_for_host(self):
         """
-        Generate the choropleth map visualizing the counts of different host by countries.
+        Build the choropleth map visualizing the counts of different host by countries.
         """
-        countries = {}
-        for country in pycountry.countries:
-            countries[country.name] = country.alpha_2
-
-        # Extract country names from the 'location' column
-        self.dataframe['country'] = self.dataframe['location'].str.split(
-            ',',
-        ).str[-1]
-        self.dataframe['country'] = self.dataframe['country'].apply(
-            lambda x: countries.get(x, x),
-        )
-
         # Group by country and count occurrences
-        country_counts = self.dataframe['country'].value_counts().reset_index()
+        country_counts = self.chart_data.country_counts().reset_index()
         country_counts.columns = ['country', 'count']
 
-        # Create the choropleth map
         logger.info(
             'Starting to generate the choropleth map of different host by countries',
         )
-        fig = px.choropleth(
-            country_counts,
-            locations='country',
-            locationmode='country names',
-            color='count',
-            color_continuous_scale=px.colors.sequential.Plasma,
+        return ChoroplethChart(
             title='Host Distribution by Country',
+            countries=tuple(country_counts['country'].tolist()),
+            counts=tuple(int(count) for count in country_counts['count']),
         )
-        fig.show()
-        fig.write_image('visualized_diagram/Host Distribution by Country.jpeg')
 
     def generate_diagram(self):
         """
         Generate the diagram based on certain criteria's
+        The charts are rendered concurrently by the chart renderer.
         """
         logger.info('Starting to generate the diagram')
-        self.visualization_by_operating_system()
-        self.visualization_by_old_host_vs_new_host()
-        self.visualization_by_agent_version()
-        self.visualization_by_host_year_created()
-        self.visualization_by_host_status()
-        self.visualization_by_countries_for_host()
+        charts = [
+            self.visualization_by_operating_system(),
+            self.visualization_by_old_host_vs_new_host(),
+            self.visualization_by_agent_version(),
+            self.visualization_by_host_year_created(),
+            self.visualization_by_host_status(),
+            self.visualization_by_countries_for_host(),
+        ]
+        chart_renderer.render(charts, 'visualized_diagram')
         logger.info('Completed generating the diagram')
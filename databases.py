@@ -1,23 +1,114 @@
 from __future__ import annotations
 
-from dataclasses import asdict
+import hashlib
+from collections import deque
+from collections.abc import Iterable
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import fields
+from datetime import datetime
+from datetime import timedelta
+from functools import cached_property
+from functools import lru_cache
+from itertools import islice
+from operator import attrgetter
 from typing import Any
 
+import msgspec
+from pymongo import ASCENDING
 from pymongo import MongoClient
 from pymongo import UpdateOne
 from pymongo.collection import Collection
+from pymongo.database import Database
+from pymongo.errors import BulkWriteError
+from pymongo.errors import PyMongoError
 
 from config import settings
+from logger import Logger
+from metrics import metrics
+from resources import resources
+
+logger = Logger().get_logger()
+
+# Field of the stored documents holding the fingerprint of their content
+FINGERPRINT_FIELD = 'fingerprint'
+# Fields which change on every sighting of a host and are left out of the fingerprint
+VOLATILE_FIELDS = ('updated', 'last_seen')
+
+
+def chunked(items: Iterable[Any], size: int) -> Iterator[list[Any]]:
+    """
+    Split the items into lists of at most `size` elements.
+    """
+    iterator = iter(items)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+@lru_cache(maxsize=None)
+def host_fields(host_class: type) -> tuple[tuple[str, ...], attrgetter, attrgetter]:
+    """
+    Return the field names of the host class with one getter of all of them and one getter of the
+    fields the fingerprint is computed from, so a host is read with two calls instead of asdict.
+    """
+    names = tuple(field.name for field in fields(host_class))
+    content_names = tuple(name for name in names if name not in VOLATILE_FIELDS)
+    return names, attrgetter(*names), attrgetter(*content_names)
+
+
+def host_document(host: Any) -> dict[str, Any]:
+    """
+    Return the document of the host, a shallow replacement of asdict for the flat host classes.
+    """
+    names, values, _ = host_fields(type(host))
+    return dict(zip(names, values(host)))
+
+
+def host_fingerprint(host: Any) -> str:
+    """
+    Return a stable fingerprint of the normalized fields of the host, without the volatile timestamps.
+    """
+    _, _, content_values = host_fields(type(host))
+    return hashlib.blake2b(
+        msgspec.json.encode(content_values(host)), digest_size=16,
+    ).hexdigest()
+
+
+def stored_value(value: Any) -> Any:
+    """
+    Return the value the way MongoDB stores it, datetimes being kept with millisecond precision.
+    """
+    if isinstance(value, datetime):
+        return value.replace(microsecond=value.microsecond // 1000 * 1000)
+    return value
 
 
 class MongoDBHandler:
 
     def __init__(self):
-        self.client = MongoClient(
-            settings.MONGO_DB_HOST, settings.MONGO_DB_PORT,
-        )
-        self.db = self.client[settings.MONGO_DB_NAME]
-        self.collection = self.db[settings.MONGO_DB_COLLECTION_NAME]
+        """
+        Initializing the MongoDBHandler class with the write settings. The MongoClient is only
+        created on first use of the collections, so importing the module does not connect.
+        """
+        self.batch_size = max(1, settings.MONGO_BATCH_SIZE)
+        self.write_workers = max(1, settings.MONGO_WRITE_WORKERS)
+        self.last_seen_refresh = timedelta(seconds=settings.LAST_SEEN_REFRESH_INTERVAL)
+
+    @cached_property
+    def client(self) -> MongoClient:
+        return resources.mongo_client
+
+    @cached_property
+    def db(self) -> Database:
+        return self.client[settings.MONGO_DB_NAME]
+
+    @cached_property
+    def collection(self) -> Collection:
+        return self.db[settings.MONGO_DB_COLLECTION_NAME]
+
+    @cached_property
+    def sync_state(self) -> Collection:
+        return self.db[settings.MONGO_DB_SYNC_STATE_COLLECTION_NAME]
 
     def get_collection(self) -> Collection:
         """
@@ -31,40 +122,262 @@ class MongoDBHandler:
         """
         return list(self.collection.find({}))
 
-    def insert_data_operations(self, unique_data: list[Any]) -> None:
+    def iter_documents(self, fields: list[str], batch_size: int) -> Iterator[dict[str, Any]]:
         """
-        This function performs the following operations:
-          1. Iterates through each unique host data.
-          2. Checks if the host data exists in the database using the host ID.
-          3. If the host exists, compares the 'updated' value with the 'updated' value stored in the database.
-             If the 'updated' value is greater, updates the operations array with the new host data.
-          4. If the host does not exist, adds an operation to insert the new host data with upsert=True.
-          5. Executes all the operations in bulk to the database.
-        """
-        operations = []
-        for host in unique_data:
-            host_dict = asdict(host)
-            existing_host = self.collection.find_one({'host_id': host.host_id})
-            if existing_host:
-                existing_updated = existing_host.get('updated')
-                if existing_updated and host.updated > existing_updated:
-                    operations.append(
-                        UpdateOne(
-                            {'host_id': host.host_id},
-                            {'$set': host_dict},
-                        ),
-                    )
-            else:
-                operations.append(
-                    UpdateOne(
+        Iterate over the documents of the collection with only the given fields,
+        fetching `batch_size` documents per round trip.
+        """
+        projection = {'_id': 0, **{field: 1 for field in fields}}
+        metrics.add_mongo_operations('find')
+        return self.collection.find({}, projection, batch_size=batch_size)
+
+    def get_chart_counts(self, cutoff_date: datetime) -> dict[str, list[dict[str, Any]]]:
+        """
+        Return the host counts the diagrams are drawn from, grouped on the database server in a single
+        $facet aggregation: by os, status, agent version major, created year, old vs new hosts and country.
+        Every facet is a list of {'_id': value, 'count': count} documents sorted by count.
+        """
+        def count_by(expression: Any, match: dict[str, Any]) -> list[dict[str, Any]]:
+            return [
+                {'$match': match},
+                {'$group': {'_id': expression, 'count': {'$sum': 1}}},
+                {'$sort': {'count': -1}},
+            ]
+
+        pipeline = [
+            {
+                '$facet': {
+                    'os': count_by('$os', {'os': {'$ne': None}}),
+                    'status': count_by('$status', {'status': {'$ne': None}}),
+                    'agent_version_major': count_by(
+                        {'$arrayElemAt': [{'$split': ['$agent_version', '.']}, 0]},
+                        {'agent_version': {'$type': 'string'}},
+                    ),
+                    'created_year': count_by(
+                        {'$year': '$created'}, {'created': {'$type': 'date'}},
+                    ),
+                    'host_age': count_by(
+                        {
+                            '$cond': [
+                                {
+                                    '$and': [
+                                        {'$eq': [{'$type': '$last_seen'}, 'date']},
+                                        {'$lt': ['$last_seen', cutoff_date]},
+                                    ],
+                                },
+                                'Old', 'New',
+                            ],
+                        },
+                        {},
+                    ),
+                    'country': count_by(
+                        {'$arrayElemAt': [{'$split': ['$location', ',']}, -1]},
+                        {'location': {'$type': 'string'}},
+                    ),
+                },
+            },
+        ]
+        metrics.add_mongo_operations('aggregate')
+        return next(self.collection.aggregate(pipeline), {})
+
+    def ensure_indexes(self) -> None:
+        """
+        Create the unique index on host_id so the lookups and upserts by host_id are not collection scans.
+        Creating an index which already exists is a no-op.
+        """
+        try:
+            self.collection.create_index(
+                [('host_id', ASCENDING)], unique=True, name='host_id_unique',
+            )
+        except PyMongoError as e:
+            logger.error(
+                f'Error during creating the unique index on host_id due to reason: {e}',
+            )
+
+    def get_watermarks(self) -> dict[str, datetime]:
+        """
+        Return the per source high-water marks of the newest record loaded into the database.
+        """
+        document = self.sync_state.find_one({'_id': 'watermarks'}) or {}
+        document.pop('_id', None)
+        return document
+
+    def update_watermarks(self, watermarks: dict[str, datetime | None]) -> None:
+        """
+        Move the per source high-water marks forward. $max makes sure a watermark never goes back in time.
+        """
+        watermarks = {
+            source: watermark for source, watermark in watermarks.items() if watermark
+        }
+        if watermarks:
+            self.sync_state.update_one(
+                {'_id': 'watermarks'}, {'$max': watermarks}, upsert=True,
+            )
+
+    def get_last_full_sync(self) -> datetime | None:
+        """
+        Return the time the last full resync started at.
+        """
+        document = self.sync_state.find_one({'_id': 'full_sync'}) or {}
+        return document.get('started_at')
+
+    def set_last_full_sync(self, started_at: datetime) -> None:
+        """
+        Record the time the last completed full resync started at.
+        """
+        self.sync_state.update_one(
+            {'_id': 'full_sync'}, {'$set': {'started_at': started_at}}, upsert=True,
+        )
+
+    def get_existing_hosts(self, host_ids: list[str], fields: Iterable[str]) -> dict[str, dict[str, Any]]:
+        """
+        Return the given fields and the fingerprint of the stored document of every given host ID
+        which exists in the database using a single $in query.
+        """
+        metrics.add_mongo_operations('find')
+        projection = {'_id': 0, 'host_id': 1, FINGERPRINT_FIELD: 1, **{field: 1 for field in fields}}
+        cursor = self.collection.find(
+            {'host_id': {'$in': host_ids}}, projection,
+        )
+        return {document['host_id']: document for document in cursor}
+
+    def changed_fields(self, host: Any, existing_host: dict[str, Any]) -> dict[str, Any]:
+        """
+        Return the fields of the host whose value differs from the stored document,
+        along with the new fingerprint.
+        A host with the same content only gets the timestamps which moved forward, unless last_seen moved
+        forward by less than `last_seen_refresh`, where the empty mapping means there is nothing to write.
+        """
+        fingerprint = host_fingerprint(host)
+        if existing_host.get(FINGERPRINT_FIELD) == fingerprint:
+            existing_last_seen = existing_host.get('last_seen')
+            if (
+                isinstance(host.last_seen, datetime) and isinstance(existing_last_seen, datetime)
+                    and host.last_seen - existing_last_seen < self.last_seen_refresh
+            ):
+                return {}
+            return {
+                field: getattr(host, field) for field in VOLATILE_FIELDS
+                if stored_value(getattr(host, field)) != existing_host.get(field)
+            }
+        changes = {
+            field: value for field, value in host_document(host).items()
+            if field not in existing_host or stored_value(value) != existing_host[field]
+        }
+        changes[FINGERPRINT_FIELD] = fingerprint
+        return changes
+
+    def build_operations(self, unique_data: Iterable[Any]) -> Iterator[UpdateOne]:
+        """
+        Yield the update operations for the hosts which are new or newer than the stored ones.
+        The stored hosts are looked up with one $in query per chunk of `batch_size` host IDs, reading only
+        the host fields and the fingerprint. Newer hosts are compared with the stored document through
+        the fingerprint of their content, and only their changed fields are written. Hosts with an unchanged
+        content only get their timestamps written, once last_seen is `last_seen_refresh` behind.
+        """
+        unchanged = 0
+        for chunk in chunked(unique_data, self.batch_size):
+            existing_hosts = self.get_existing_hosts(
+                [host.host_id for host in chunk], host_fields(type(chunk[0]))[0],
+            )
+            for host in chunk:
+                if host.host_id in existing_hosts:
+                    existing_host = existing_hosts[host.host_id]
+                    existing_updated = existing_host.get('updated')
+                    if existing_updated and host.updated > existing_updated:
+                        changes = self.changed_fields(host, existing_host)
+                        if changes:
+                            yield UpdateOne(
+                                {'host_id': host.host_id},
+                                {'$set': changes},
+                            )
+                        else:
+                            unchanged += 1
+                else:
+                    document = host_document(host)
+                    document[FINGERPRINT_FIELD] = host_fingerprint(host)
+                    yield UpdateOne(
                         {'host_id': host.host_id}, {
-                            '$set': host_dict,
+                            '$set': document,
                         }, upsert=True,
-                    ),
+                    )
+        if unchanged:
+            logger.info(f'Skipped the update of {unchanged} newer hosts with an unchanged content')
+
+    def write_batch(self, batch_number: int, operations: list[UpdateOne]) -> dict[str, Any]:
+        """
+        Execute one batch of operations with an unordered bulk write so a failing document
+        does not stop the rest of the batch.
+        Returns the matched, upserted and modified counts and the number of write errors of the batch.
+        """
+        write_errors = []
+        metrics.add_mongo_operations('bulk_write')
+        metrics.add_mongo_operations('update', len(operations))
+        try:
+            details = self.collection.bulk_write(
+                operations, ordered=False,
+            ).bulk_api_result
+        except BulkWriteError as e:
+            details = e.details
+            write_errors = details.get('writeErrors', [])
+            logger.error(
+                f'Batch {batch_number} finished with {len(write_errors)} write errors, first error: {write_errors[:1]}',
+            )
+        except PyMongoError as e:
+            details = {}
+            write_errors = [{'errmsg': str(e)}]
+            logger.error(
+                f'Batch {batch_number} failed due to reason: {e}',
+            )
+        return {
+            'batch': batch_number,
+            'operations': len(operations),
+            'matched': details.get('nMatched', 0),
+            'upserted': details.get('nUpserted', 0),
+            'modified': details.get('nModified', 0),
+            'write_errors': len(write_errors),
+        }
+
+    def write_operations(self, operations: Iterable[UpdateOne]) -> list[dict[str, Any]]:
+        """
+        Split the operations into batches of `batch_size` and write them concurrently from a thread pool.
+        At most twice the number of workers batches are held in memory at the same time.
+        """
+        results = []
+        in_flight = deque()
+        with ThreadPoolExecutor(max_workers=self.write_workers) as executor:
+            for batch_number, batch in enumerate(chunked(operations, self.batch_size), start=1):
+                if len(in_flight) >= self.write_workers * 2:
+                    results.append(in_flight.popleft().result())
+                in_flight.append(
+                    executor.submit(self.write_batch, batch_number, batch),
                 )
+            results.extend(future.result() for future in in_flight)
+        for result in results:
+            logger.info(f'Bulk write batch result: {result}')
+        return results
 
-        if operations:
-            self.collection.bulk_write(operations)
+    def insert_data_operations(self, unique_data: Iterable[Any]) -> list[dict[str, Any]]:
+        """
+        This function performs the following operations:
+          1. Iterates through the unique host data in chunks.
+          2. Checks which hosts of the chunk exist in the database with a single query on the host IDs.
+          3. If the host exists, compares the 'updated' value with the 'updated' value stored in the database.
+             If the 'updated' value is greater and the fingerprint of the content differs,
+             adds an operation to update the changed fields of the host.
+          4. If the host does not exist, adds an operation to insert the new host data with upsert=True.
+          5. Executes the operations in unordered batches, several batches at a time.
+        Returns the per batch results of the bulk writes.
+        """
+        results = self.write_operations(self.build_operations(unique_data))
+        totals = {
+            key: sum(result[key] for result in results)
+            for key in ('operations', 'matched', 'upserted', 'modified', 'write_errors')
+        }
+        logger.info(
+            f'Completed writing {len(results)} batches to the database: {totals}',
+        )
+        return results
 
 
 mongo_db = MongoDBHandler()
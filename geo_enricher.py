@@ -0,0 +1,122 @@
+from __future__ import annotations
+
+import asyncio
+import json
+from collections.abc import Iterable
+from typing import Any
+
+import aiohttp
+
+from config import settings
+from data_normalizer import DataNormalizer
+from location_cache import location_cache
+from logger import Logger
+from metrics import metrics
+from resources import resources
+from source_adapters import source_adapters
+
+logger = Logger().get_logger()
+
+
+class GeoEnricher:
+    """
+    Class to resolve the location of external IP addresses concurrently.
+    """
+
+    def __init__(self):
+        """
+        Initializing the GeoEnricher class with the IP address API and concurrency limit.
+        """
+        self.url = settings.IP_ADDRESS_API_URL
+        self.concurrency = max(1, settings.GEO_CONCURRENCY)
+        self.timeout = aiohttp.ClientTimeout(total=settings.GEO_REQUEST_TIMEOUT)
+        self.data_normalizer = DataNormalizer()
+
+    def distinct_ips(self, data: list[dict[str, Any]], source: str = 'crowdstrike') -> set[str]:
+        """
+        Collect the distinct external IP addresses of the data of the source, read at the geo path of its adapter.
+        Hosts behind the same NAT IP share a single lookup.
+        """
+        ip_address_of = source_adapters[source].accessor('geo')
+        ip_addresses = {ip_address_of(item) for item in data}
+        ip_addresses.discard(None)
+        ip_addresses.discard('')
+        return ip_addresses
+
+    async def fetch_location(self, session: aiohttp.ClientSession, semaphore: asyncio.Semaphore, ip_address: str) -> str:
+        """
+        Fetching the address of a single IP address over the pooled session.
+        On error response, empty string is passed back
+        """
+        url = self.url.format(ip_address=ip_address)
+        async with semaphore:
+            try:
+                async with session.post(url, timeout=self.timeout) as response:
+                    response.raise_for_status()
+                    body = await response.read()
+                    metrics.add_fetched_bytes('geo', len(body))
+                    data = json.loads(body)
+                    return self.data_normalizer.address_from_response(
+                        data, str(response.url), response.status,
+                    )
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                error_reason = {
+                    'url': url,
+                    'error': f'Request failed: {e!r}',
+                }
+                logger.error(
+                    f'Error during fetching address from IP address due to reason: {error_reason}',
+                )
+                return ''
+
+    async def resolve_locations(self, ip_addresses: Iterable[str]) -> dict[str, str]:
+        """
+        Resolve the location of every given IP address concurrently,
+        keeping at most `concurrency` requests in flight.
+        IP addresses found in the location cache are not requested again.
+        The cache is read and written in a worker thread, so its SQLite I/O does not stall the
+        page fetches running on the event loop.
+        """
+        ip_addresses = list(ip_addresses)
+        cached = await asyncio.to_thread(location_cache.get_many, ip_addresses)
+        ip_addresses = [
+            ip_address for ip_address in ip_addresses if ip_address not in cached
+        ]
+        metrics.add_cache_lookups('location', len(cached), len(ip_addresses))
+        logger.info(
+            f'Location cache served {len(cached)} IP addresses, stats: {location_cache.stats()}',
+        )
+        if not ip_addresses:
+            return cached
+        logger.info(
+            f'Starting to resolve the address of {len(ip_addresses)} distinct IP addresses',
+        )
+        semaphore = asyncio.Semaphore(self.concurrency)
+        session = resources.http_session('geo', limit=self.concurrency)
+        locations = await asyncio.gather(
+            *(
+                self.fetch_location(session, semaphore, ip_address)
+                for ip_address in ip_addresses
+            ),
+        )
+        logger.info('Finished resolving the address of the IP addresses')
+        resolved = dict(zip(ip_addresses, locations))
+        await asyncio.to_thread(location_cache.set_many, resolved)
+        return {**cached, **resolved}
+
+    async def enrich_source_data(self, source: str, data: list[dict[str, Any]]) -> dict[str, str]:
+        """
+        Resolve the locations of the distinct external IP addresses found in the data of the source.
+        The returned mapping is passed to `DataNormalizer.normalize_records` to fill in the location.
+        """
+        return await self.resolve_locations(self.distinct_ips(data, source))
+
+    async def enrich_crowdstrike_data(self, data: list[dict[str, Any]]) -> dict[str, str]:
+        """
+        Resolve the locations of the distinct external IP addresses found in the CrowdStrike data.
+        The returned mapping is passed to `DataNormalizer.normalize_crowdstrike_data` to fill in the location.
+        """
+        return await self.enrich_source_data('crowdstrike', data)
+
+
+geo_enricher = GeoEnricher()
@@ -0,0 +1,193 @@
+from __future__ import annotations
+
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Iterable
+
+from config import settings
+from logger import Logger
+
+logger = Logger().get_logger()
+
+# Share of the max size evicted at once above it, so the table is not counted again on the next inserts
+EVICT_FRACTION = 0.1
+
+
+class LocationCache:
+    """
+    Two tier cache of IP address locations.
+    An in-process LRU tier sits in front of an on-disk SQLite tier which survives restarts.
+    Empty locations (failed lookups) are kept with a separate, shorter TTL.
+    """
+
+    def __init__(self):
+        """
+        Initializing the LocationCache class with the TTLs, size limits and the SQLite file path.
+        The SQLite connection is opened on first use.
+        """
+        self.path = settings.GEO_CACHE_PATH
+        self.ttl = settings.GEO_CACHE_TTL
+        self.negative_ttl = settings.GEO_CACHE_NEGATIVE_TTL
+        self.max_size = settings.GEO_CACHE_MAX_SIZE
+        self.memory_size = settings.GEO_CACHE_MEMORY_SIZE
+        self.enabled = settings.GEO_CACHE_ENABLED
+        self._memory: OrderedDict[str, tuple[str, float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._connection = None
+        # Upper bound of the rows of the SQLite tier, counted exactly only once it passes the max size
+        self._disk_size = None
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """
+        Open the SQLite connection and create the table if it does not exist yet.
+        """
+        if self._connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._connection = sqlite3.connect(
+                self.path, check_same_thread=False,
+            )
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS locations ('
+                'ip_address TEXT PRIMARY KEY, location TEXT NOT NULL, expires_at REAL NOT NULL)',
+            )
+            self._connection.execute(
+                'CREATE INDEX IF NOT EXISTS locations_expires_at ON locations (expires_at)',
+            )
+            self._connection.commit()
+        return self._connection
+
+    def _remember(self, ip_address: str, location: str, expires_at: float):
+        """
+        Store the entry in the LRU tier, evicting the least recently used entries above its size.
+        """
+        self._memory[ip_address] = (location, expires_at)
+        self._memory.move_to_end(ip_address)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def get_many(self, ip_addresses: Iterable[str]) -> dict[str, str]:
+        """
+        Return the cached locations of the given IP addresses which are not expired.
+        IP addresses missing from the returned mapping have to be resolved.
+        """
+        found: dict[str, str] = {}
+        if not self.enabled:
+            return found
+        now = time.time()
+        with self._lock:
+            pending = []
+            for ip_address in ip_addresses:
+                entry = self._memory.get(ip_address)
+                if entry and entry[1] > now:
+                    self._memory.move_to_end(ip_address)
+                    found[ip_address] = entry[0]
+                    self.memory_hits += 1
+                else:
+                    pending.append(ip_address)
+            # SQLite limits the number of bound parameters per statement
+            for start in range(0, len(pending), 500):
+                chunk = pending[start:start + 500]
+                rows = self.connection.execute(
+                    f'SELECT ip_address, location, expires_at FROM locations '
+                    f'WHERE expires_at > ? AND ip_address IN ({",".join("?" * len(chunk))})',
+                    [now, *chunk],
+                ).fetchall()
+                for ip_address, location, expires_at in rows:
+                    self._remember(ip_address, location, expires_at)
+                    found[ip_address] = location
+                    self.disk_hits += 1
+            self.misses += sum(1 for ip_address in pending if ip_address not in found)
+        return found
+
+    def get(self, ip_address: str) -> str | None:
+        """
+        Return the cached location of the IP address or None if it has to be resolved.
+        """
+        return self.get_many([ip_address]).get(ip_address)
+
+    def set_many(self, locations: dict[str, str]):
+        """
+        Store the resolved locations in both tiers.
+        Empty locations expire after the negative TTL, the rest after the regular TTL.
+        """
+        if not self.enabled or not locations:
+            return
+        now = time.time()
+        rows = [
+            (
+                ip_address, location,
+                now + (self.ttl if location else self.negative_ttl),
+            )
+            for ip_address, location in locations.items()
+        ]
+        with self._lock:
+            for ip_address, location, expires_at in rows:
+                self._remember(ip_address, location, expires_at)
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO locations (ip_address, location, expires_at) VALUES (?, ?, ?)',
+                rows,
+            )
+            self.evict(now, inserted=len(rows))
+            self.connection.commit()
+
+    def set(self, ip_address: str, location: str):
+        """
+        Store the resolved location of a single IP address.
+        """
+        self.set_many({ip_address: location})
+
+    def evict(self, now: float, inserted: int = 0):
+        """
+        Delete the expired entries from the SQLite tier and, above the max size,
+        the entries closest to expiring until `EVICT_FRACTION` of the max size is free.
+        The size of the table is tracked as an upper bound, every inserted row counting as a new one
+        even when it replaced an entry, so the table is only counted once the bound passes the max size
+        instead of on every insert.
+        """
+        expired = self.connection.execute(
+            'DELETE FROM locations WHERE expires_at <= ?', (now,),
+        ).rowcount
+        if self._disk_size is None:
+            (self._disk_size,) = self.connection.execute(
+                'SELECT COUNT(*) FROM locations',
+            ).fetchone()
+        else:
+            self._disk_size = max(0, self._disk_size + inserted - expired)
+        if self._disk_size <= self.max_size:
+            return
+        (size,) = self.connection.execute(
+            'SELECT COUNT(*) FROM locations',
+        ).fetchone()
+        if size > self.max_size:
+            target = self.max_size - int(self.max_size * EVICT_FRACTION)
+            self.connection.execute(
+                'DELETE FROM locations WHERE ip_address IN '
+                '(SELECT ip_address FROM locations ORDER BY expires_at LIMIT ?)',
+                (size - target,),
+            )
+            size = target
+        self._disk_size = size
+
+    def stats(self) -> dict[str, float]:
+        """
+        Return the hit and miss counters of the cache.
+        """
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            'memory_hits': self.memory_hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_rate': (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+        }
+
+
+location_cache = LocationCache()
@@ -35,8 +35,8 @@ class Logger:
         ensuring no duplicate handlers are added.
         """
         if not self.logger.hasHandlers():
-            # File handler
-            file_handler = logging.FileHandler(self.log_file)
+            # File handler, the log file is only opened on the first record
+            file_handler = logging.FileHandler(self.log_file, delay=True)
             file_handler.setLevel(logging.DEBUG)
             formatter = logging.Formatter(
                 '%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -2,47 +2,129 @@ from __future__ import annotations
 
 import asyncio
 import time
+from datetime import datetime
+from datetime import timedelta
 
 import schedule
 
+from config import settings
 from data_fetcher import data_fetcher
 from data_normalizer import DataNormalizer
-from data_visualizer import DataVisualizationHandler
 from databases import mongo_db
+from geo_enricher import geo_enricher
 from logger import Logger
+from metrics import metrics
+from pipeline import streaming_pipeline
+from resources import resources
+from scheduler import PipelineScheduler
 
 logger = Logger().get_logger()
 
 
-async def extract_data():
+def get_sync_watermarks():
+    """
+    Return the per source watermarks for an incremental run.
+    None is returned when incremental sync is disabled or a full resync is due.
+    """
+    if not settings.INCREMENTAL_SYNC:
+        return None
+    last_full_sync = mongo_db.get_last_full_sync()
+    if last_full_sync is None or datetime.now() - last_full_sync >= timedelta(seconds=settings.FULL_SYNC_INTERVAL):
+        logger.info('Full resync is due, fetching the whole inventory')
+        return None
+    watermarks = mongo_db.get_watermarks()
+    logger.info(f'Running incremental sync since the watermarks {watermarks}')
+    return watermarks
+
+
+def save_sync_watermarks(latest, load_results, full_sync_started_at=None, incomplete=()):
+    """
+    Move the per source watermarks forward to the newest loaded record.
+    The watermarks are kept when any write failed so the failed hosts are fetched again.
+    The watermark of a source in `incomplete`, whose pages could not all be fetched, is kept as well:
+    the pages are not ordered by update time, so the missing records may be older than the newest fetched one.
+    Such a run does not count as a full sync either.
+    """
+    if not settings.INCREMENTAL_SYNC:
+        return
+    if any(result['write_errors'] for result in load_results):
+        logger.error('Keeping the sync watermarks since some writes failed')
+        return
+    if incomplete:
+        logger.error(f'Keeping the sync watermarks of {sorted(incomplete)} since their pages were not all fetched')
+    mongo_db.update_watermarks(
+        {source: watermark for source, watermark in latest.items() if source not in incomplete},
+    )
+    if full_sync_started_at is not None and not incomplete:
+        mongo_db.set_last_full_sync(full_sync_started_at)
+
+
+async def extract_data(since=None, incomplete=None):
     """
     Call the API used for Qualys and CrowdStrike data.
+    When the per source watermarks are given only the records newer than them are returned.
+    The sources which could not be fetched completely are added to `incomplete`.
     """
-    qualys_data, crowdstrike_data = await data_fetcher.fetch_all_data()
+    with metrics.stage('extract'):
+        qualys_data, crowdstrike_data = await data_fetcher.fetch_all_data(since=since, incomplete=incomplete)
+    metrics.add_records('extract', len(qualys_data or []) + len(crowdstrike_data or []))
     return qualys_data, crowdstrike_data
 
 
-def transform_data(qualys_data, crowdstrike_data):
+async def enrich_data(crowdstrike_data):
+    """
+    Resolve the locations of the distinct external IP addresses of the CrowdStrike data.
+    """
+    with metrics.stage('geo_enrich'):
+        locations = await geo_enricher.enrich_crowdstrike_data(crowdstrike_data or [])
+    metrics.add_records('geo_enrich', len(locations))
+    return locations
+
+
+def newer_than(hosts, watermark):
+    """
+    Keep only the hosts updated after the watermark.
+    """
+    if watermark is None:
+        return hosts
+    return [host for host in hosts if host.updated > watermark]
+
+
+def transform_data(qualys_data, crowdstrike_data, locations=None, since=None):
     """
     Normalize the data obtained from qualys and crowdstrike to same format
     and remove duplicates if exists.
+    When the per source watermarks are given only the hosts newer than them are kept.
     """
     data_normalizer = DataNormalizer()
     normalized_data = []
+    since = since or {}
 
-    if qualys_data:
-        logger.info('Normalizing Qualys Data')
-        normalized_data.extend(
-            data_normalizer.normalize_qualys_data(qualys_data),
-        )
+    with metrics.stage('normalize'):
+        if qualys_data:
+            logger.info('Normalizing Qualys Data')
+            normalized_data.extend(
+                newer_than(
+                    data_normalizer.normalize_source('qualys', qualys_data),
+                    since.get('qualys'),
+                ),
+            )
 
-    if crowdstrike_data:
-        logger.info('Normalizing CrowdStrike Data')
-        normalized_data.extend(
-            data_normalizer.normalize_crowdstrike_data(crowdstrike_data),
-        )
+        if crowdstrike_data:
+            logger.info('Normalizing CrowdStrike Data')
+            normalized_data.extend(
+                newer_than(
+                    data_normalizer.normalize_source(
+                        'crowdstrike', crowdstrike_data, locations=locations,
+                    ),
+                    since.get('crowdstrike'),
+                ),
+            )
+    metrics.add_records('normalize', len(normalized_data))
 
-    unique_data = data_normalizer.remove_duplicates(normalized_data)
+    with metrics.stage('dedup'):
+        unique_data = data_normalizer.remove_duplicates(normalized_data)
+    metrics.add_records('dedup', len(unique_data))
     return unique_data
 
 
@@ -51,41 +133,143 @@ def load_data_to_database(normalized_data):
     Inserting the normalized_data into the mongo db databases.
     """
     logger.info('Starting to insert the normalized data into the mongodb')
-    mongo_db.insert_data_operations(normalized_data)
+    with metrics.stage('load'):
+        load_results = mongo_db.insert_data_operations(normalized_data)
+    metrics.add_records('load', sum(result['operations'] for result in load_results))
+    return load_results
+
+
+def snapshot_data(normalized_data, full):
+    """
+    Write the deduplicated hosts of the run to the columnar snapshot when snapshots are enabled.
+    pyarrow is only imported when they are.
+    """
+    if not settings.SNAPSHOT_ENABLED:
+        return
+    from snapshot import inventory_snapshot
+
+    with metrics.stage('snapshot'):
+        records = inventory_snapshot.write_run(normalized_data, full=full)
+    metrics.add_records('snapshot', records)
 
 
 def visualize_data():
     """
-    Visualize the data by calling instance of DataVisualizationHandler class
+    Visualize the data by calling instance of DataVisualizationHandler class.
+    The visualization stack, pandas and pycountry, is imported on the first call only,
+    so runs which never visualize do not pay for it.
     """
+    from data_visualizer import DataVisualizationHandler
+
     logger.info(
         'Starting to visualize the data and save the generated diagram to the designated folders.',
     )
-    visualizer = DataVisualizationHandler()
-    visualizer()
+    with metrics.stage('visualize'):
+        visualizer = DataVisualizationHandler()
+        visualizer()
+    metrics.write()
+
+
+async def run_batch_pipeline(load_lock, since=None, incomplete=None):
+    """
+    Fetch, transform and load the whole payload of both sources one stage after another.
+    Only the load holds the load lock, so the fetch can overlap other work.
+    The sources which could not be fetched completely are added to `incomplete`.
+    Returns the per batch load results and the newest record update time per source,
+    or None when there is no data to process.
+    """
+    logger.info('Starting to fetch data for both Qualys and CrowdStrike API')
+    incomplete = set() if incomplete is None else incomplete
+    qualys_data, crowdstrike_data = await extract_data(since=since, incomplete=incomplete)
+    if since is None and not (qualys_data and crowdstrike_data):
+        logger.info(
+            'Both Qualys Data and CrowdStrike Data are empty. Skipping data processing and visualization.',
+        )
+        return None
+    if since is not None and not (qualys_data or crowdstrike_data):
+        logger.info(
+            'No Qualys Data or CrowdStrike Data newer than the watermarks. Skipping data processing and visualization.',
+        )
+        return None
+    logger.info('Starting to resolve the locations for CrowdStrike Data')
+    locations = await enrich_data(crowdstrike_data)
+    logger.info('Starting to transfor data for Qualys Data and CrowdStrike Data')
+    processed_data = await metrics.to_thread(
+        transform_data, qualys_data, crowdstrike_data, locations=locations, since=since,
+    )
+    logger.info('Starting to load processed data into mongo db databases')
+    async with load_lock:
+        load_results = await metrics.to_thread(load_data_to_database, processed_data)
+    await metrics.to_thread(snapshot_data, processed_data, full=since is None and not incomplete)
+    latest = {
+        'qualys': data_fetcher.latest_timestamp('qualys', qualys_data),
+        'crowdstrike': data_fetcher.latest_timestamp('crowdstrike', crowdstrike_data),
+    }
+    return load_results, latest
+
+
+async def run_streaming_pipeline(load_lock, since=None, incomplete=None):
+    """
+    Stream the pages of both sources through normalize, dedup and load with bounded memory.
+    The stages load while they fetch, so the whole run holds the load lock.
+    The sources which could not be fetched completely are added to `incomplete`.
+    Returns the per batch load results and the newest record update time per source,
+    or None when there is no data to process.
+    """
+    logger.info('Starting the streaming pipeline for both Qualys and CrowdStrike API')
+    async with load_lock:
+        load_results, latest = await streaming_pipeline.run(since=since, incomplete=incomplete)
+    if not load_results:
+        logger.info(
+            'No Qualys Data or CrowdStrike Data was loaded. Skipping visualization.',
+        )
+        return None
+    return load_results, latest
+
+
+async def run_pipeline(load_lock):
+    """
+    Run fetch, transform and load, holding the load lock while writing to the database,
+    and move the watermarks forward.
+    The metrics file is written at the end of every run and the run is profiled when PROFILE_MODE is set.
+    Returns whether new data was loaded which needs to be visualized.
+    """
+    started_at = time.perf_counter()
+    full_sync_started_at = datetime.now()
+    since = await asyncio.to_thread(get_sync_watermarks)
+    incomplete = set()
+    try:
+        with metrics.profile():
+            if settings.PIPELINE_MODE == 'streaming':
+                outcome = await run_streaming_pipeline(load_lock, since=since, incomplete=incomplete)
+            else:
+                outcome = await run_batch_pipeline(load_lock, since=since, incomplete=incomplete)
+    finally:
+        metrics.finish_run(time.perf_counter() - started_at)
+    if outcome is None:
+        return False
+    load_results, latest = outcome
+    await asyncio.to_thread(
+        save_sync_watermarks, latest, load_results,
+        full_sync_started_at=full_sync_started_at if since is None else None,
+        incomplete=incomplete,
+    )
+    return True
 
 
 def main():
     """
     Following steps are performed  in this function
-        1. Call the API to fetch the data
+        1. Call the API to fetch the data, only the records newer than the watermarks on incremental runs
         2. If data exists, transform the data to the same format and remove the duplicate if exists.
-        3. Insert the transformed data to database
+        3. Insert the transformed data to database and move the watermarks forward
         4. Load the data inserted to database and generate the diagram.
+    In streaming mode steps 1 to 3 run concurrently page by page.
     """
     logger.info('Starting to call the main function at time')
     start_time = time.time()
-    logger.info('Starting to fetch data for both Qualys and CrowdStrike API')
-    qualys_data, crowdstrike_data = asyncio.run(extract_data())
-    if not (qualys_data and crowdstrike_data):
-        logger.info(
-            'Both Qualys Data and CrowdStrike Data are empty. Skipping data processing and visualization.',
-        )
+    if not resources.run(run_pipeline(asyncio.Lock())):
         return
-    logger.info('Starting to transfor data for Qualys Data and CrowdStrike Data')
-    processed_data = transform_data(qualys_data, crowdstrike_data)
-    logger.info('Starting to load processed data into mongo db databases')
-    load_data_to_database(processed_data)
     logger.info('Starting to generate the diagram and save to the folder')
     visualize_data()
     end_time = time.time()
@@ -98,16 +282,28 @@ def main():
 if __name__ == '__main__':
     """
     Here, we specify the job to run at a specific time every day.
-    For now it is scheduled to run at every 30 seconds.
+    For now it is scheduled to run at every SCHEDULE_INTERVAL seconds, 30 by default.
+    With SCHEDULER_MODE=daemon the job runs in a long lived event loop instead.
+    With REPLAY_RUN set the job runs once on the spooled pages of that run.
     The while True loop ensures the script keeps running, allowing schedule
     to execute the job at the specified time. schedule.run_pending() checks
     if any scheduled tasks are pending and runs them
     """
-    # Schedule the job to run at a specific time every day
-    schedule.every(30).seconds.do(main)
-    """
-    For more schedule options visit https://schedule.readthedocs.io/en/stable/examples.html#run-a-job-every-x-minute
-    """
-    while True:
-        schedule.run_pending()
-        time.sleep(1)
+    mongo_db.ensure_indexes()
+    if settings.REPLAY_RUN:
+        # Reprocess the spooled run once instead of calling the APIs on a schedule
+        main()
+        resources.close()
+    elif settings.SCHEDULER_MODE == 'daemon':
+        # Long lived event loop which overlaps the visualization with the next fetch
+        resources.run(PipelineScheduler(run_pipeline, visualize_data).run_forever())
+        resources.close()
+    else:
+        # Schedule the job to run at a specific time every day
+        schedule.every(settings.SCHEDULE_INTERVAL).seconds.do(main)
+        """
+        For more schedule options visit https://schedule.readthedocs.io/en/stable/examples.html#run-a-job-every-x-minute
+        """
+        while True:
+            schedule.run_pending()
+            time.sleep(1)
@@ -0,0 +1,290 @@
+from __future__ import annotations
+
+import asyncio
+import cProfile
+import os
+import pstats
+import resource
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from collections.abc import Callable
+from collections.abc import Iterator
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any
+
+from config import settings
+from logger import Logger
+
+logger = Logger().get_logger()
+
+# Stages of the pipeline the metrics are recorded for
+STAGES = ('extract', 'normalize', 'geo_enrich', 'dedup', 'load', 'snapshot', 'visualize')
+# Number of allocation sites written to the tracemalloc report of a run
+TRACEMALLOC_TOP_STATS = 50
+
+
+class PipelineMetrics:
+    """
+    Class to collect the per stage metrics of the pipeline and write them in the Prometheus text format,
+    so they can be scraped with the textfile collector of the node exporter.
+    All the values are counted since the start of the process.
+    """
+
+    def __init__(self):
+        """
+        Initializing the PipelineMetrics class with the metrics file and the profiling mode.
+        """
+        self.path = settings.METRICS_PATH
+        self.profile_mode = settings.PROFILE_MODE
+        self.profile_dir = settings.PROFILE_DIR
+        self._lock = threading.Lock()
+        # Every stage is reported from the start, also before it ran for the first time
+        self.stage_seconds: dict[str, float] = defaultdict(float, dict.fromkeys(STAGES, 0.0))
+        self.stage_calls: dict[str, int] = defaultdict(int, dict.fromkeys(STAGES, 0))
+        self.stage_records: dict[str, int] = defaultdict(int, dict.fromkeys(STAGES, 0))
+        self.fetched_bytes: dict[str, int] = defaultdict(int)
+        self.mongo_operations: dict[str, int] = defaultdict(int)
+        self.cache_hits: dict[str, int] = defaultdict(int)
+        self.cache_misses: dict[str, int] = defaultdict(int)
+        self.runs = 0
+        self.last_run_seconds = 0.0
+        # Name of the worker process the metrics are labeled with, empty outside of the workers
+        self.worker = ''
+        # Profiles of the worker thread calls of the run being profiled with cProfile, None otherwise
+        self._thread_profiles: list[cProfile.Profile] | None = None
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """
+        Measure the wall time of a stage.
+        Stages running several times in a run, like the pages of the streaming pipeline, add up.
+        """
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started_at
+            with self._lock:
+                self.stage_seconds[name] += elapsed
+                self.stage_calls[name] += 1
+
+    async def to_thread(self, function: Callable[..., Any], /, *args: Any, **kwargs: Any) -> Any:
+        """
+        Run the function in a worker thread like asyncio.to_thread. While a run is profiled with cProfile,
+        the call is profiled in its thread, since the profiler of the run only sees the event loop thread.
+        """
+        if self._thread_profiles is None:
+            return await asyncio.to_thread(function, *args, **kwargs)
+        return await asyncio.to_thread(self._profiled_call, function, *args, **kwargs)
+
+    def _profiled_call(self, function: Callable[..., Any], /, *args: Any, **kwargs: Any) -> Any:
+        """
+        Call the function under its own profiler, kept to be merged into the profile of the run.
+        """
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Only one profiler can be active at a time from Python 3.12 on
+            return function(*args, **kwargs)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            profiler.disable()
+            with self._lock:
+                if self._thread_profiles is not None:
+                    self._thread_profiles.append(profiler)
+
+    def add_records(self, stage: str, count: int):
+        """
+        Count the records processed by a stage.
+        """
+        with self._lock:
+            self.stage_records[stage] += count
+
+    def add_fetched_bytes(self, source: str, count: int):
+        """
+        Count the response bytes received from a source.
+        """
+        with self._lock:
+            self.fetched_bytes[source] += count
+
+    def add_mongo_operations(self, operation: str, count: int = 1):
+        """
+        Count the operations issued to the database.
+        """
+        with self._lock:
+            self.mongo_operations[operation] += count
+
+    def add_cache_lookups(self, cache: str, hits: int, misses: int):
+        """
+        Count the hits and misses of a cache.
+        """
+        with self._lock:
+            self.cache_hits[cache] += hits
+            self.cache_misses[cache] += misses
+
+    def use_worker(self, name: str):
+        """
+        Write the metrics of a worker process to its own file next to METRICS_PATH, labeled with the
+        worker name, since the worker processes of a machine would otherwise overwrite each other's file.
+        """
+        self.worker = name
+        if self.path:
+            root, extension = os.path.splitext(self.path)
+            self.path = f'{root}-{name}{extension}'
+
+    def finish_run(self, seconds: float):
+        """
+        Record a completed run and write the metrics file.
+        """
+        with self._lock:
+            self.runs += 1
+            self.last_run_seconds = seconds
+        self.write()
+
+    def render(self) -> str:
+        """
+        Return the metrics in the Prometheus text exposition format.
+        """
+        worker_label = f'worker="{self.worker}",' if self.worker else ''
+        scalar_labels = f'{{worker="{self.worker}"}}' if self.worker else ''
+
+        def family(name: str, kind: str, help_text: str, label: str, values: dict[str, float]) -> list[str]:
+            lines = [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+            lines.extend(
+                f'{name}{{{worker_label}{label}="{key}"}} {value}' for key, value in sorted(values.items())
+            )
+            return lines
+
+        with self._lock:
+            caches = set(self.cache_hits) | set(self.cache_misses)
+            hit_ratios = {
+                cache: self.cache_hits[cache] / (self.cache_hits[cache] + self.cache_misses[cache])
+                for cache in caches
+                if self.cache_hits[cache] + self.cache_misses[cache]
+            }
+            lines = [
+                *family(
+                    'pipeline_stage_seconds_total', 'counter',
+                    'Wall time spent in the stage.', 'stage', self.stage_seconds,
+                ),
+                *family(
+                    'pipeline_stage_calls_total', 'counter',
+                    'Number of times the stage ran.', 'stage', self.stage_calls,
+                ),
+                *family(
+                    'pipeline_stage_records_total', 'counter',
+                    'Records processed by the stage.', 'stage', self.stage_records,
+                ),
+                *family(
+                    'pipeline_fetched_bytes_total', 'counter',
+                    'Response bytes received from the source.', 'source', self.fetched_bytes,
+                ),
+                *family(
+                    'pipeline_mongo_operations_total', 'counter',
+                    'Operations issued to the database.', 'operation', self.mongo_operations,
+                ),
+                *family(
+                    'pipeline_cache_hits_total', 'counter',
+                    'Lookups served by the cache.', 'cache', self.cache_hits,
+                ),
+                *family(
+                    'pipeline_cache_misses_total', 'counter',
+                    'Lookups not served by the cache.', 'cache', self.cache_misses,
+                ),
+                *family(
+                    'pipeline_cache_hit_ratio', 'gauge',
+                    'Share of the lookups served by the cache.', 'cache', hit_ratios,
+                ),
+                '# HELP pipeline_runs_total Completed pipeline runs.',
+                '# TYPE pipeline_runs_total counter',
+                f'pipeline_runs_total{scalar_labels} {self.runs}',
+                '# HELP pipeline_last_run_seconds Wall time of the latest run.',
+                '# TYPE pipeline_last_run_seconds gauge',
+                f'pipeline_last_run_seconds{scalar_labels} {self.last_run_seconds}',
+                # The stages overlap in the streaming pipeline, so only the peak of the process is reported
+                '# HELP pipeline_process_peak_rss_bytes Peak resident set size of the process since it started.',
+                '# TYPE pipeline_process_peak_rss_bytes gauge',
+                # ru_maxrss is in kilobytes on Linux
+                f'pipeline_process_peak_rss_bytes{scalar_labels} {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024}',
+            ]
+        return '\n'.join(lines) + '\n'
+
+    def write(self):
+        """
+        Atomically replace the metrics file, so a scrape never reads a partially written file.
+        Every write goes through its own temporary file, so concurrent writes do not interleave.
+        A failed write is logged and never fails the run.
+        """
+        if not self.path:
+            return
+        directory = os.path.dirname(self.path)
+        temporary_path = None
+        try:
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            file_descriptor, temporary_path = tempfile.mkstemp(
+                dir=directory or '.', prefix='.metrics', suffix='.tmp',
+            )
+            with os.fdopen(file_descriptor, 'w') as metrics_file:
+                metrics_file.write(self.render())
+            # mkstemp creates the file readable by the owner only, the textfile collector may run as another user
+            os.chmod(temporary_path, 0o644)
+            os.replace(temporary_path, self.path)
+        except OSError as e:
+            logger.error(f'Error during writing the metrics file {self.path} due to reason: {e!r}')
+            if temporary_path is not None:
+                try:
+                    os.remove(temporary_path)
+                except OSError:
+                    pass
+
+    @contextmanager
+    def profile(self) -> Iterator[None]:
+        """
+        Capture a profile of the run when PROFILE_MODE is set and save it to the profile directory:
+        'cprofile' saves the cProfile stats of the calling thread merged with the ones of the calls run
+        through `to_thread`, to be read with pstats or snakeviz,
+        'tracemalloc' saves the allocation sites holding the most memory at the end of the run.
+        """
+        if self.profile_mode not in ('cprofile', 'tracemalloc'):
+            yield
+            return
+        os.makedirs(self.profile_dir, exist_ok=True)
+        run_name = datetime.now().strftime('%Y-%m-%dT%H-%M-%S-%f')
+        if self.profile_mode == 'cprofile':
+            profiler = cProfile.Profile()
+            self._thread_profiles = []
+            profiler.enable()
+            try:
+                yield
+            finally:
+                profiler.disable()
+                with self._lock:
+                    thread_profiles, self._thread_profiles = self._thread_profiles, None
+                stats = pstats.Stats(profiler)
+                for thread_profile in thread_profiles:
+                    stats.add(thread_profile)
+                path = os.path.join(self.profile_dir, f'{run_name}.prof')
+                stats.dump_stats(path)
+                logger.info(f'Saved the cProfile stats of the run to {path}')
+            return
+        tracemalloc.start()
+        try:
+            yield
+        finally:
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            path = os.path.join(self.profile_dir, f'{run_name}.tracemalloc.txt')
+            with open(path, 'w') as report:
+                for statistic in snapshot.statistics('lineno')[:TRACEMALLOC_TOP_STATS]:
+                    report.write(f'{statistic}\n')
+            logger.info(f'Saved the tracemalloc report of the run to {path}')
+
+
+metrics = PipelineMetrics()
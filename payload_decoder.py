@@ -0,0 +1,143 @@
+from __future__ import annotations
+
+from typing import Any
+from typing import TypedDict
+
+import msgspec
+
+from config import settings
+from logger import Logger
+from source_adapters import CROWDSTRIKE_ADAPTER
+from source_adapters import QUALYS_ADAPTER
+from source_adapters import source_adapters
+from source_adapters import SourceAdapter
+
+logger = Logger().get_logger()
+
+
+class QualysHostAssetInterface(TypedDict, total=False):
+    macAddress: str | None
+
+
+class QualysNetworkInterfaceItem(TypedDict, total=False):
+    HostAssetInterface: QualysHostAssetInterface
+
+
+class QualysNetworkInterface(TypedDict, total=False):
+    list: list[QualysNetworkInterfaceItem]
+
+
+class QualysAgentInfo(TypedDict, total=False):
+    platform: str | None
+    location: str | None
+    agentVersion: str | None
+    status: str | None
+
+
+class QualysRecord(TypedDict, total=False):
+    """
+    Fields of a Qualys host record read by normalize_qualys_data.
+    """
+    _id: int | str
+    dnsHostName: str | None
+    address: str | None
+    os: str | None
+    modified: str | None
+    created: str | None
+    manufacturer: str | None
+    model: str | None
+    cloudProvider: str | None
+    agentInfo: QualysAgentInfo
+    networkInterface: QualysNetworkInterface
+
+
+class CrowdStrikeRecord(TypedDict, total=False):
+    """
+    Fields of a CrowdStrike device record read by normalize_crowdstrike_data and the geo enricher.
+    """
+    device_id: str | None
+    hostname: str | None
+    local_ip: str | None
+    mac_address: str | None
+    platform_name: str | None
+    os_version: str | None
+    last_seen: str | None
+    system_manufacturer: str | None
+    system_product_name: str | None
+    external_ip: str | None
+    agent_version: str | None
+    status: str | None
+    first_seen: str | None
+    service_provider: str | None
+
+
+class PayloadDecoder:
+    """
+    Class to decode the API responses of the sources straight into records holding only the
+    fields the normalizers read. The response bytes are parsed against the schema of the source,
+    so the fields outside of it, like the rest of `agentInfo` and `networkInterface`, are skipped
+    without allocating Python objects for them. The records stay plain dicts, so every consumer
+    of the raw records works on them unchanged.
+    A response which does not match the schema is decoded with json as before.
+    The schemas cover the paths of the built-in adapters only, so a source whose adapter was replaced
+    through SOURCE_ADAPTERS_PATH is decoded in full.
+    """
+
+    # Schema of the records of every source, with the adapter whose paths it covers
+    SOURCE_RECORDS: dict[str, tuple[SourceAdapter, type]] = {
+        'qualys': (QUALYS_ADAPTER, QualysRecord),
+        'crowdstrike': (CROWDSTRIKE_ADAPTER, CrowdStrikeRecord),
+    }
+
+    def __init__(self):
+        """
+        Initializing the PayloadDecoder class with one page and one record decoder per source
+        still mapped by the adapter its schema was written for.
+        """
+        self.enabled = settings.FETCH_TYPED_DECODE
+        records = {}
+        for source, (adapter, record) in self.SOURCE_RECORDS.items():
+            if source_adapters[source] is adapter:
+                records[source] = record
+            else:
+                logger.info(f'The {source} adapter was replaced, decoding all the fields of its records')
+        self.page_decoders = {
+            source: msgspec.json.Decoder(list[record])
+            for source, record in records.items()
+        }
+        self.record_decoders = {
+            source: msgspec.json.Decoder(record)
+            for source, record in records.items()
+        }
+        self.any_decoder = msgspec.json.Decoder()
+
+    def _decode(self, decoders: dict[str, msgspec.json.Decoder], source: str, body: bytes) -> Any:
+        """
+        Decode the body with the decoder of the source, falling back to untyped decoding when the
+        source has no schema, typed decoding is disabled or the body does not match the schema.
+        """
+        decoder = decoders.get(source) if self.enabled else None
+        if decoder is not None:
+            try:
+                return decoder.decode(body)
+            except msgspec.ValidationError as e:
+                logger.info(
+                    f'{source} payload does not match its schema ({e}), decoding all of its fields',
+                )
+        return self.any_decoder.decode(body)
+
+    def decode_page(self, source: str, body: bytes) -> Any:
+        """
+        Decode a response body of the source holding a list of records.
+        Raises msgspec.DecodeError, a ValueError, on malformed JSON.
+        """
+        return self._decode(self.page_decoders, source, body)
+
+    def decode_record(self, source: str, line: bytes) -> Any:
+        """
+        Decode one record of the source, e.g. a line of a spooled segment.
+        """
+        return self._decode(self.record_decoders, source, line)
+
+
+payload_decoder = PayloadDecoder()
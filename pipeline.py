@@ -0,0 +1,172 @@
+from __future__ import annotations
+
+import asyncio
+from datetime import datetime
+from typing import Any
+from typing import TYPE_CHECKING
+
+from config import settings
+from data_fetcher import data_fetcher
+from data_normalizer import DataNormalizer
+from data_normalizer import HostInfo
+from databases import mongo_db
+from geo_enricher import geo_enricher
+from logger import Logger
+from metrics import metrics
+from source_adapters import source_adapters
+
+if TYPE_CHECKING:
+    from snapshot import SnapshotWriter
+
+logger = Logger().get_logger()
+
+# Marks the end of the stream on the queues between the stages
+DONE = object()
+
+
+class StreamingPipeline:
+    """
+    Class to run fetch, normalize, dedup and load as chained stages with bounded queues between them.
+    Memory is capped by the queue and batch sizes instead of the total number of hosts.
+    """
+
+    def __init__(self):
+        """
+        Initializing the StreamingPipeline class with the queue and batch sizes.
+        """
+        self.queue_size = max(1, settings.STREAM_QUEUE_SIZE)
+        self.batch_size = mongo_db.batch_size * mongo_db.write_workers
+        self.data_normalizer = DataNormalizer()
+
+    async def fetch_stage(self, output: asyncio.Queue, since: dict[str, datetime] | None, latest: dict[str, datetime], incomplete: set[str]):
+        """
+        Stream the pages of both sources into the output queue, keeping only the records newer
+        than the watermarks on incremental runs, and track the newest record per source.
+        The sources which could not be fetched completely are added to `incomplete`.
+        """
+        since = since or {}
+        with metrics.stage('extract'):
+            async for source, page in data_fetcher.stream_all_pages(incomplete):
+                metrics.add_records('extract', len(page))
+                page_latest = data_fetcher.latest_timestamp(source, page)
+                if page_latest and (latest.get(source) is None or page_latest > latest[source]):
+                    latest[source] = page_latest
+                page = data_fetcher.filter_since(source, page, since.get(source))
+                if page:
+                    await output.put((source, page))
+        await output.put(DONE)
+
+    async def normalize_stage(self, source_queue: asyncio.Queue, output: asyncio.Queue):
+        """
+        Normalize every page into HostInfo objects, resolving the locations first for the sources,
+        like CrowdStrike, whose location comes from an IP address.
+        """
+        while (item := await source_queue.get()) is not DONE:
+            source, page = item
+            locations = None
+            if source_adapters[source].geo is not None:
+                with metrics.stage('geo_enrich'):
+                    locations = await geo_enricher.enrich_source_data(source, page)
+                metrics.add_records('geo_enrich', len(locations))
+            with metrics.stage('normalize'):
+                hosts = await metrics.to_thread(
+                    self.data_normalizer.normalize_records, source, page, locations,
+                )
+            metrics.add_records('normalize', len(hosts))
+            await output.put(hosts)
+        await output.put(DONE)
+
+    async def dedup_stage(self, source_queue: asyncio.Queue, output: asyncio.Queue):
+        """
+        Drop the hosts which are not newer than a host with the same host_id in the pending batch
+        and emit the rest in batches of `batch_size`.
+        Only the pending batch is kept in memory. A host repeated in a later batch is emitted again and
+        settled on load, where a host only replaces the stored one when its updated value is newer.
+        """
+        batch: dict[str, HostInfo] = {}
+        while (hosts := await source_queue.get()) is not DONE:
+            full_batches = []
+            with metrics.stage('dedup'):
+                for host in hosts:
+                    pending = batch.get(host.host_id)
+                    if pending is not None and not (
+                        host.updated and (pending.updated is None or host.updated > pending.updated)
+                    ):
+                        continue
+                    batch[host.host_id] = host
+                    if len(batch) >= self.batch_size:
+                        full_batches.append(list(batch.values()))
+                        batch = {}
+            for full_batch in full_batches:
+                metrics.add_records('dedup', len(full_batch))
+                await output.put(full_batch)
+        if batch:
+            metrics.add_records('dedup', len(batch))
+            await output.put(list(batch.values()))
+        await output.put(DONE)
+
+    async def load_stage(self, source_queue: asyncio.Queue, results: list[dict[str, Any]], snapshot_writer: SnapshotWriter | None = None):
+        """
+        Write every batch of unique hosts into the database, one batch at a time,
+        and into the snapshot of the run when snapshots are enabled.
+        """
+        while (batch := await source_queue.get()) is not DONE:
+            with metrics.stage('load'):
+                batch_results = await metrics.to_thread(
+                    mongo_db.insert_data_operations, batch,
+                )
+            metrics.add_records(
+                'load', sum(result['operations'] for result in batch_results),
+            )
+            results.extend(batch_results)
+            if snapshot_writer is not None:
+                with metrics.stage('snapshot'):
+                    await metrics.to_thread(snapshot_writer.write_hosts, batch)
+                metrics.add_records('snapshot', len(batch))
+
+    async def run(self, since: dict[str, datetime] | None = None, incomplete: set[str] | None = None) -> tuple[list[dict[str, Any]], dict[str, datetime]]:
+        """
+        Run all the stages concurrently until the stream is exhausted.
+        The snapshot of the run is only completed when every stage completed. A host can be in it
+        more than once, as a newer version emitted later, which is deduplicated when reading it.
+        The sources which could not be fetched completely are added to `incomplete`, and then the
+        snapshot of the run does not count as a full one.
+        Returns the per batch load results and the newest record update time per source.
+        """
+        incomplete = set() if incomplete is None else incomplete
+        pages: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        hosts: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        batches: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        results: list[dict[str, Any]] = []
+        latest: dict[str, datetime] = {}
+        snapshot_writer = None
+        if settings.SNAPSHOT_ENABLED:
+            # pyarrow is only imported when snapshots are enabled
+            from snapshot import inventory_snapshot
+
+            snapshot_writer = inventory_snapshot.start_run()
+        tasks = [
+            asyncio.create_task(self.fetch_stage(pages, since, latest, incomplete)),
+            asyncio.create_task(self.normalize_stage(pages, hosts)),
+            asyncio.create_task(self.dedup_stage(hosts, batches)),
+            asyncio.create_task(self.load_stage(batches, results, snapshot_writer)),
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            if snapshot_writer is not None:
+                snapshot_writer.abort()
+            raise
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        if snapshot_writer is not None and await asyncio.to_thread(snapshot_writer.close, full=since is None and not incomplete, unique=False):
+            await asyncio.to_thread(inventory_snapshot.prune)
+        logger.info(
+            f'Completed the streaming pipeline with {len(results)} load batches',
+        )
+        return results, latest
+
+
+streaming_pipeline = StreamingPipeline()
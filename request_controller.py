@@ -0,0 +1,161 @@
+from __future__ import annotations
+
+import asyncio
+import math
+import random
+from datetime import datetime
+from datetime import timezone
+from email.utils import parsedate_to_datetime
+
+from config import settings
+from logger import Logger
+
+logger = Logger().get_logger()
+
+# Status codes of the responses which are worth retrying
+RETRYABLE_STATUSES = {408, 425, 429, 500, 502, 503, 504}
+# Status codes telling the client to slow down
+THROTTLE_STATUSES = {429, 503}
+# Factor the concurrency limit is multiplied with on throttling or high latency
+DECREASE_FACTOR = 0.5
+# Weight of the latest latency in the moving average of the request latency
+LATENCY_SMOOTHING = 0.2
+
+
+class AdaptiveLimiter:
+    """
+    Class to bound the requests in flight to one source with an AIMD limit:
+    every successful request below the latency target, sent while the limit was reached, raises
+    the limit by 1/limit, so by one per round of requests, and a throttled or slow request halves it,
+    at most once per round trip.
+    """
+
+    def __init__(self, source: str, initial: int, minimum: int, maximum: int, latency_target: float):
+        """
+        Initializing the AdaptiveLimiter class with the bounds of the concurrency limit.
+        """
+        self.source = source
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = float(min(self.maximum, max(self.minimum, initial)))
+        self.latency_target = latency_target
+        self.average_latency = None
+        self.in_flight = 0
+        self._decreased_at = 0.0
+        self._condition = None
+        self._loop = None
+
+    @property
+    def concurrency(self) -> int:
+        """
+        Return the number of requests currently allowed in flight.
+        """
+        return int(self.limit)
+
+    @property
+    def condition(self) -> asyncio.Condition:
+        """
+        Return the condition the requests wait on, created again when used from another event loop.
+        """
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._condition = asyncio.Condition()
+            self.in_flight = 0
+        return self._condition
+
+    async def acquire(self):
+        """
+        Wait until a request to the source may be sent.
+        """
+        condition = self.condition
+        async with condition:
+            await condition.wait_for(lambda: self.in_flight < self.concurrency)
+            self.in_flight += 1
+
+    async def release(self, latency: float, throttled: bool):
+        """
+        Record the outcome of a request and adapt the limit to it.
+        """
+        condition = self.condition
+        async with condition:
+            # The limit only grows while it is what holds the requests back
+            limited = self.in_flight >= self.concurrency
+            self.in_flight -= 1
+            if self.average_latency is None:
+                self.average_latency = latency
+            else:
+                self.average_latency += LATENCY_SMOOTHING * (latency - self.average_latency)
+            now = self._loop.time()
+            if throttled or latency > self.latency_target:
+                # The requests in flight see the same congestion, so react once per round trip
+                if now - self._decreased_at >= self.average_latency:
+                    self.limit = max(self.minimum, self.limit * DECREASE_FACTOR)
+                    self._decreased_at = now
+                    logger.info(
+                        f'Decreased the concurrency of {self.source} to {self.concurrency} '
+                        f'after a {"throttled" if throttled else "slow"} request of {latency:.2f} seconds',
+                    )
+            elif limited:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            condition.notify_all()
+
+
+class RequestController:
+    """
+    Class to hold the adaptive concurrency limit of every source and the retry policy of the requests.
+    """
+
+    def __init__(self):
+        """
+        Initializing the RequestController class with the retry and concurrency settings.
+        """
+        self.max_retries = max(0, settings.FETCH_MAX_RETRIES)
+        self.backoff_base = settings.FETCH_BACKOFF_BASE
+        self.backoff_max = settings.FETCH_BACKOFF_MAX
+        self.initial_concurrency = max(1, settings.FETCH_PAGE_CONCURRENCY)
+        self.max_concurrency = max(1, settings.FETCH_MAX_CONCURRENCY)
+        self.latency_target = settings.FETCH_LATENCY_TARGET
+        self.limiters: dict[str, AdaptiveLimiter] = {}
+
+    def limiter(self, source: str) -> AdaptiveLimiter:
+        """
+        Return the limiter of the source, creating it on first use.
+        The limit is kept between runs so every run starts from what the source handled last time.
+        """
+        if source not in self.limiters:
+            self.limiters[source] = AdaptiveLimiter(
+                source, self.initial_concurrency, 1, self.max_concurrency, self.latency_target,
+            )
+        return self.limiters[source]
+
+    def should_retry(self, status: int | None, attempt: int) -> bool:
+        """
+        Return whether a request which failed with the status, None for a connection error, is sent again.
+        """
+        return attempt < self.max_retries and (status is None or status in RETRYABLE_STATUSES)
+
+    def retry_delay(self, attempt: int, retry_after: str | None = None) -> float:
+        """
+        Return how long to wait before the next attempt.
+        The Retry-After header is honored, in seconds or as an HTTP date. Otherwise the delay is
+        drawn from an exponential backoff with full jitter, so the clients do not retry in lockstep.
+        """
+        if retry_after:
+            try:
+                return min(self.backoff_max, max(0.0, float(retry_after)))
+            except ValueError:
+                pass
+            try:
+                retry_at = parsedate_to_datetime(retry_after)
+                if retry_at.tzinfo is None:
+                    retry_at = retry_at.replace(tzinfo=timezone.utc)
+                delay = (retry_at - datetime.now(timezone.utc)).total_seconds()
+                return min(self.backoff_max, max(0.0, delay))
+            except (TypeError, ValueError):
+                pass
+        ceiling = min(self.backoff_max, self.backoff_base * math.pow(2, attempt))
+        return random.uniform(0, ceiling)
+
+
+request_controller = RequestController()
@@ -0,0 +1,166 @@
+from __future__ import annotations
+
+import asyncio
+import threading
+from collections.abc import Coroutine
+from typing import Any
+from typing import TYPE_CHECKING
+
+import aiohttp
+from pymongo import MongoClient
+
+from config import settings
+from logger import Logger
+
+if TYPE_CHECKING:
+    import requests
+
+logger = Logger().get_logger()
+
+
+async def on_connection_acquired(session: aiohttp.ClientSession, trace_config_ctx: Any, params: Any):
+    """
+    Record when the request got its connection, new or reused, in the dict passed as `trace_request_ctx`,
+    so the time spent waiting for a free connection of the pool can be told apart from the upstream latency.
+    """
+    if isinstance(trace_config_ctx.trace_request_ctx, dict):
+        trace_config_ctx.trace_request_ctx['connected_at'] = asyncio.get_running_loop().time()
+
+
+def connection_trace_config() -> aiohttp.TraceConfig:
+    """
+    Return the trace config recording when the requests of a session acquired their connection.
+    """
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_connection_create_end.append(on_connection_acquired)
+    trace_config.on_connection_reuseconn.append(on_connection_acquired)
+    return trace_config
+
+
+class ResourceManager:
+    """
+    Class owning the network clients shared by all the modules for the lifetime of the process:
+    one pooled aiohttp session per upstream, one requests session and one MongoClient.
+    Connections, TLS handshakes and DNS lookups are reused across the pipeline runs.
+    """
+
+    def __init__(self):
+        """
+        Initializing the ResourceManager class with the pool settings.
+        The clients are created on first use.
+        """
+        self.http_pool_limit = max(1, settings.HTTP_POOL_LIMIT)
+        self.dns_cache_ttl = settings.HTTP_DNS_CACHE_TTL
+        self.keepalive_timeout = settings.HTTP_KEEPALIVE_TIMEOUT
+        self.mongo_max_pool_size = max(1, settings.MONGO_MAX_POOL_SIZE)
+        self._lock = threading.Lock()
+        self._loop = None
+        self._sessions: dict[str, aiohttp.ClientSession] = {}
+        self._sessions_loop = None
+        self._requests_session = None
+        self._mongo_client = None
+
+    @property
+    def event_loop(self) -> asyncio.AbstractEventLoop:
+        """
+        Return the event loop of the process, creating it on first use.
+        Running every pipeline run on the same loop keeps the aiohttp sessions bound to it alive.
+        """
+        if self._loop is None or self._loop.is_closed():
+            self._loop = asyncio.new_event_loop()
+        return self._loop
+
+    def run(self, coroutine: Coroutine[Any, Any, Any]) -> Any:
+        """
+        Run the coroutine to completion on the event loop of the process.
+        """
+        return self.event_loop.run_until_complete(coroutine)
+
+    def http_session(self, upstream: str, limit: int | None = None) -> aiohttp.ClientSession:
+        """
+        Return the pooled aiohttp session of the upstream, creating it on first use.
+        The connector keeps idle connections alive for `keepalive_timeout` seconds, caches DNS lookups
+        for `dns_cache_ttl` seconds and opens at most `limit` connections. A request passing a dict as
+        `trace_request_ctx` gets the time it acquired its connection in the 'connected_at' key.
+        Sessions belong to the event loop they were created on, so they are created again when
+        called from another loop.
+        """
+        loop = asyncio.get_running_loop()
+        if self._sessions_loop is not loop:
+            if self._sessions:
+                logger.info(
+                    'Event loop changed, creating new HTTP sessions for the upstreams',
+                )
+            self._sessions = {}
+            self._sessions_loop = loop
+        session = self._sessions.get(upstream)
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=limit or self.http_pool_limit,
+                ttl_dns_cache=self.dns_cache_ttl,
+                keepalive_timeout=self.keepalive_timeout,
+            )
+            session = aiohttp.ClientSession(
+                connector=connector, trace_configs=[connection_trace_config()],
+            )
+            self._sessions[upstream] = session
+        return session
+
+    @property
+    def requests_session(self) -> requests.Session:
+        """
+        Return the shared requests session, creating it on first use.
+        requests is only imported then, as only the synchronous location lookup uses it.
+        """
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        with self._lock:
+            if self._requests_session is None:
+                adapter = HTTPAdapter(
+                    pool_connections=self.http_pool_limit,
+                    pool_maxsize=self.http_pool_limit,
+                )
+                session = requests.Session()
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self._requests_session = session
+            return self._requests_session
+
+    @property
+    def mongo_client(self) -> MongoClient:
+        """
+        Return the shared MongoClient, creating it on first use.
+        """
+        with self._lock:
+            if self._mongo_client is None:
+                self._mongo_client = MongoClient(
+                    settings.MONGO_DB_HOST, settings.MONGO_DB_PORT,
+                    maxPoolSize=self.mongo_max_pool_size,
+                )
+            return self._mongo_client
+
+    async def close_http_sessions(self):
+        """
+        Close the aiohttp sessions of all the upstreams.
+        """
+        sessions, self._sessions = self._sessions, {}
+        for session in sessions.values():
+            await session.close()
+
+    def close(self):
+        """
+        Close all the clients and the event loop.
+        """
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.run_until_complete(self.close_http_sessions())
+            self._loop.close()
+        if self._requests_session is not None:
+            self._requests_session.close()
+            self._requests_session = None
+        if self._mongo_client is not None:
+            self._mongo_client.close()
+            self._mongo_client = None
+
+
+resources = ResourceManager()
@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+import asyncio
+import random
+import signal
+from collections.abc import Awaitable
+from collections.abc import Callable
+
+from config import settings
+from logger import Logger
+
+logger = Logger().get_logger()
+
+# Weight of the latest run duration in the moving average the adaptive interval is based on
+DURATION_SMOOTHING = 0.3
+# The adaptive interval leaves at least this many run durations between two run starts
+ADAPTIVE_INTERVAL_FACTOR = 2
+
+
+class PipelineScheduler:
+    """
+    Class to run the pipeline periodically in a single long lived event loop.
+    Fetch, transform and load of a run are awaited before the next run is scheduled, so runs never
+    pile up, while the visualization of a run keeps going in the background and overlaps the fetch
+    of the next run. Loads are serialized by a lock and only one visualization runs at a time.
+    """
+
+    def __init__(self, run_stages: Callable[[asyncio.Lock], Awaitable[bool]], visualize: Callable[[], None]):
+        """
+        Initializing the PipelineScheduler class with the pipeline stages and the interval settings.
+        `run_stages` fetches, transforms and loads the data, taking the load lock around the load,
+        and returns whether there is anything new to visualize.
+        `visualize` is a blocking callable which is run in a worker thread.
+        """
+        self.run_stages = run_stages
+        self.visualize = visualize
+        self.interval = max(1, settings.SCHEDULE_INTERVAL)
+        self.max_interval = max(self.interval, settings.SCHEDULE_MAX_INTERVAL)
+        self.jitter = max(0.0, settings.SCHEDULE_JITTER)
+        self.adaptive = settings.SCHEDULE_ADAPTIVE
+        self.average_duration = None
+        self.load_lock = None
+        self.stopping = None
+        self.visualize_task = None
+
+    def next_interval(self, duration: float) -> float:
+        """
+        Return the time between the start of this run and the start of the next one.
+        With the adaptive interval enabled it grows with the moving average of the run duration,
+        between the configured interval and the maximum interval.
+        """
+        if self.average_duration is None:
+            self.average_duration = duration
+        else:
+            self.average_duration += DURATION_SMOOTHING * (duration - self.average_duration)
+        if not self.adaptive:
+            return self.interval
+        return min(
+            self.max_interval,
+            max(self.interval, ADAPTIVE_INTERVAL_FACTOR * self.average_duration),
+        )
+
+    def next_delay(self, duration: float) -> float:
+        """
+        Return how long to wait after a run which took `duration` seconds.
+        A run which overran the interval is followed by the next one straight away. A random jitter
+        of up to `jitter` times the interval spreads the runs of several instances over time.
+        """
+        interval = self.next_interval(duration)
+        return max(0.0, interval - duration) + random.uniform(0, self.jitter * interval)
+
+    async def visualize_in_background(self):
+        """
+        Start the visualization of the latest load, once the previous visualization has finished.
+        """
+        await self.wait_for_visualization()
+        self.visualize_task = asyncio.create_task(
+            asyncio.to_thread(self.visualize),
+        )
+
+    async def wait_for_visualization(self):
+        """
+        Wait for the running visualization, logging its failure instead of raising it.
+        """
+        if self.visualize_task is None:
+            return
+        try:
+            await self.visualize_task
+        except Exception as e:
+            logger.error(f'Error during visualizing the data due to reason: {e}')
+        self.visualize_task = None
+
+    async def run_once(self):
+        """
+        Run fetch, transform and load, then start the visualization without waiting for it.
+        A failing run is logged and does not stop the scheduler.
+        """
+        try:
+            if await self.run_stages(self.load_lock):
+                await self.visualize_in_background()
+        except Exception as e:
+            logger.error(f'Error during the scheduled run due to reason: {e}')
+
+    def stop(self):
+        """
+        Ask the scheduler to stop after the current run.
+        """
+        if self.stopping is not None:
+            self.stopping.set()
+
+    async def run_forever(self):
+        """
+        Run the pipeline until SIGINT or SIGTERM is received, then wait for the running visualization.
+        """
+        loop = asyncio.get_running_loop()
+        self.load_lock = asyncio.Lock()
+        self.stopping = asyncio.Event()
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signal_number, self.stop)
+        logger.info(
+            f'Starting the scheduler with an interval of {self.interval} seconds',
+        )
+        while not self.stopping.is_set():
+            started_at = loop.time()
+            await self.run_once()
+            duration = loop.time() - started_at
+            delay = self.next_delay(duration)
+            logger.info(
+                f'Scheduled run took {duration:.2f} seconds, starting the next run in {delay:.2f} seconds',
+            )
+            try:
+                await asyncio.wait_for(self.stopping.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+        await self.wait_for_visualization()
+        logger.info('Stopped the scheduler')
@@ -0,0 +1,320 @@
+from __future__ import annotations
+
+import contextlib
+import json
+import os
+import shutil
+from collections.abc import Iterable
+from dataclasses import fields
+from datetime import datetime
+from typing import Any
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from config import settings
+from data_normalizer import HostInfo
+from databases import host_fields
+from logger import Logger
+
+logger = Logger().get_logger()
+
+# File of a snapshot run written once all its parts are, a run without it is incomplete
+MANIFEST_FILE = 'manifest.json'
+# File marking a run one of whose parts could not be written, so it is never completed
+FAILED_FILE = 'failed'
+# String columns with a value per host, every other string column is dictionary encoded
+UNIQUE_STRING_COLUMNS = ('host_id', 'hostname', 'ip_address', 'mac_address')
+TIMESTAMP_COLUMNS = ('last_seen', 'created', 'updated', 'first_seen')
+
+
+def snapshot_schema() -> pa.Schema:
+    """
+    Return the Arrow schema of the HostInfo fields: dictionary encoded strings for the columns with few
+    distinct values, plain strings for the ones with a value per host and native timestamps.
+    """
+    columns = []
+    for field in fields(HostInfo):
+        if field.name in TIMESTAMP_COLUMNS:
+            columns.append(pa.field(field.name, pa.timestamp('us')))
+        elif field.name in UNIQUE_STRING_COLUMNS:
+            columns.append(pa.field(field.name, pa.string()))
+        else:
+            columns.append(pa.field(field.name, pa.dictionary(pa.int32(), pa.string())))
+    return pa.schema(columns)
+
+
+SNAPSHOT_SCHEMA = snapshot_schema()
+
+
+def column_array(field: pa.Field, values: tuple[Any, ...]) -> pa.Array:
+    """
+    Convert the values of one HostInfo field to an Arrow array of the type of the field.
+    Values of an unexpected type, e.g. numbers from a configured source, are converted to strings,
+    or to missing timestamps.
+    """
+    if pa.types.is_timestamp(field.type):
+        try:
+            return pa.array(values, type=field.type)
+        except (pa.ArrowTypeError, pa.ArrowInvalid):
+            return pa.array(pd.to_datetime(pd.Series(values, dtype=object), errors='coerce'), type=field.type)
+    try:
+        array = pa.array(values, type=pa.string())
+    except (pa.ArrowTypeError, pa.ArrowInvalid):
+        array = pa.array(
+            [value if value is None or isinstance(value, str) else str(value) for value in values],
+            type=pa.string(),
+        )
+    return array.dictionary_encode() if pa.types.is_dictionary(field.type) else array
+
+
+def hosts_table(hosts: list[Any]) -> pa.Table:
+    """
+    Build the Arrow table of the hosts, reading all the fields of a host with one call.
+    """
+    _, values, _ = host_fields(type(hosts[0]))
+    columns = zip(*map(values, hosts))
+    return pa.Table.from_arrays(
+        [column_array(field, column) for field, column in zip(SNAPSHOT_SCHEMA, columns)],
+        schema=SNAPSHOT_SCHEMA,
+    )
+
+
+class SnapshotWriter:
+    """
+    Class to write the hosts of one run to a Parquet file, one row group per written batch of hosts.
+    The file is written under a temporary name and the manifest is written last, so readers never see
+    a partial run. Failing to write is logged and aborts the snapshot of the run without failing the run.
+    """
+
+    def __init__(self, directory: str):
+        """
+        Initializing the SnapshotWriter class with the directory of the run.
+        """
+        self.directory = directory
+        self.path = os.path.join(directory, 'part-00000.parquet')
+        self.records = 0
+        self.aborted = False
+        self._writer = None
+        os.makedirs(directory, exist_ok=True)
+
+    def write_hosts(self, hosts: list[Any]):
+        """
+        Append the hosts to the Parquet file of the run.
+        """
+        if not hosts or self.aborted:
+            return
+        try:
+            if self._writer is None:
+                self._writer = pq.ParquetWriter(f'{self.path}.tmp', SNAPSHOT_SCHEMA)
+            self._writer.write_table(hosts_table(hosts))
+        except (OSError, pa.ArrowException) as e:
+            logger.error(f'Error during writing the snapshot due to reason: {e!r}')
+            self.abort()
+            return
+        self.records += len(hosts)
+
+    def close(self, full: bool, unique: bool) -> bool:
+        """
+        Close the Parquet file and write the manifest of the run.
+        `full` tells whether the run holds the whole inventory and `unique` whether every host is in it once.
+        Returns whether the run is complete.
+        """
+        if self.aborted:
+            return False
+        try:
+            if self._writer is not None:
+                self._writer.close()
+                os.replace(f'{self.path}.tmp', self.path)
+            write_manifest(self.directory, full, unique, self.records)
+        except (OSError, pa.ArrowException) as e:
+            logger.error(f'Error during writing the snapshot due to reason: {e!r}')
+            self.abort()
+            return False
+        return True
+
+    def abort(self):
+        """
+        Close the Parquet file without writing the manifest, leaving the run incomplete.
+        """
+        self.aborted = True
+        if self._writer is not None:
+            try:
+                self._writer.close()
+            except (OSError, pa.ArrowException):
+                pass
+            self._writer = None
+        logger.error(f'Writing the snapshot to {self.directory} was aborted, the run is incomplete')
+
+
+def write_manifest(directory: str, full: bool, unique: bool, records: int):
+    """
+    Write the manifest completing the snapshot run in the directory.
+    """
+    manifest = {'full': full, 'unique': unique, 'records': records}
+    with open(os.path.join(directory, f'{MANIFEST_FILE}.tmp'), 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+    os.replace(os.path.join(directory, f'{MANIFEST_FILE}.tmp'), os.path.join(directory, MANIFEST_FILE))
+    logger.info(f'Wrote the snapshot of {records} hosts to {directory}')
+
+
+class InventorySnapshot:
+    """
+    Class to keep a columnar snapshot of the deduplicated hosts of every run as Parquet files,
+    partitioned per run in `run=<time>` directories, and to read the current inventory back from it.
+    An incremental run only holds the hosts it loaded, so the inventory is read from the newest full run
+    and the complete runs after it, keeping the newest version of every host.
+    Runs before the newest full run are removed.
+    """
+
+    def __init__(self):
+        """
+        Initializing the InventorySnapshot class with the snapshot directory.
+        """
+        self.enabled = settings.SNAPSHOT_ENABLED
+        self.directory = settings.SNAPSHOT_DIR
+
+    def run_directory(self, run: str) -> str:
+        """
+        Return the directory of the run.
+        """
+        return os.path.join(self.directory, f'run={run}')
+
+    def start_run(self, run: str | None = None) -> SnapshotWriter | None:
+        """
+        Return the writer of a new snapshot run, or None when snapshots are disabled.
+        """
+        if not self.enabled:
+            return None
+        run = run or datetime.now().strftime('%Y-%m-%dT%H-%M-%S-%f')
+        return SnapshotWriter(self.run_directory(run))
+
+    def write_run(self, hosts: list[Any], full: bool) -> int:
+        """
+        Write the deduplicated hosts of a run as a complete snapshot run.
+        Returns the number of written hosts.
+        """
+        writer = self.start_run()
+        if writer is None:
+            return 0
+        writer.write_hosts(hosts)
+        if not writer.close(full=full, unique=True):
+            return 0
+        self.prune()
+        return writer.records
+
+    def write_part(self, run: str, part: str, hosts: list[Any]):
+        """
+        Write the hosts of one part of a run, e.g. one work unit, as its own Parquet file.
+        A part written again, when the unit is processed again, replaces the previous file.
+        Failing to write a part is logged and marks the run failed without failing the unit.
+        """
+        if not self.enabled or not hosts:
+            return
+        directory = self.run_directory(run)
+        path = os.path.join(directory, f'{part}.parquet')
+        try:
+            os.makedirs(directory, exist_ok=True)
+            pq.write_table(hosts_table(hosts), f'{path}.tmp')
+            os.replace(f'{path}.tmp', path)
+        except (OSError, pa.ArrowException) as e:
+            logger.error(f'Error during writing the snapshot part {path} due to reason: {e!r}')
+            with contextlib.suppress(OSError), open(os.path.join(directory, FAILED_FILE), 'w'):
+                pass
+
+    def finish_run(self, run: str, full: bool):
+        """
+        Complete the run whose parts were written with `write_part`, unless writing a part failed.
+        The parts may hold several versions of a host, which are deduplicated when reading.
+        """
+        if not self.enabled:
+            return
+        directory = self.run_directory(run)
+        if os.path.exists(os.path.join(directory, FAILED_FILE)):
+            logger.error(f'Writing the snapshot to {directory} failed, the run is incomplete')
+            return
+        try:
+            os.makedirs(directory, exist_ok=True)
+            records = sum(
+                pq.ParquetFile(path).metadata.num_rows for path in self.part_files(directory)
+            )
+            write_manifest(directory, full, unique=False, records=records)
+        except (OSError, pa.ArrowException) as e:
+            logger.error(f'Error during writing the snapshot due to reason: {e!r}')
+            return
+        self.prune()
+
+    def part_files(self, directory: str) -> list[str]:
+        """
+        Return the Parquet files of the run in the directory.
+        """
+        return sorted(
+            os.path.join(directory, name) for name in os.listdir(directory) if name.endswith('.parquet')
+        )
+
+    def complete_runs(self) -> list[tuple[str, dict[str, Any]]]:
+        """
+        Return the directory and manifest of every complete run, oldest first.
+        """
+        if not os.path.isdir(self.directory):
+            return []
+        runs = []
+        for name in sorted(os.listdir(self.directory)):
+            manifest_path = os.path.join(self.directory, name, MANIFEST_FILE)
+            if os.path.isfile(manifest_path):
+                with open(manifest_path) as manifest_file:
+                    runs.append((os.path.join(self.directory, name), json.load(manifest_file)))
+        return runs
+
+    def current_runs(self) -> list[tuple[str, dict[str, Any]]]:
+        """
+        Return the newest complete full run and the complete runs after it.
+        """
+        runs = self.complete_runs()
+        full_runs = [position for position, (_, manifest) in enumerate(runs) if manifest['full']]
+        return runs[full_runs[-1]:] if full_runs else []
+
+    def prune(self):
+        """
+        Remove the runs, complete or not, started before the newest complete full run.
+        """
+        current = self.current_runs()
+        if not current:
+            return
+        oldest_kept = os.path.basename(current[0][0])
+        for name in os.listdir(self.directory):
+            if name < oldest_kept:
+                shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+
+    def read(self, columns: Iterable[str]) -> pd.DataFrame:
+        """
+        Read the given columns of the current inventory into a DataFrame.
+        The Parquet files are memory mapped and only the requested columns are read. Dictionary encoded
+        columns become categoricals and timestamp columns datetime64 without converting them to Python objects.
+        When several runs, or a run with several versions of a host, are read, the newest version of every host is kept.
+        Raises FileNotFoundError when there is no complete full run.
+        """
+        columns = list(columns)
+        runs = self.current_runs()
+        if not runs:
+            raise FileNotFoundError(f'No complete full snapshot run in {self.directory}')
+        deduplicate = len(runs) > 1 or not runs[0][1]['unique']
+        read_columns = list(dict.fromkeys([*columns, 'host_id', 'updated'])) if deduplicate else columns
+        tables = [
+            pq.read_table(path, columns=read_columns, memory_map=True)
+            for directory, _ in runs for path in self.part_files(directory)
+        ]
+        if not tables:
+            return pd.DataFrame(columns=columns)
+        dataframe = pa.concat_tables(tables).to_pandas()
+        if deduplicate:
+            # The first of the newest versions is kept, as remove_duplicates does
+            dataframe = dataframe.sort_values(
+                'updated', ascending=False, kind='stable',
+            ).drop_duplicates('host_id')[columns].reset_index(drop=True)
+        logger.info(f'Read {len(dataframe)} hosts from the snapshot runs {[directory for directory, _ in runs]}')
+        return dataframe
+
+
+inventory_snapshot = InventorySnapshot()
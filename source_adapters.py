@@ -0,0 +1,256 @@
+from __future__ import annotations
+
+import json
+from collections.abc import Callable
+from dataclasses import dataclass
+from dataclasses import field
+from typing import Any
+
+from config import settings
+from logger import Logger
+
+logger = Logger().get_logger()
+
+# Functions a field value can be passed through, by the name used in the adapter configuration
+CONVERTERS: dict[str, Callable[[Any], Any]] = {
+    'str': str,
+}
+
+
+@dataclass(frozen=True)
+class FieldPath:
+    """
+    Path of keys leading to a field of a raw record, with the same semantics as DataNormalizer.get_nested:
+    the default is returned as soon as a key is missing or the value does not fit the key.
+    A required field is read without default and raises KeyError when missing.
+    An empty path always yields the default.
+    """
+    path: tuple[str | int, ...] = ()
+    default: Any = ''
+    required: bool = False
+    convert: str | None = None
+
+    @classmethod
+    def from_config(cls, config: dict[str, Any] | list[str | int] | str) -> FieldPath:
+        """
+        Build the field path from its configuration: a key, a list of keys or a mapping of the attributes.
+        """
+        if isinstance(config, str):
+            return cls((config,))
+        if isinstance(config, list):
+            return cls(tuple(config))
+        if config.get('convert') is not None and config['convert'] not in CONVERTERS:
+            raise ValueError(f'Unknown converter {config["convert"]!r}, expected one of {sorted(CONVERTERS)}')
+        return cls(
+            path=tuple(config.get('path', ())), default=config.get('default', ''),
+            required=config.get('required', False), convert=config.get('convert'),
+        )
+
+
+@dataclass
+class SourceAdapter:
+    """
+    Declarative mapping of the raw records of one source to the HostInfo fields.
+    `fields` holds the path of every HostInfo field read from the record, the other fields are ''.
+    When `geo` is set the location is not read from the record but resolved from the IP address at that path.
+    `url` is the API of the sources added through the configuration file.
+    The paths are compiled into one generated function per adapter on first use.
+    """
+    name: str
+    label: str
+    fields: dict[str, FieldPath]
+    geo: FieldPath | None = None
+    url: str | None = None
+    _extractors: dict[tuple[str, ...], Callable[..., Any]] = field(default_factory=dict, repr=False)
+    _accessors: dict[str, Callable[[dict[str, Any]], Any]] = field(default_factory=dict, repr=False)
+
+    @classmethod
+    def from_config(cls, config: dict[str, Any]) -> SourceAdapter:
+        """
+        Build the adapter from one entry of the configuration file.
+        """
+        return cls(
+            name=config['name'], label=config.get('label', config['name']),
+            fields={
+                name: FieldPath.from_config(path)
+                for name, path in config.get('fields', {}).items()
+            },
+            geo=FieldPath.from_config(config['geo']) if config.get('geo') else None,
+            url=config.get('url'),
+        )
+
+    def host_extractor(self, field_names: tuple[str, ...]) -> Callable[..., Any]:
+        """
+        Return the function building a host of the class with the given fields from a raw record,
+        called as extract(record, host_class, location_of). `location_of` maps the IP address at the
+        geo path to the location.
+        """
+        if field_names not in self._extractors:
+            unknown = set(self.fields) - set(field_names)
+            if unknown:
+                raise ValueError(f'{self.name} adapter maps unknown HostInfo fields {sorted(unknown)}')
+            paths = {
+                name: self.fields.get(name, FieldPath())
+                for name in field_names if not (self.geo and name == 'location')
+            }
+            self._extractors[field_names] = compile_extractor(
+                f'{self.name} host', paths, self.geo,
+            )
+        return self._extractors[field_names]
+
+    def accessor(self, name: str) -> Callable[[dict[str, Any]], Any]:
+        """
+        Return the function reading the HostInfo field, or 'geo' for the IP address, from a raw record.
+        Required fields are read like optional ones, so a record missing them yields the default.
+        """
+        if name not in self._accessors:
+            path = self.geo if name == 'geo' else self.fields.get(name, FieldPath())
+            path = FieldPath(path.path, path.default, convert=path.convert)
+            self._accessors[name] = compile_extractor(f'{self.name} {name}', {'value': path})
+        return self._accessors[name]
+
+
+def path_statements(target: str, path: FieldPath, constant: str) -> list[str]:
+    """
+    Return the source lines assigning the value at the path of the `record` to the target variable.
+    A single key is read with dict.get. Longer paths index straight through inside one try block,
+    which raises exactly where get_nested would return the default, except for an integer key on a
+    string, which is checked explicitly.
+    """
+    if not path.path:
+        return [f'{target} = {constant}']
+    if path.required:
+        return [f'{target} = record' + ''.join(f'[{key!r}]' for key in path.path)]
+    if len(path.path) == 1:
+        return [f'{target} = record.get({path.path[0]!r}, {constant})']
+    lines = ['try:', f'    {target} = record']
+    indent = '    '
+    for key in path.path:
+        if isinstance(key, int):
+            # The rest of the path is only read when the value could be indexed
+            lines += [
+                f'{indent}if isinstance({target}, str):',
+                f'{indent}    {target} = {constant}',
+                f'{indent}else:',
+            ]
+            indent += '    '
+        lines.append(f'{indent}{target} = {target}[{key!r}]')
+    lines += ['except (KeyError, IndexError, TypeError):', f'    {target} = {constant}']
+    return lines
+
+
+def compile_extractor(description: str, paths: dict[str, FieldPath], geo: FieldPath | None = None) -> Callable[..., Any]:
+    """
+    Generate and compile the function reading the paths from a raw record, the description
+    naming its code object in tracebacks and profiles.
+    With a single 'value' path the function returns that value, otherwise it builds
+    host_class(**fields) and resolves the location with location_of when geo is given.
+    """
+    namespace: dict[str, Any] = {}
+    body = []
+    targets = {}
+    for number, (name, path) in enumerate(paths.items()):
+        constant = f'default_{number}'
+        namespace[constant] = path.default
+        target = f'field_{number}'
+        body += path_statements(target, path, constant)
+        if path.convert:
+            namespace[f'convert_{number}'] = CONVERTERS[path.convert]
+            body.append(f'{target} = convert_{number}({target})')
+        targets[name] = target
+    if geo is not None:
+        namespace['default_geo'] = geo.default
+        body += path_statements('ip_address', geo, 'default_geo')
+        targets['location'] = 'location_of(ip_address)'
+    if list(paths) == ['value'] and geo is None:
+        signature = 'record'
+        body.append(f'return {targets["value"]}')
+    else:
+        signature = 'record, host_class, location_of'
+        arguments = ', '.join(f'{name}={target}' for name, target in targets.items())
+        body.append(f'return host_class({arguments})')
+    source = f'def extract({signature}):\n' + ''.join(f'    {line}\n' for line in body)
+    exec(compile(source, f'<{description} extractor>', 'exec'), namespace)
+    return namespace['extract']
+
+
+class SourceAdapterRegistry:
+    """
+    Class to hold the adapter of every source: the built-in Qualys and CrowdStrike adapters
+    and the ones declared in the JSON file at SOURCE_ADAPTERS_PATH, which may also replace a built-in one.
+    """
+
+    def __init__(self):
+        """
+        Initializing the SourceAdapterRegistry class with the built-in adapters and the configured ones.
+        """
+        self.adapters: dict[str, SourceAdapter] = {
+            adapter.name: adapter for adapter in (QUALYS_ADAPTER, CROWDSTRIKE_ADAPTER)
+        }
+        self.path = settings.SOURCE_ADAPTERS_PATH
+        if self.path:
+            with open(self.path) as config_file:
+                for config in json.load(config_file):
+                    adapter = SourceAdapter.from_config(config)
+                    self.adapters[adapter.name] = adapter
+                    logger.info(f'Loaded the {adapter.name} source adapter from {self.path}')
+
+    def __getitem__(self, name: str) -> SourceAdapter:
+        return self.adapters[name]
+
+    def configured_sources(self) -> dict[str, str]:
+        """
+        Return the mapping of source name to API url of the adapters declared with an url.
+        """
+        return {
+            name: adapter.url for name, adapter in self.adapters.items() if adapter.url
+        }
+
+
+QUALYS_ADAPTER = SourceAdapter(
+    name='qualys',
+    label='Qualys',
+    fields={
+        'host_id': FieldPath(('_id',), required=True, convert='str'),
+        'hostname': FieldPath(('dnsHostName',)),
+        'ip_address': FieldPath(('address',)),
+        'mac_address': FieldPath(('networkInterface', 'list', 0, 'HostAssetInterface', 'macAddress')),
+        'os_version': FieldPath(('os',)),
+        'os': FieldPath(('agentInfo', 'platform')),
+        'last_seen': FieldPath(('modified',)),
+        'manufacturer': FieldPath(('manufacturer',)),
+        'model': FieldPath(('model',)),
+        'location': FieldPath(('agentInfo', 'location')),
+        'agent_version': FieldPath(('agentInfo', 'agentVersion')),
+        'status': FieldPath(('agentInfo', 'status')),
+        'created': FieldPath(('created',)),
+        'updated': FieldPath(('modified',)),
+        'cloud_provider': FieldPath(('cloudProvider',), default=None),
+        'first_seen': FieldPath(('created',)),
+    },
+)
+
+CROWDSTRIKE_ADAPTER = SourceAdapter(
+    name='crowdstrike',
+    label='CrowdStrike',
+    fields={
+        'host_id': FieldPath(('device_id',)),
+        'hostname': FieldPath(('hostname',)),
+        'ip_address': FieldPath(('local_ip',)),
+        'mac_address': FieldPath(('mac_address',), default=None),
+        'os': FieldPath(('platform_name',)),
+        'os_version': FieldPath(('os_version',), default=None),
+        'last_seen': FieldPath(('last_seen',)),
+        'manufacturer': FieldPath(('system_manufacturer',), default=None),
+        'model': FieldPath(('system_product_name',), default=None),
+        'agent_version': FieldPath(('agent_version',), default=None),
+        'status': FieldPath(('status',)),
+        'created': FieldPath(('first_seen',)),
+        'updated': FieldPath(('last_seen',)),
+        'cloud_provider': FieldPath(('service_provider',), default=None),
+        'first_seen': FieldPath(('first_seen',)),
+    },
+    geo=FieldPath(('external_ip',), default=None),
+)
+
+source_adapters = SourceAdapterRegistry()
@@ -0,0 +1,201 @@
+from __future__ import annotations
+
+import gzip
+import io
+import json
+import mmap
+import os
+import shutil
+from collections.abc import Iterator
+from datetime import datetime
+from typing import Any
+
+from config import settings
+from databases import chunked
+from logger import Logger
+from payload_decoder import payload_decoder
+
+logger = Logger().get_logger()
+
+# File of a spooled run listing its segments, written once the run is complete
+MANIFEST_FILE = 'manifest.json'
+# Fast compression, the segments are written while the pages are fetched
+COMPRESS_LEVEL = 1
+
+
+class SpoolWriter:
+    """
+    Class to write the raw pages of one run to gzip compressed NDJSON segments of at most
+    `segment_records` records per source. A segment is written under a temporary name and renamed
+    once complete, and the manifest is written last, so a run without manifest is incomplete.
+    """
+
+    def __init__(self, directory: str, segment_records: int):
+        """
+        Initializing the SpoolWriter class with the directory of the run.
+        """
+        self.directory = directory
+        self.segment_records = segment_records
+        self.segments: dict[str, list[str]] = {}
+        self.records: dict[str, int] = {}
+        self._files: dict[str, gzip.GzipFile] = {}
+        self._segment_records: dict[str, int] = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def segment_path(self, source: str, number: int) -> str:
+        """
+        Return the path of the numbered segment of the source.
+        """
+        return os.path.join(self.directory, f'{source}-{number:05d}.ndjson.gz')
+
+    def close_segment(self, source: str):
+        """
+        Close the open segment of the source and move it to its final name.
+        """
+        segment = self._files.pop(source, None)
+        if segment is None:
+            return
+        segment.close()
+        path = self.segment_path(source, len(self.segments[source]))
+        os.replace(f'{path}.tmp', path)
+        self.segments[source].append(os.path.basename(path))
+
+    def write_page(self, source: str, page: list[dict[str, Any]]):
+        """
+        Append the records of the page to the open segment of the source, one JSON document per line.
+        """
+        self.segments.setdefault(source, [])
+        self.records.setdefault(source, 0)
+        for record in page:
+            if source not in self._files:
+                path = self.segment_path(source, len(self.segments[source]))
+                self._files[source] = gzip.open(
+                    f'{path}.tmp', 'wb', compresslevel=COMPRESS_LEVEL,
+                )
+                self._segment_records[source] = 0
+            self._files[source].write(json.dumps(record).encode('utf-8') + b'\n')
+            self._segment_records[source] += 1
+            self.records[source] += 1
+            if self._segment_records[source] >= self.segment_records:
+                self.close_segment(source)
+
+    def close(self):
+        """
+        Close the open segments and write the manifest of the run.
+        """
+        for source in list(self._files):
+            self.close_segment(source)
+        manifest = {
+            'sources': {
+                source: {'records': self.records[source], 'segments': segments}
+                for source, segments in self.segments.items()
+            },
+        }
+        with open(os.path.join(self.directory, MANIFEST_FILE), 'w') as manifest_file:
+            json.dump(manifest, manifest_file, indent=2)
+        logger.info(f'Spooled the raw pages of the run to {self.directory}: {self.records}')
+
+    def abort(self):
+        """
+        Close the open segments without writing the manifest, leaving the run incomplete.
+        """
+        for segment in self._files.values():
+            segment.close()
+        self._files = {}
+        logger.error(f'Spooling to {self.directory} was aborted, the run is incomplete')
+
+
+class PayloadSpool:
+    """
+    Class to spool the raw pages fetched from the APIs to local disk and to replay a spooled run
+    instead of calling the APIs.
+    """
+
+    def __init__(self):
+        """
+        Initializing the PayloadSpool class with the spool directory and the run to replay.
+        """
+        self.enabled = settings.SPOOL_ENABLED
+        self.directory = settings.SPOOL_DIR
+        self.segment_records = max(1, settings.SPOOL_SEGMENT_RECORDS)
+        self.keep_runs = settings.SPOOL_KEEP_RUNS
+        self.replay_run = settings.REPLAY_RUN
+
+    @property
+    def replaying(self) -> bool:
+        """
+        Return whether the pages are read from a spooled run instead of the APIs.
+        """
+        return bool(self.replay_run)
+
+    @property
+    def spooling(self) -> bool:
+        """
+        Return whether the pages fetched from the APIs are written to the spool.
+        """
+        return self.enabled and not self.replaying
+
+    def complete_runs(self) -> list[str]:
+        """
+        Return the names of the complete spooled runs, oldest first.
+        """
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(
+            run for run in os.listdir(self.directory)
+            if os.path.isfile(os.path.join(self.directory, run, MANIFEST_FILE))
+        )
+
+    def start_run(self) -> SpoolWriter | None:
+        """
+        Return the writer of a new spooled run, or None when spooling is disabled or a run is replayed.
+        The oldest runs beyond `keep_runs` are removed first.
+        """
+        if not self.enabled or self.replaying:
+            return None
+        if self.keep_runs > 0 and os.path.isdir(self.directory):
+            runs = sorted(os.listdir(self.directory))
+            for run in runs[:max(0, len(runs) - self.keep_runs + 1)]:
+                shutil.rmtree(os.path.join(self.directory, run), ignore_errors=True)
+        run = datetime.now().strftime('%Y-%m-%dT%H-%M-%S-%f')
+        return SpoolWriter(os.path.join(self.directory, run), self.segment_records)
+
+    def run_directory(self) -> str:
+        """
+        Return the directory of the run to replay, the newest complete run for 'latest'.
+        """
+        if self.replay_run == 'latest':
+            runs = self.complete_runs()
+            if not runs:
+                raise FileNotFoundError(f'No complete spooled run in {self.directory}')
+            return os.path.join(self.directory, runs[-1])
+        directory = os.path.join(self.directory, self.replay_run)
+        if not os.path.isfile(os.path.join(directory, MANIFEST_FILE)):
+            raise FileNotFoundError(f'{directory} is not a complete spooled run')
+        return directory
+
+    def iter_records(self, source: str) -> Iterator[dict[str, Any]]:
+        """
+        Stream the records of the source from the segments of the replayed run.
+        Every segment is memory mapped and decompressed line by line, so only one buffer of it is in memory,
+        and every line is decoded against the schema of the source.
+        """
+        directory = self.run_directory()
+        with open(os.path.join(directory, MANIFEST_FILE)) as manifest_file:
+            manifest = json.load(manifest_file)
+        segments = manifest['sources'].get(source, {}).get('segments', [])
+        for segment in segments:
+            with open(os.path.join(directory, segment), 'rb') as segment_file:
+                with mmap.mmap(segment_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    with io.BufferedReader(gzip.GzipFile(fileobj=mapped, mode='rb')) as lines:
+                        for line in lines:
+                            yield payload_decoder.decode_record(source, line)
+
+    def iter_pages(self, source: str, page_size: int) -> Iterator[list[dict[str, Any]]]:
+        """
+        Stream the records of the source from the replayed run in pages of `page_size` records.
+        """
+        return chunked(self.iter_records(source), max(1, page_size))
+
+
+payload_spool = PayloadSpool()
@@ -0,0 +1,75 @@
+from __future__ import annotations
+
+import os
+import sys
+import tempfile
+
+import pytest
+
+# The settings are read from the environment when config is first imported, so the variables
+# without a default are set before any module of the project is imported by the tests
+TEST_ENVIRONMENT = {
+    'API_KEY': 'test',
+    'QUALYS_API_URL': 'http://127.0.0.1:9/qualys',
+    'CROWDSTRIKE_API_URL': 'http://127.0.0.1:9/crowdstrike',
+    'IP_ADDRESS_API_URL': 'http://127.0.0.1:9/ip/{ip_address}/json/',
+    'SKIP': '0',
+    'LIMIT': '2',
+    'MONGO_DB_PORT': '27017',
+    'MONGO_DB_HOST': 'localhost',
+    'MONGO_DB_NAME': 'hosts_db',
+    'MONGO_DB_COLLECTION_NAME': 'hosts',
+    'LOGGING_DIR': os.path.join(tempfile.gettempdir(), 'pipeline-tests-logging'),
+}
+for name, value in TEST_ENVIRONMENT.items():
+    os.environ.setdefault(name, value)
+
+# The modules of the project are imported from the project root, like the benchmarks do
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def make_host():
+    """
+    Return a factory of hosts with the given fields overriding the ones of a complete host.
+    """
+    from data_normalizer import HostInfo
+
+    def make_host(host_class=HostInfo, **overrides):
+        values = {
+            'host_id': 'host-1',
+            'hostname': 'web-01',
+            'ip_address': '10.0.0.1',
+            'mac_address': '00:00:00:00:00:01',
+            'os': 'Linux',
+            'os_version': '6.1',
+            'last_seen': '2024-01-02T00:00:00Z',
+            'manufacturer': 'Acme',
+            'model': 'A1',
+            'location': 'Kathmandu, Bagmati Nepal',
+            'agent_version': '1.0',
+            'status': 'online',
+            'created': '2023-01-01T00:00:00Z',
+            'updated': '2024-01-02T00:00:00Z',
+            'cloud_provider': 'aws',
+            'first_seen': '2023-01-01T00:00:00Z',
+        }
+        values.update(overrides)
+        return host_class(**values)
+
+    return make_host
+
+
+@pytest.fixture
+def mongo(monkeypatch):
+    """
+    Point the collections of the database handler at an in-memory mongomock database.
+    """
+    import mongomock
+
+    from databases import mongo_db
+
+    database = mongomock.MongoClient().db
+    monkeypatch.setattr(mongo_db, 'collection', database.hosts)
+    monkeypatch.setattr(mongo_db, 'sync_state', database.sync_state)
+    return mongo_db
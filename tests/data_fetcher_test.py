@@ -0,0 +1,185 @@
+from __future__ import annotations
+
+import asyncio
+from datetime import datetime
+from datetime import timedelta
+from datetime import timezone
+from email.utils import format_datetime
+
+import aiohttp
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from data_fetcher import DataFetcher
+from resources import resources
+from spool import MANIFEST_FILE
+from spool import payload_spool
+from request_controller import request_controller
+
+
+class SourceStandIn:
+    """
+    Stand-in of the source APIs answering every request with the next scripted (status, headers),
+    or with a page of the `total` records when the script is used up or holds None.
+    The pages of `failing` (source, skip) pairs always fail.
+    """
+
+    def __init__(self, responses=(), total=0, failing=()):
+        self.responses = list(responses)
+        self.total = total
+        self.failing = set(failing)
+        self.requests = []
+
+    async def handle(self, request):
+        skip, limit = int(request.query['skip']), int(request.query['limit'])
+        self.requests.append((request.match_info['source'], skip))
+        if (request.match_info['source'], skip) in self.failing:
+            return web.Response(status=500, text='error')
+        if self.responses and (response := self.responses.pop(0)) is not None:
+            status, headers = response
+            return web.Response(status=status, headers=headers, text='error')
+        return web.json_response([{'_id': number} for number in range(skip, min(skip + limit, self.total))])
+
+
+@pytest.fixture(autouse=True)
+def controller(monkeypatch):
+    """
+    Start every test with fresh limiters and record the retry delays instead of sleeping them.
+    """
+    monkeypatch.setattr(request_controller, 'limiters', {})
+    monkeypatch.setattr(request_controller, 'max_retries', 2)
+    monkeypatch.setattr(request_controller, 'initial_concurrency', 4)
+    monkeypatch.setattr(request_controller, 'max_concurrency', 8)
+    delays = []
+    retry_delay = request_controller.retry_delay
+
+    def recorded_retry_delay(attempt, retry_after=None):
+        delays.append(retry_delay(attempt, retry_after))
+        return 0
+
+    monkeypatch.setattr(request_controller, 'retry_delay', recorded_retry_delay)
+    return delays
+
+
+def serve(stand_in, scenario):
+    """
+    Run the scenario with a fetcher and a session pointed at the stand-in.
+    """
+    async def run():
+        app = web.Application()
+        app.router.add_post('/{source}', stand_in.handle)
+        async with TestServer(app) as server:
+            fetcher = DataFetcher()
+            fetcher.qualys_url = str(server.make_url('/qualys'))
+            fetcher.crowdstrike_url = str(server.make_url('/crowdstrike'))
+            async with aiohttp.ClientSession() as session:
+                return await scenario(fetcher, session)
+
+    return asyncio.run(run())
+
+
+def fetch_once(fetcher, session):
+    return fetcher.fetch_data(session, fetcher.qualys_url, params={'skip': 0, 'limit': 2})
+
+
+def test_retry_after_in_seconds_is_honored(controller):
+    stand_in = SourceStandIn([(429, {'Retry-After': '7'})], total=2)
+    assert serve(stand_in, fetch_once) == [{'_id': 0}, {'_id': 1}]
+    assert controller == [7.0]
+    assert len(stand_in.requests) == 2
+
+
+def test_retry_after_as_http_date_is_honored(controller):
+    retry_at = format_datetime(datetime.now(timezone.utc) + timedelta(seconds=20), usegmt=True)
+    stand_in = SourceStandIn([(503, {'Retry-After': retry_at})], total=2)
+    assert serve(stand_in, fetch_once) == [{'_id': 0}, {'_id': 1}]
+    [delay] = controller
+    assert 18 <= delay <= 20
+
+
+def test_gives_up_after_max_retries(controller):
+    stand_in = SourceStandIn([(500, {})] * 5, total=2)
+    assert serve(stand_in, fetch_once) is None
+    assert len(stand_in.requests) == request_controller.max_retries + 1
+    assert len(controller) == request_controller.max_retries
+
+
+def test_client_errors_are_not_retried(controller):
+    stand_in = SourceStandIn([(404, {})], total=2)
+    assert serve(stand_in, fetch_once) is None
+    assert len(stand_in.requests) == 1
+    assert controller == []
+
+
+def test_throttled_response_halves_the_limit():
+    stand_in = SourceStandIn([(429, {'Retry-After': '0'})], total=2)
+    serve(stand_in, fetch_once)
+    assert request_controller.limiters['qualys'].concurrency == 2
+
+
+def test_limit_stays_within_its_bounds():
+    async def scenario(fetcher, session):
+        limiter = request_controller.limiter('qualys')
+        bounds = []
+        # The limit is halved at most once per round trip, so the throttled requests are sent one by one
+        stand_in.responses = [(429, {})] * 12
+        for _ in range(4):
+            await fetch_once(fetcher, session)
+        bounds.append(limiter.concurrency)
+        await asyncio.gather(*(fetch_once(fetcher, session) for _ in range(200)))
+        bounds.append(limiter.concurrency)
+        return bounds
+
+    stand_in = SourceStandIn(total=2)
+    lowest, highest = serve(stand_in, scenario)
+    assert lowest == 1
+    assert highest == request_controller.max_concurrency
+
+
+def walk_pages(fetcher, session):
+    async def walk():
+        incomplete = set()
+        fetcher.limit = 2
+        pages = [page async for page in fetcher.fetch_pages(session, fetcher.qualys_url, incomplete)]
+        return pages, incomplete
+
+    return walk()
+
+
+def test_short_last_page_ends_the_walk():
+    pages, incomplete = serve(SourceStandIn(total=5), walk_pages)
+    assert pages == [[{'_id': 0}, {'_id': 1}], [{'_id': 2}, {'_id': 3}], [{'_id': 4}]]
+    assert incomplete == set()
+
+
+def test_empty_page_ends_the_walk():
+    pages, incomplete = serve(SourceStandIn(total=4), walk_pages)
+    assert pages == [[{'_id': 0}, {'_id': 1}], [{'_id': 2}, {'_id': 3}]]
+    assert incomplete == set()
+
+
+def test_failed_page_marks_the_source_incomplete_and_leaves_the_spool_run_without_manifest(monkeypatch, tmp_path):
+    monkeypatch.setattr(payload_spool, 'enabled', True)
+    monkeypatch.setattr(payload_spool, 'replay_run', '')
+    monkeypatch.setattr(payload_spool, 'directory', str(tmp_path / 'spool'))
+
+    async def scenario(fetcher, session):
+        incomplete = set()
+        fetcher.limit = 2
+        pages = {}
+        try:
+            async for source, page in fetcher.stream_all_pages(incomplete):
+                pages.setdefault(source, []).extend(page)
+        finally:
+            await resources.close_http_sessions()
+        return pages, incomplete
+
+    stand_in = SourceStandIn(total=6, failing={('qualys', 2)})
+    pages, incomplete = serve(stand_in, scenario)
+    assert incomplete == {'qualys'}
+    assert pages['qualys'] == [{'_id': 0}, {'_id': 1}]
+    assert len(pages['crowdstrike']) == 6
+    [run] = (tmp_path / 'spool').iterdir()
+    assert not (run / MANIFEST_FILE).exists()
+    assert payload_spool.complete_runs() == []
@@ -0,0 +1,126 @@
+from __future__ import annotations
+
+from dataclasses import replace
+from datetime import datetime
+from datetime import timedelta
+
+import pytest
+from pymongo import UpdateOne
+
+from data_normalizer import CompactHostInfo
+from databases import FINGERPRINT_FIELD
+from databases import host_document
+from databases import host_fingerprint
+from databases import MongoDBHandler
+
+
+def stored(host):
+    document = host_document(host)
+    document[FINGERPRINT_FIELD] = host_fingerprint(host)
+    return document
+
+
+def advanced(host, hours=1):
+    return replace(
+        host, updated=host.updated + timedelta(hours=hours), last_seen=host.last_seen + timedelta(hours=hours),
+    )
+
+
+@pytest.fixture
+def handler():
+    handler = MongoDBHandler()
+    handler.last_seen_refresh = timedelta(0)
+    return handler
+
+
+def test_fingerprint_ignores_volatile_fields(make_host):
+    host = make_host()
+    assert host_fingerprint(advanced(host)) == host_fingerprint(host)
+
+
+def test_fingerprint_changes_with_content(make_host):
+    host = make_host()
+    assert host_fingerprint(replace(host, status='offline')) != host_fingerprint(host)
+
+
+def test_fingerprint_same_for_host_classes(make_host):
+    assert host_fingerprint(make_host(CompactHostInfo)) == host_fingerprint(make_host())
+
+
+def test_changed_fields_unchanged_content_writes_advanced_timestamps(make_host, handler):
+    host = make_host()
+    newer = advanced(host)
+    assert handler.changed_fields(newer, stored(host)) == {
+        'updated': newer.updated, 'last_seen': newer.last_seen,
+    }
+
+
+def test_changed_fields_unchanged_content_writes_only_timestamps_which_moved(make_host, handler):
+    host = make_host()
+    newer = replace(host, updated=host.updated + timedelta(hours=1))
+    assert handler.changed_fields(newer, stored(host)) == {'updated': newer.updated}
+
+
+def test_changed_fields_skips_timestamps_within_refresh_interval(make_host, handler):
+    handler.last_seen_refresh = timedelta(days=1)
+    host = make_host()
+    assert handler.changed_fields(advanced(host), stored(host)) == {}
+    newer = advanced(host, hours=25)
+    assert handler.changed_fields(newer, stored(host)) == {
+        'updated': newer.updated, 'last_seen': newer.last_seen,
+    }
+
+
+def test_changed_fields_changed_content_writes_changed_fields_and_fingerprint(make_host, handler):
+    host = make_host()
+    newer = replace(advanced(host), status='offline')
+    assert handler.changed_fields(newer, stored(host)) == {
+        'updated': newer.updated,
+        'last_seen': newer.last_seen,
+        'status': 'offline',
+        FINGERPRINT_FIELD: host_fingerprint(newer),
+    }
+
+
+def test_changed_fields_compares_datetimes_at_stored_precision(make_host, handler):
+    host = make_host(created=datetime(2023, 1, 1, 0, 0, 0, 123456))
+    existing = stored(host)
+    existing['created'] = datetime(2023, 1, 1, 0, 0, 0, 123000)
+    existing[FINGERPRINT_FIELD] = 'outdated'
+    newer = advanced(host)
+    assert 'created' not in handler.changed_fields(newer, existing)
+
+
+def test_build_operations_reads_host_fields_and_skips_unchanged_hosts(make_host, handler, monkeypatch):
+    host = make_host()
+    existing = {host.host_id: stored(advanced(host))}
+    lookups = []
+
+    def get_existing_hosts(host_ids, fields):
+        lookups.append((host_ids, tuple(fields)))
+        return {host_id: existing[host_id] for host_id in host_ids if host_id in existing}
+
+    monkeypatch.setattr(handler, 'get_existing_hosts', get_existing_hosts)
+    new_host = make_host(host_id='host-2')
+    newer = advanced(host, hours=2)
+    operations = list(handler.build_operations([advanced(host), newer, new_host]))
+    assert lookups == [(['host-1', 'host-1', 'host-2'], tuple(host_document(host)))]
+    assert operations == [
+        UpdateOne({'host_id': 'host-1'}, {'$set': {'updated': newer.updated, 'last_seen': newer.last_seen}}),
+        UpdateOne({'host_id': 'host-2'}, {'$set': stored(new_host)}, upsert=True),
+    ]
+
+
+def test_unchanged_newer_host_is_not_written_within_the_default_refresh_interval(make_host, mongo):
+    host = make_host()
+    mongo.insert_data_operations([host])
+    newer = advanced(host, hours=23)
+    assert mongo.last_seen_refresh == timedelta(days=1)
+    assert list(mongo.build_operations([newer])) == []
+    results = mongo.insert_data_operations([newer])
+    assert sum(result['operations'] for result in results) == 0
+    assert mongo.collection.find_one({'host_id': host.host_id})['updated'] == host.updated
+    refreshed = advanced(host, hours=25)
+    assert list(mongo.build_operations([refreshed])) == [
+        UpdateOne({'host_id': host.host_id}, {'$set': {'updated': refreshed.updated, 'last_seen': refreshed.last_seen}}),
+    ]
@@ -0,0 +1,20 @@
+from __future__ import annotations
+
+import statistics
+
+from benchmarks.import_time import BUDGET_MS
+from benchmarks.import_time import measure
+
+
+def test_import_main_within_budget():
+    # The first import warms the bytecode cache and is not counted
+    measure('main')
+    timings = [measure('main')[0] for _ in range(3)]
+    assert statistics.median(timings) / 1000 <= BUDGET_MS
+
+
+def test_import_main_defers_heavy_modules_and_connections():
+    _, _, state = measure('main')
+    assert state['lazy_modules'] == []
+    assert state['mongo_client'] is False
+    assert state['log_file_open'] is False
@@ -0,0 +1,122 @@
+from __future__ import annotations
+
+from types import SimpleNamespace
+
+import pytest
+
+import location_cache as location_cache_module
+from location_cache import LocationCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(location_cache_module, 'time', SimpleNamespace(time=lambda: clock.now))
+    return clock
+
+
+@pytest.fixture
+def make_cache(tmp_path, clock):
+    def make_cache(**overrides):
+        cache = LocationCache()
+        cache.path = str(tmp_path / 'cache' / 'locations.sqlite3')
+        cache.enabled = True
+        cache.ttl = 100
+        cache.negative_ttl = 10
+        cache.max_size = 1000
+        cache.memory_size = 1000
+        for name, value in overrides.items():
+            setattr(cache, name, value)
+        return cache
+
+    return make_cache
+
+
+def disk_rows(cache):
+    return dict(cache.connection.execute('SELECT ip_address, location FROM locations').fetchall())
+
+
+def test_locations_are_served_from_memory_then_from_disk_after_a_restart(make_cache):
+    cache = make_cache()
+    cache.set_many({'1.1.1.1': 'Kathmandu', '2.2.2.2': ''})
+    assert cache.get_many(['1.1.1.1', '2.2.2.2', '3.3.3.3']) == {'1.1.1.1': 'Kathmandu', '2.2.2.2': ''}
+    assert (cache.memory_hits, cache.disk_hits, cache.misses) == (2, 0, 1)
+    restarted = make_cache()
+    assert restarted.get('1.1.1.1') == 'Kathmandu'
+    assert restarted.disk_hits == 1
+    assert restarted.get('1.1.1.1') == 'Kathmandu'
+    assert restarted.memory_hits == 1
+
+
+def test_entries_expire_after_the_ttl(make_cache, clock):
+    cache = make_cache()
+    cache.set('1.1.1.1', 'Kathmandu')
+    clock.now += 99
+    assert cache.get('1.1.1.1') == 'Kathmandu'
+    clock.now += 1
+    assert cache.get('1.1.1.1') is None
+    assert make_cache().get('1.1.1.1') is None
+
+
+def test_empty_locations_expire_after_the_shorter_negative_ttl(make_cache, clock):
+    cache = make_cache()
+    cache.set_many({'1.1.1.1': 'Kathmandu', '2.2.2.2': ''})
+    clock.now += 10
+    assert cache.get_many(['1.1.1.1', '2.2.2.2']) == {'1.1.1.1': 'Kathmandu'}
+
+
+def test_expired_entries_are_deleted_from_disk_on_the_next_insert(make_cache, clock):
+    cache = make_cache()
+    cache.set_many({'1.1.1.1': 'Kathmandu', '2.2.2.2': ''})
+    clock.now += 10
+    cache.set('3.3.3.3', 'Pokhara')
+    assert disk_rows(cache) == {'1.1.1.1': 'Kathmandu', '3.3.3.3': 'Pokhara'}
+
+
+def test_memory_tier_evicts_the_least_recently_used(make_cache):
+    cache = make_cache(memory_size=2)
+    cache.set_many({'1.1.1.1': 'a', '2.2.2.2': 'b'})
+    assert cache.get('1.1.1.1') == 'a'
+    cache.set('3.3.3.3', 'c')
+    assert list(cache._memory) == ['1.1.1.1', '3.3.3.3']
+    assert cache.get('2.2.2.2') == 'b'
+    assert cache.disk_hits == 1
+
+
+def test_disk_tier_evicts_the_entries_closest_to_expiring_above_the_max_size(make_cache, clock):
+    cache = make_cache(max_size=10)
+    for number in range(11):
+        clock.now += 1
+        cache.set(f'10.0.0.{number}', f'location {number}')
+    # Evicted down to the max size less EVICT_FRACTION of it
+    assert sorted(disk_rows(cache)) == sorted(f'10.0.0.{number}' for number in range(2, 11))
+
+
+def test_disk_tier_is_counted_only_once_the_size_bound_passes_the_max_size(make_cache):
+    cache = make_cache(max_size=10)
+    counts = []
+    cache.connection.set_trace_callback(
+        lambda statement: counts.append(statement) if 'COUNT(*)' in statement else None,
+    )
+    for number in range(10):
+        cache.set(f'10.0.0.{number}', 'a')
+    assert len(counts) == 1
+    cache.set('10.0.0.10', 'a')
+    assert len(counts) == 2
+    assert len(disk_rows(cache)) == 9
+
+
+def test_replaced_entries_do_not_evict_below_the_max_size(make_cache):
+    cache = make_cache(max_size=10)
+    for _ in range(25):
+        cache.set('1.1.1.1', 'a')
+        cache.set('2.2.2.2', 'b')
+    assert disk_rows(cache) == {'1.1.1.1': 'a', '2.2.2.2': 'b'}
+    assert cache._disk_size <= cache.max_size
+
+
+def test_disabled_cache_stores_nothing(make_cache):
+    cache = make_cache(enabled=False)
+    cache.set('1.1.1.1', 'a')
+    assert cache.get('1.1.1.1') is None
+    assert cache._connection is None
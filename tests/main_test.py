@@ -0,0 +1,62 @@
+from __future__ import annotations
+
+from dataclasses import replace
+from datetime import datetime
+from datetime import timedelta
+
+import pytest
+
+import main
+
+STARTED_AT = datetime(2024, 3, 1)
+BEFORE = {'qualys': datetime(2024, 1, 1), 'crowdstrike': datetime(2024, 1, 1)}
+LATEST = {'qualys': datetime(2024, 2, 1), 'crowdstrike': datetime(2024, 2, 2)}
+
+
+@pytest.fixture
+def incremental(monkeypatch, mongo):
+    monkeypatch.setattr(main, 'settings', replace(main.settings, INCREMENTAL_SYNC=True, FULL_SYNC_INTERVAL=3600))
+    mongo.update_watermarks(BEFORE)
+    return mongo
+
+
+def test_clean_full_run_moves_the_watermarks_and_records_the_full_sync(incremental):
+    main.save_sync_watermarks(LATEST, [{'write_errors': 0}], full_sync_started_at=STARTED_AT)
+    assert incremental.get_watermarks() == LATEST
+    assert incremental.get_last_full_sync() == STARTED_AT
+
+
+def test_watermarks_never_move_back(incremental):
+    main.save_sync_watermarks(LATEST, [{'write_errors': 0}])
+    main.save_sync_watermarks(BEFORE, [{'write_errors': 0}])
+    assert incremental.get_watermarks() == LATEST
+
+
+def test_failed_write_keeps_every_watermark_and_is_not_a_full_sync(incremental):
+    main.save_sync_watermarks(
+        LATEST, [{'write_errors': 0}, {'write_errors': 1}], full_sync_started_at=STARTED_AT,
+    )
+    assert incremental.get_watermarks() == BEFORE
+    assert incremental.get_last_full_sync() is None
+
+
+def test_incomplete_source_keeps_its_watermark_and_is_not_a_full_sync(incremental):
+    main.save_sync_watermarks(
+        LATEST, [{'write_errors': 0}], full_sync_started_at=STARTED_AT, incomplete={'qualys'},
+    )
+    assert incremental.get_watermarks() == {'qualys': BEFORE['qualys'], 'crowdstrike': LATEST['crowdstrike']}
+    assert incremental.get_last_full_sync() is None
+
+
+def test_get_sync_watermarks_runs_a_full_sync_when_due(incremental):
+    assert main.get_sync_watermarks() is None
+    incremental.set_last_full_sync(datetime.now() - timedelta(minutes=5))
+    assert main.get_sync_watermarks() == BEFORE
+    incremental.set_last_full_sync(datetime.now() - timedelta(hours=2))
+    assert main.get_sync_watermarks() is None
+
+
+def test_watermarks_are_not_saved_without_incremental_sync(mongo):
+    main.save_sync_watermarks(LATEST, [{'write_errors': 0}], full_sync_started_at=STARTED_AT)
+    assert mongo.get_watermarks() == {}
+    assert mongo.get_last_full_sync() is None
@@ -0,0 +1,73 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import pstats
+import sys
+
+import pytest
+
+from metrics import PipelineMetrics
+
+
+def busy_stage(count):
+    return sum(range(count))
+
+
+@pytest.fixture
+def pipeline_metrics(tmp_path):
+    pipeline_metrics = PipelineMetrics()
+    pipeline_metrics.path = str(tmp_path / 'metrics' / 'pipeline.prom')
+    pipeline_metrics.profile_dir = str(tmp_path / 'profiles')
+    return pipeline_metrics
+
+
+def test_render_reports_the_process_peak_rss_and_no_stage_peak(pipeline_metrics):
+    with pipeline_metrics.stage('load'):
+        pass
+    lines = pipeline_metrics.render().splitlines()
+    assert 'pipeline_stage_calls_total{stage="load"} 1' in lines
+    assert any(line.startswith('pipeline_process_peak_rss_bytes ') for line in lines)
+    assert not any('stage_peak' in line for line in lines)
+
+
+def test_use_worker_labels_the_series_and_writes_its_own_file(pipeline_metrics):
+    pipeline_metrics.use_worker('w1')
+    pipeline_metrics.finish_run(1.5)
+    assert pipeline_metrics.path.endswith('pipeline-w1.prom')
+    with open(pipeline_metrics.path) as metrics_file:
+        lines = metrics_file.read().splitlines()
+    assert 'pipeline_runs_total{worker="w1"} 1' in lines
+    assert 'pipeline_stage_calls_total{worker="w1",stage="load"} 0' in lines
+
+
+def test_write_replaces_the_file_without_leaving_temporary_files(pipeline_metrics):
+    pipeline_metrics.write()
+    pipeline_metrics.finish_run(2.0)
+    directory = os.path.dirname(pipeline_metrics.path)
+    assert os.listdir(directory) == ['pipeline.prom']
+    assert os.stat(pipeline_metrics.path).st_mode & 0o777 == 0o644
+    with open(pipeline_metrics.path) as metrics_file:
+        assert 'pipeline_runs_total 1' in metrics_file.read().splitlines()
+
+
+def test_write_failure_does_not_raise(pipeline_metrics, tmp_path):
+    blocker = tmp_path / 'blocker'
+    blocker.write_text('')
+    pipeline_metrics.path = str(blocker / 'pipeline.prom')
+    pipeline_metrics.finish_run(1.0)
+
+
+@pytest.mark.skipif(sys.version_info >= (3, 12), reason='only one profiler can be active at a time from Python 3.12 on')
+def test_cprofile_includes_the_worker_thread_calls(pipeline_metrics):
+    pipeline_metrics.profile_mode = 'cprofile'
+
+    async def run():
+        with pipeline_metrics.profile():
+            await pipeline_metrics.to_thread(busy_stage, 1000)
+
+    asyncio.run(run())
+    assert pipeline_metrics._thread_profiles is None
+    [profile] = os.listdir(pipeline_metrics.profile_dir)
+    stats = pstats.Stats(os.path.join(pipeline_metrics.profile_dir, profile))
+    assert 'busy_stage' in {function for _, _, function in stats.stats}
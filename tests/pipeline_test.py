@@ -0,0 +1,70 @@
+from __future__ import annotations
+
+import asyncio
+from datetime import timedelta
+
+import pytest
+
+from pipeline import DONE
+from pipeline import StreamingPipeline
+
+
+async def run_stages(pipeline, pages, load_results=None):
+    hosts = asyncio.Queue()
+    batches = asyncio.Queue()
+    for page in pages:
+        hosts.put_nowait(page)
+    hosts.put_nowait(DONE)
+    await pipeline.dedup_stage(hosts, batches)
+    if load_results is not None:
+        await pipeline.load_stage(batches, load_results)
+        return []
+    emitted = []
+    while (batch := batches.get_nowait()) is not DONE:
+        emitted.append(batch)
+    return emitted
+
+
+@pytest.fixture
+def pipeline():
+    pipeline = StreamingPipeline()
+    pipeline.batch_size = 10
+    return pipeline
+
+
+def test_dedup_keeps_the_newest_host_of_the_batch(make_host, pipeline):
+    host = make_host()
+    newer = make_host(updated=host.updated + timedelta(hours=1), status='offline')
+    older = make_host(updated=host.updated - timedelta(hours=1), status='unknown')
+    other = make_host(host_id='host-2')
+    batches = asyncio.run(run_stages(pipeline, [[host, other], [newer, older]]))
+    assert batches == [[newer, other]]
+
+
+def test_dedup_emits_batches_of_batch_size(make_host, pipeline):
+    pipeline.batch_size = 2
+    hosts = [make_host(host_id=f'host-{number}') for number in range(5)]
+    batches = asyncio.run(run_stages(pipeline, [hosts[:3], hosts[3:]]))
+    assert batches == [hosts[:2], hosts[2:4], hosts[4:]]
+
+
+def test_dedup_only_holds_the_pending_batch(make_host, pipeline):
+    pipeline.batch_size = 1
+    host = make_host()
+    batches = asyncio.run(run_stages(pipeline, [[host], [host]]))
+    assert batches == [[host], [host]]
+
+
+def test_newer_duplicate_in_a_later_batch_replaces_the_earlier_one_on_load(make_host, mongo, pipeline):
+    pipeline.batch_size = 1
+    host = make_host()
+    newer = make_host(updated=host.updated + timedelta(hours=1), status='offline')
+    older = make_host(updated=host.updated - timedelta(hours=1), status='unknown')
+    other = make_host(host_id='host-2')
+    load_results = []
+    asyncio.run(run_stages(pipeline, [[host], [other], [newer], [older]], load_results))
+    stored = {document['host_id']: document for document in mongo.collection.find({}, {'_id': 0})}
+    assert stored['host-1']['status'] == 'offline'
+    assert stored['host-1']['updated'] == newer.updated
+    assert set(stored) == {'host-1', 'host-2'}
+    assert not any(result['write_errors'] for result in load_results)
@@ -0,0 +1,106 @@
+from __future__ import annotations
+
+import asyncio
+from datetime import datetime
+from datetime import timedelta
+from datetime import timezone
+from email.utils import format_datetime
+
+import pytest
+
+from request_controller import AdaptiveLimiter
+from request_controller import RequestController
+
+
+@pytest.fixture
+def controller():
+    controller = RequestController()
+    controller.max_retries = 2
+    controller.backoff_base = 0.5
+    controller.backoff_max = 30
+    controller.max_concurrency = 8
+    controller.initial_concurrency = 4
+    return controller
+
+
+def run_requests(limiter, outcomes):
+    """
+    Release one request per (latency, throttled) outcome, each sent while the limit was reached.
+    """
+    async def run():
+        limiter.condition
+        for latency, throttled in outcomes:
+            limiter.in_flight = limiter.concurrency
+            await limiter.release(latency, throttled)
+
+    asyncio.run(run())
+
+
+def test_retry_delay_honors_retry_after_in_seconds(controller):
+    assert controller.retry_delay(0, '3') == 3.0
+    assert controller.retry_delay(0, '0') == 0.0
+    assert controller.retry_delay(0, '3600') == controller.backoff_max
+
+
+def test_retry_delay_honors_retry_after_as_http_date(controller):
+    retry_at = datetime.now(timezone.utc) + timedelta(seconds=20)
+    assert 18 <= controller.retry_delay(0, format_datetime(retry_at, usegmt=True)) <= 20
+    past = datetime.now(timezone.utc) - timedelta(seconds=20)
+    assert controller.retry_delay(0, format_datetime(past, usegmt=True)) == 0.0
+
+
+def test_retry_delay_falls_back_to_jittered_backoff(controller):
+    for attempt in range(8):
+        ceiling = min(controller.backoff_max, controller.backoff_base * 2 ** attempt)
+        assert 0 <= controller.retry_delay(attempt, 'soon') <= ceiling
+        assert 0 <= controller.retry_delay(attempt) <= ceiling
+
+
+def test_should_retry_gives_up_after_max_retries(controller):
+    assert controller.should_retry(429, 0)
+    assert controller.should_retry(None, 1)
+    assert not controller.should_retry(503, 2)
+    assert not controller.should_retry(404, 0)
+
+
+def test_limiter_halves_the_limit_on_a_throttled_response(controller):
+    limiter = controller.limiter('source')
+    assert limiter.concurrency == 4
+    run_requests(limiter, [(0.0, True)])
+    assert limiter.concurrency == 2
+
+
+def test_limiter_halves_the_limit_on_a_slow_response(controller):
+    limiter = controller.limiter('source')
+    run_requests(limiter, [(limiter.latency_target + 1, False)])
+    assert limiter.concurrency == 2
+
+
+def test_limiter_grows_by_about_one_per_round_of_requests(controller):
+    limiter = controller.limiter('source')
+    run_requests(limiter, [(0.0, False)] * 5)
+    assert limiter.concurrency == 5
+
+
+def test_limiter_does_not_grow_below_the_limit(controller):
+    limiter = controller.limiter('source')
+
+    async def run():
+        await limiter.acquire()
+        await limiter.release(0.0, False)
+
+    asyncio.run(run())
+    assert limiter.limit == 4
+
+
+def test_limiter_stays_within_its_bounds(controller):
+    limiter = controller.limiter('source')
+    run_requests(limiter, [(0.0, True)] * 10)
+    assert limiter.concurrency == 1
+    run_requests(limiter, [(0.0, False)] * 200)
+    assert limiter.concurrency == controller.max_concurrency
+
+
+def test_limiter_initial_limit_is_clamped():
+    assert AdaptiveLimiter('source', 0, 1, 8, 5).concurrency == 1
+    assert AdaptiveLimiter('source', 20, 1, 8, 5).concurrency == 8
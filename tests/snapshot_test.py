@@ -0,0 +1,106 @@
+from __future__ import annotations
+
+import dataclasses
+import os
+
+import pytest
+
+import data_visualizer
+from snapshot import InventorySnapshot
+from snapshot import MANIFEST_FILE
+
+
+@pytest.fixture
+def snapshot(tmp_path):
+    snapshot = InventorySnapshot()
+    snapshot.enabled = True
+    snapshot.directory = str(tmp_path / 'snapshots')
+    return snapshot
+
+
+def write_run(snapshot, run, hosts, full):
+    writer = snapshot.start_run(run)
+    writer.write_hosts(hosts)
+    assert writer.close(full=full, unique=True)
+
+
+def read_hosts(snapshot):
+    dataframe = snapshot.read(['host_id', 'os', 'updated'])
+    return {row.host_id: row.os for row in dataframe.itertuples()}
+
+
+def test_read_keeps_the_newest_version_of_every_host_of_the_full_and_incremental_runs(snapshot, make_host):
+    write_run(
+        snapshot, '2024-01-01', [
+            make_host(host_id='host-1', os='Linux', updated='2024-01-01T00:00:00Z'),
+            make_host(host_id='host-2', os='Linux', updated='2024-01-01T00:00:00Z'),
+        ], full=True,
+    )
+    write_run(
+        snapshot, '2024-01-02', [
+            make_host(host_id='host-1', os='Windows', updated='2024-01-02T00:00:00Z'),
+            make_host(host_id='host-3', os='Windows', updated='2024-01-02T00:00:00Z'),
+        ], full=False,
+    )
+
+    dataframe = snapshot.read(['host_id', 'os'])
+
+    assert list(dataframe.columns) == ['host_id', 'os']
+    assert dataframe['host_id'].is_unique
+    assert read_hosts(snapshot) == {'host-1': 'Windows', 'host-2': 'Linux', 'host-3': 'Windows'}
+
+
+def test_read_keeps_the_newest_version_when_an_older_one_is_written_later(snapshot, make_host):
+    write_run(snapshot, '2024-01-01', [make_host(host_id='host-1', os='Linux')], full=True)
+    # Parts of a run may hold several versions of a host, in any order
+    snapshot.write_part('2024-01-02', 'part-00000001', [make_host(host_id='host-1', os='Windows', updated='2024-01-03T00:00:00Z')])
+    snapshot.write_part('2024-01-02', 'part-00000002', [make_host(host_id='host-1', os='macOS', updated='2024-01-02T12:00:00Z')])
+    snapshot.finish_run('2024-01-02', full=False)
+
+    assert read_hosts(snapshot) == {'host-1': 'Windows'}
+
+
+def test_read_starts_at_the_newest_full_run_and_skips_incomplete_runs(snapshot, make_host):
+    write_run(snapshot, '2024-01-01', [make_host(host_id='host-1', os='Linux')], full=True)
+    write_run(snapshot, '2024-01-02', [make_host(host_id='host-2', os='Linux')], full=False)
+    write_run(snapshot, '2024-01-03', [make_host(host_id='host-3', os='Linux')], full=True)
+    writer = snapshot.start_run('2024-01-04')
+    writer.write_hosts([make_host(host_id='host-4', os='Linux')])
+    writer.abort()
+
+    assert read_hosts(snapshot) == {'host-3': 'Linux'}
+
+    snapshot.prune()
+
+    assert sorted(os.listdir(snapshot.directory)) == ['run=2024-01-03', 'run=2024-01-04']
+
+
+def test_read_without_a_complete_full_run_raises(snapshot, make_host):
+    with pytest.raises(FileNotFoundError):
+        snapshot.read(['host_id'])
+
+    write_run(snapshot, '2024-01-01', [make_host(host_id='host-1')], full=False)
+    writer = snapshot.start_run('2024-01-02')
+    writer.write_hosts([make_host(host_id='host-2')])
+    writer.abort()
+
+    assert not os.path.exists(os.path.join(snapshot.run_directory('2024-01-02'), MANIFEST_FILE))
+    with pytest.raises(FileNotFoundError):
+        snapshot.read(['host_id'])
+
+
+def test_visualizer_falls_back_to_mongodb_without_a_complete_snapshot(monkeypatch, tmp_path, mongo, make_host):
+    import snapshot
+
+    monkeypatch.setattr(snapshot.inventory_snapshot, 'directory', str(tmp_path / 'snapshots'))
+    monkeypatch.setattr(
+        data_visualizer, 'settings', dataclasses.replace(data_visualizer.settings, VISUALIZER_SOURCE='snapshot'),
+    )
+    mongo.collection.insert_many([
+        dataclasses.asdict(make_host(host_id='host-1')),
+        dataclasses.asdict(make_host(host_id='host-2', os='Windows')),
+    ])
+
+    dataframe = data_visualizer.DataVisualizationHandler().dataframe
+
+    assert sorted(dataframe['os']) == ['Linux', 'Windows']
@@ -0,0 +1,133 @@
+from __future__ import annotations
+
+import pytest
+
+from data_normalizer import DataNormalizer
+from data_normalizer import HostInfo
+from source_adapters import compile_extractor
+from source_adapters import FieldPath
+from source_adapters import SourceAdapter
+
+RECORD = {
+    'name': 'web-01',
+    'nothing': None,
+    'text': 'abc',
+    'count': 3,
+    'agent': {'platform': 'Linux', 'version': None, 'tags': ['a', 'b']},
+    'interfaces': {'list': [{'mac': '00:01'}, {'mac': '00:02'}]},
+    'numbers': {0: 'zero'},
+    'empty': [],
+}
+
+PATHS = [
+    ('name',),
+    ('missing',),
+    ('nothing',),
+    ('nothing', 'deeper'),
+    ('text', 'deeper'),
+    ('text', 0),
+    ('count', 'deeper'),
+    ('count', 0),
+    ('agent', 'platform'),
+    ('agent', 'version'),
+    ('agent', 'missing'),
+    ('agent', 'missing', 'deeper'),
+    ('agent', 'tags', 1),
+    ('agent', 'tags', -1),
+    ('agent', 'tags', 5),
+    ('agent', 'tags', 'deeper'),
+    ('agent', 'tags', 0, 0),
+    ('agent', 'tags', 0, 'deeper'),
+    ('interfaces', 'list', 0, 'mac'),
+    ('interfaces', 'list', 1, 'mac'),
+    ('interfaces', 'list', 2, 'mac'),
+    ('interfaces', 'list', 'mac'),
+    ('numbers', 0),
+    ('empty', 0),
+    ('empty', 0, 'mac'),
+    (),
+]
+
+
+def extract_value(path):
+    return compile_extractor('test', {'value': path})
+
+
+@pytest.mark.parametrize('default', ['', None, 'unknown'])
+@pytest.mark.parametrize('keys', PATHS)
+def test_extractor_matches_get_nested(keys, default):
+    extract = extract_value(FieldPath(keys, default=default))
+    expected = DataNormalizer().get_nested(RECORD, list(keys), default) if keys else default
+    assert extract(RECORD) == expected
+
+
+def test_required_field_raises_key_error_when_missing():
+    extract = extract_value(FieldPath(('agent', 'missing'), required=True))
+    with pytest.raises(KeyError):
+        extract(RECORD)
+    assert extract_value(FieldPath(('agent', 'platform'), required=True))(RECORD) == 'Linux'
+
+
+def test_convert_is_applied_to_the_value():
+    assert extract_value(FieldPath(('count',), convert='str'))(RECORD) == '3'
+    assert extract_value(FieldPath(('interfaces', 'list', 0, 'mac'), convert='str'))(RECORD) == '00:01'
+
+
+def test_unknown_converter_is_rejected():
+    with pytest.raises(ValueError):
+        FieldPath.from_config({'path': ['count'], 'convert': 'int'})
+
+
+def test_field_path_from_config():
+    assert FieldPath.from_config('name') == FieldPath(('name',))
+    assert FieldPath.from_config(['interfaces', 'list', 0]) == FieldPath(('interfaces', 'list', 0))
+    assert FieldPath.from_config({'path': ['_id'], 'required': True, 'convert': 'str'}) == FieldPath(
+        ('_id',), required=True, convert='str',
+    )
+
+
+def make_adapter():
+    return SourceAdapter(
+        name='test',
+        label='Test',
+        fields={
+            'host_id': FieldPath(('id',), required=True, convert='str'),
+            'hostname': FieldPath(('name',)),
+            'os': FieldPath(('agent', 'platform')),
+            'last_seen': FieldPath(('seen',)),
+            'created': FieldPath(('seen',)),
+            'updated': FieldPath(('seen',)),
+            'first_seen': FieldPath(('seen',)),
+            'cloud_provider': FieldPath(('cloud',), default=None),
+        },
+        geo=FieldPath(('external_ip',), default=None),
+    )
+
+
+def test_host_extractor_builds_the_host():
+    extract = make_adapter().host_extractor(DataNormalizer().field_names)
+    record = {**RECORD, 'id': 7, 'seen': '2024-01-02T00:00:00Z', 'external_ip': '1.2.3.4'}
+    host = extract(record, HostInfo, {'1.2.3.4': 'Kathmandu, Bagmati Nepal'}.get)
+    assert host.host_id == '7'
+    assert host.hostname == 'web-01'
+    assert host.os == 'Linux'
+    assert host.location == 'Kathmandu, Bagmati Nepal'
+    assert host.cloud_provider is None
+    assert host.mac_address == ''
+    with pytest.raises(KeyError):
+        extract(RECORD, HostInfo, {}.get)
+
+
+def test_host_extractor_rejects_unknown_fields():
+    adapter = make_adapter()
+    adapter.fields['unknown'] = FieldPath(('name',))
+    with pytest.raises(ValueError):
+        adapter.host_extractor(DataNormalizer().field_names)
+
+
+def test_accessor_reads_required_fields_as_optional():
+    adapter = make_adapter()
+    assert adapter.accessor('host_id')({'id': 7}) == '7'
+    assert adapter.accessor('host_id')({}) == ''
+    assert adapter.accessor('geo')({'external_ip': '1.2.3.4'}) == '1.2.3.4'
+    assert adapter.accessor('geo')({}) is None
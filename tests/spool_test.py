@@ -0,0 +1,97 @@
+from __future__ import annotations
+
+import gzip
+import json
+import os
+
+import pytest
+
+from spool import MANIFEST_FILE
+from spool import PayloadSpool
+
+
+@pytest.fixture
+def spool(tmp_path):
+    spool = PayloadSpool()
+    spool.enabled = True
+    spool.directory = str(tmp_path / 'spool')
+    spool.segment_records = 3
+    spool.keep_runs = 3
+    spool.replay_run = ''
+    return spool
+
+
+def records(source, count):
+    # Only fields of the schemas of the sources, which the replayed records are decoded against
+    key = 'device_id' if source == 'crowdstrike' else '_id'
+    return [{key: f'{source}-{number}'} for number in range(count)]
+
+
+def spool_run(spool, pages, complete=True):
+    writer = spool.start_run()
+    for source, page in pages:
+        writer.write_page(source, page)
+    if complete:
+        writer.close()
+    else:
+        writer.abort()
+    return os.path.basename(writer.directory)
+
+
+def test_pages_round_trip_through_rolled_over_segments(spool):
+    qualys, crowdstrike = records('qualys', 7), records('crowdstrike', 2)
+    run = spool_run(spool, [('qualys', qualys[:4]), ('crowdstrike', crowdstrike), ('qualys', qualys[4:])])
+    directory = os.path.join(spool.directory, run)
+    with open(os.path.join(directory, MANIFEST_FILE)) as manifest_file:
+        manifest = json.load(manifest_file)
+    assert manifest['sources']['qualys'] == {
+        'records': 7,
+        'segments': ['qualys-00000.ndjson.gz', 'qualys-00001.ndjson.gz', 'qualys-00002.ndjson.gz'],
+    }
+    assert manifest['sources']['crowdstrike']['segments'] == ['crowdstrike-00000.ndjson.gz']
+    with gzip.open(os.path.join(directory, 'qualys-00000.ndjson.gz')) as segment:
+        assert [json.loads(line) for line in segment] == qualys[:3]
+    assert not [name for name in os.listdir(directory) if name.endswith('.tmp')]
+
+    spool.replay_run = run
+    assert spool.replaying and not spool.spooling
+    assert list(spool.iter_pages('qualys', 5)) == [qualys[:5], qualys[5:]]
+    assert list(spool.iter_records('crowdstrike')) == crowdstrike
+    assert list(spool.iter_records('other')) == []
+
+
+def test_aborted_run_has_no_manifest_and_cannot_be_replayed(spool):
+    run = spool_run(spool, [('qualys', records('qualys', 4))], complete=False)
+    assert not os.path.exists(os.path.join(spool.directory, run, MANIFEST_FILE))
+    assert spool.complete_runs() == []
+    spool.replay_run = run
+    with pytest.raises(FileNotFoundError):
+        list(spool.iter_records('qualys'))
+
+
+def test_replay_latest_skips_the_runs_without_manifest(spool):
+    complete = spool_run(spool, [('qualys', records('qualys', 2))])
+    spool_run(spool, [('qualys', records('qualys', 4))], complete=False)
+    spool.replay_run = 'latest'
+    assert spool.run_directory() == os.path.join(spool.directory, complete)
+    assert list(spool.iter_records('qualys')) == records('qualys', 2)
+
+
+def test_replay_latest_without_complete_run_fails(spool):
+    spool.replay_run = 'latest'
+    with pytest.raises(FileNotFoundError):
+        spool.run_directory()
+
+
+def test_start_run_keeps_the_newest_runs(spool):
+    runs = [spool_run(spool, [('qualys', records('qualys', 1))]) for _ in range(5)]
+    assert sorted(os.listdir(spool.directory)) == runs[-3:]
+    assert spool.complete_runs() == runs[-3:]
+
+
+def test_no_writer_while_replaying_or_disabled(spool):
+    spool.replay_run = 'latest'
+    assert spool.start_run() is None
+    spool.replay_run = ''
+    spool.enabled = False
+    assert spool.start_run() is None
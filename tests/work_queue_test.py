@@ -0,0 +1,92 @@
+from __future__ import annotations
+
+import pytest
+
+from work_queue import partition_of
+from work_queue import WorkQueue
+from work_queue import WorkUnit
+
+
+def make_unit(*host_ids):
+    return WorkUnit(records={'qualys': [{'_id': host_id} for host_id in host_ids]})
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = WorkQueue()
+    queue.path = str(tmp_path / 'queue' / 'work.sqlite3')
+    queue.lease_seconds = 300
+    queue.max_attempts = 2
+    return queue
+
+
+def test_partition_of_is_stable():
+    assert partition_of('host-1', 64) == partition_of('host-1', 64)
+    assert 0 <= partition_of('host-1', 64) < 64
+
+
+def test_lease_returns_the_oldest_unit(queue):
+    queue.enqueue('run', 1, make_unit('a'))
+    queue.enqueue('run', 2, make_unit('b'))
+    unit_id, run, unit = queue.lease('worker-1')
+    assert run == 'run'
+    assert unit == make_unit('a')
+    assert queue.run_status('run') == {'pending': 1, 'leased': 1, 'done': 0, 'failed': 0, 'write_errors': 0}
+
+
+def test_one_lease_per_partition(queue):
+    queue.enqueue('run', 1, make_unit('a'))
+    queue.enqueue('run', 1, make_unit('b'))
+    queue.enqueue('run', 2, make_unit('c'))
+    first_id, _, first = queue.lease('worker-1')
+    _, _, second = queue.lease('worker-2')
+    assert first == make_unit('a')
+    assert second == make_unit('c')
+    assert queue.lease('worker-3') is None
+    assert queue.acknowledge(first_id, 'worker-1', 0)
+    assert queue.lease('worker-3')[2] == make_unit('b')
+
+
+def test_expired_lease_is_taken_over(queue):
+    queue.lease_seconds = 0
+    queue.enqueue('run', 1, make_unit('a'))
+    unit_id, _, _ = queue.lease('worker-1')
+    assert queue.lease('worker-2')[0] == unit_id
+    assert not queue.extend_lease(unit_id, 'worker-1')
+    assert not queue.acknowledge(unit_id, 'worker-1', 0)
+    assert queue.acknowledge(unit_id, 'worker-2', 3)
+    assert queue.run_status('run') == {'pending': 0, 'leased': 0, 'done': 1, 'failed': 0, 'write_errors': 3}
+
+
+def test_expired_lease_fails_after_max_attempts(queue):
+    queue.lease_seconds = 0
+    queue.enqueue('run', 1, make_unit('a'))
+    assert queue.lease('worker-1') is not None
+    assert queue.lease('worker-2') is not None
+    assert queue.run_status('run')['failed'] == 1
+    assert queue.lease('worker-3') is None
+    assert queue.run_status('run') == {'pending': 0, 'leased': 0, 'done': 0, 'failed': 1, 'write_errors': 0}
+
+
+def test_release_retries_until_max_attempts(queue):
+    queue.enqueue('run', 1, make_unit('a'))
+    unit_id, _, _ = queue.lease('worker-1')
+    queue.release(unit_id, 'worker-1')
+    assert queue.run_status('run')['pending'] == 1
+    assert queue.lease('worker-2')[0] == unit_id
+    queue.release(unit_id, 'worker-2')
+    assert queue.run_status('run')['failed'] == 1
+    assert queue.lease('worker-3') is None
+
+
+def test_purge_keeps_the_current_run_and_unfinished_units(queue):
+    queue.enqueue('old', 1, make_unit('a'))
+    queue.enqueue('old', 2, make_unit('b'))
+    queue.enqueue('new', 3, make_unit('c'))
+    unit_id, _, _ = queue.lease('worker-1')
+    queue.acknowledge(unit_id, 'worker-1', 0)
+    unit_id, _, _ = queue.lease('worker-1')
+    queue.purge(keep_run='old')
+    assert queue.run_status('old')['done'] == 1
+    queue.purge(keep_run='new')
+    assert queue.run_status('old') == {'pending': 0, 'leased': 1, 'done': 0, 'failed': 0, 'write_errors': 0}
@@ -0,0 +1,203 @@
+from __future__ import annotations
+
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Any
+
+import msgspec
+
+from config import settings
+from logger import Logger
+
+logger = Logger().get_logger()
+
+# Fast compression, the payloads are written while the pages are fetched
+COMPRESS_LEVEL = 1
+
+
+def partition_of(host_id: str, partitions: int) -> int:
+    """
+    Return the partition of the host ID, stable across processes and machines.
+    """
+    return zlib.crc32(host_id.encode('utf-8')) % partitions
+
+
+class WorkUnit(msgspec.Struct):
+    """
+    Raw records of one partition per source to normalize and load, with the locations of their external IP addresses.
+    """
+    records: dict[str, list[dict[str, Any]]] = {}
+    locations: dict[str, str] = {}
+
+    def __len__(self) -> int:
+        return sum(map(len, self.records.values()))
+
+
+class WorkQueue:
+    """
+    Durable queue of work units in a SQLite file shared by the coordinator and the workers.
+    A unit is leased by one worker for `lease_seconds` and acknowledged once its hosts are loaded.
+    A unit whose lease expires, because its worker died or failed, is leased again, so every unit is
+    processed at least once. The units of one partition are leased one at a time and oldest first,
+    so the same host is never written by two workers at once.
+    """
+
+    def __init__(self):
+        """
+        Initializing the WorkQueue class with the SQLite file path and the lease settings.
+        The SQLite connection is opened on first use, so every process opens its own.
+        """
+        self.path = settings.WORK_QUEUE_PATH
+        self.lease_seconds = settings.WORK_LEASE_SECONDS
+        self.max_attempts = max(1, settings.WORK_MAX_ATTEMPTS)
+        self._lock = threading.Lock()
+        self._connection = None
+        self._pid = None
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """
+        Open the SQLite connection and create the table if it does not exist yet.
+        Transactions are started explicitly, so concurrent leases do not race.
+        """
+        if self._connection is None or self._pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._connection = sqlite3.connect(
+                self.path, timeout=30, isolation_level=None, check_same_thread=False,
+            )
+            self._pid = os.getpid()
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS units ('
+                'id INTEGER PRIMARY KEY AUTOINCREMENT, run TEXT NOT NULL, partition INTEGER NOT NULL, '
+                'records INTEGER NOT NULL, payload BLOB, state TEXT NOT NULL DEFAULT \'pending\', '
+                'lease_owner TEXT, lease_expires REAL, attempts INTEGER NOT NULL DEFAULT 0, '
+                'write_errors INTEGER NOT NULL DEFAULT 0)',
+            )
+            self._connection.execute(
+                'CREATE INDEX IF NOT EXISTS units_state ON units (state, partition)',
+            )
+            self._connection.execute(
+                'CREATE INDEX IF NOT EXISTS units_run ON units (run, state)',
+            )
+        return self._connection
+
+    def enqueue(self, run: str, partition: int, unit: WorkUnit):
+        """
+        Add a pending unit of the partition to the run.
+        """
+        payload = zlib.compress(msgspec.json.encode(unit), COMPRESS_LEVEL)
+        with self._lock:
+            self.connection.execute(
+                'INSERT INTO units (run, partition, records, payload) VALUES (?, ?, ?, ?)',
+                (run, partition, len(unit), payload),
+            )
+
+    def lease(self, owner: str) -> tuple[int, str, WorkUnit] | None:
+        """
+        Lease the oldest unit of a partition no other worker holds a lease on.
+        Expired leases are taken over, and marked failed once the unit used up its attempts.
+        Returns the unit ID, its run and the unit, or None when there is nothing to lease.
+        """
+        now = time.time()
+        with self._lock:
+            connection = self.connection
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                connection.execute(
+                    "UPDATE units SET state = 'failed', lease_owner = NULL "
+                    "WHERE state = 'leased' AND lease_expires <= ? AND attempts >= ?",
+                    (now, self.max_attempts),
+                )
+                row = connection.execute(
+                    'SELECT id, run, payload FROM units '
+                    "WHERE (state = 'pending' OR (state = 'leased' AND lease_expires <= :now)) "
+                    'AND partition NOT IN ('
+                    "SELECT partition FROM units WHERE state = 'leased' AND lease_expires > :now) "
+                    'ORDER BY id LIMIT 1',
+                    {'now': now},
+                ).fetchone()
+                if row is not None:
+                    connection.execute(
+                        "UPDATE units SET state = 'leased', lease_owner = ?, lease_expires = ?, "
+                        'attempts = attempts + 1 WHERE id = ?',
+                        (owner, now + self.lease_seconds, row[0]),
+                    )
+                connection.execute('COMMIT')
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+        if row is None:
+            return None
+        unit_id, run, payload = row
+        return unit_id, run, msgspec.json.decode(zlib.decompress(payload), type=WorkUnit)
+
+    def extend_lease(self, unit_id: int, owner: str) -> bool:
+        """
+        Push the lease of the unit `lease_seconds` forward. Returns False when the lease was lost.
+        """
+        with self._lock:
+            cursor = self.connection.execute(
+                "UPDATE units SET lease_expires = ? WHERE id = ? AND lease_owner = ? AND state = 'leased'",
+                (time.time() + self.lease_seconds, unit_id, owner),
+            )
+        return cursor.rowcount == 1
+
+    def acknowledge(self, unit_id: int, owner: str, write_errors: int) -> bool:
+        """
+        Mark the leased unit done and drop its payload. Returns False when the lease was lost,
+        in which case another worker processes the unit again.
+        """
+        with self._lock:
+            cursor = self.connection.execute(
+                "UPDATE units SET state = 'done', payload = NULL, lease_owner = NULL, write_errors = ? "
+                "WHERE id = ? AND lease_owner = ? AND state = 'leased'",
+                (write_errors, unit_id, owner),
+            )
+        return cursor.rowcount == 1
+
+    def release(self, unit_id: int, owner: str):
+        """
+        Give the lease of a unit which failed back, so it is retried, or mark it failed once it used up its attempts.
+        """
+        with self._lock:
+            self.connection.execute(
+                "UPDATE units SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                "lease_owner = NULL, lease_expires = NULL WHERE id = ? AND lease_owner = ? AND state = 'leased'",
+                (self.max_attempts, unit_id, owner),
+            )
+
+    def run_status(self, run: str) -> dict[str, int]:
+        """
+        Return the number of units of the run per state and the write errors of its done units.
+        Units whose lease expired after their last attempt count as failed.
+        """
+        now = time.time()
+        with self._lock:
+            rows = self.connection.execute(
+                "SELECT CASE WHEN state = 'leased' AND lease_expires <= ? AND attempts >= ? "
+                "THEN 'failed' ELSE state END, COUNT(*), SUM(write_errors) FROM units WHERE run = ? GROUP BY 1",
+                (now, self.max_attempts, run),
+            ).fetchall()
+        status = {'pending': 0, 'leased': 0, 'done': 0, 'failed': 0, 'write_errors': 0}
+        for state, count, write_errors in rows:
+            status[state] += count
+            status['write_errors'] += write_errors or 0
+        return status
+
+    def purge(self, keep_run: str | None = None):
+        """
+        Delete the done units of every run but `keep_run`.
+        """
+        with self._lock:
+            self.connection.execute(
+                "DELETE FROM units WHERE state = 'done' AND run != ?", (keep_run or '',),
+            )
+
+
+work_queue = WorkQueue()
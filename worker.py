@@ -0,0 +1,311 @@
+"""
+Coordinator/worker mode of the pipeline.
+
+The coordinator fetches the pages of both sources, resolves the locations of the CrowdStrike devices,
+splits the records by partition of their host ID into work units on the durable work queue and waits
+until the workers loaded them. Each worker leases one unit at a time, normalizes, deduplicates and
+loads its hosts, writes them to the snapshot part of the unit and acknowledges it. Workers can run on several machines sharing the queue file.
+
+    python worker.py coordinator
+    python worker.py worker --processes 4
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+import time
+from datetime import datetime
+from typing import Any
+
+from config import settings
+from data_fetcher import data_fetcher
+from data_normalizer import DataNormalizer
+from databases import mongo_db
+from geo_enricher import geo_enricher
+from logger import Logger
+from main import get_sync_watermarks
+from main import save_sync_watermarks
+from main import visualize_data
+from metrics import metrics
+from resources import resources
+from source_adapters import source_adapters
+from work_queue import partition_of
+from work_queue import work_queue
+from work_queue import WorkUnit
+
+logger = Logger().get_logger()
+
+
+class Coordinator:
+    """
+    Class to split the fetched records into work units per partition of their host ID.
+    """
+
+    def __init__(self):
+        """
+        Initializing the Coordinator class with the partitioning settings.
+        """
+        self.partitions = max(1, settings.WORK_PARTITIONS)
+        self.unit_records = max(1, settings.WORK_UNIT_RECORDS)
+        self.poll_interval = settings.WORK_POLL_INTERVAL
+        self.stall_seconds = max(1, settings.WORK_STALL_LEASES) * work_queue.lease_seconds
+
+    async def enqueue_run(self, run: str, since: dict[str, datetime] | None, incomplete: set[str]) -> tuple[int, dict[str, datetime]]:
+        """
+        Stream the pages of both sources into work units of at most `unit_records` records per partition.
+        The sources which could not be fetched completely are added to `incomplete`.
+        Returns the number of enqueued units and the newest record update time per source.
+        """
+        since = since or {}
+        units: dict[int, WorkUnit] = {}
+        latest: dict[str, datetime] = {}
+        enqueued = 0
+        with metrics.stage('extract'):
+            async for source, page in data_fetcher.stream_all_pages(incomplete):
+                metrics.add_records('extract', len(page))
+                page_latest = data_fetcher.latest_timestamp(source, page)
+                if page_latest and (latest.get(source) is None or page_latest > latest[source]):
+                    latest[source] = page_latest
+                page = data_fetcher.filter_since(source, page, since.get(source))
+                if not page:
+                    continue
+                adapter = source_adapters[source]
+                host_id_of = adapter.accessor('host_id')
+                ip_address_of = adapter.accessor('geo') if adapter.geo else None
+                locations = {}
+                if ip_address_of:
+                    with metrics.stage('geo_enrich'):
+                        locations = await geo_enricher.enrich_source_data(source, page)
+                    metrics.add_records('geo_enrich', len(locations))
+                full_units = []
+                for record in page:
+                    partition = partition_of(str(host_id_of(record)), self.partitions)
+                    unit = units.setdefault(partition, WorkUnit())
+                    unit.records.setdefault(source, []).append(record)
+                    if ip_address_of and (ip_address := ip_address_of(record)):
+                        unit.locations[ip_address] = locations.get(ip_address, '')
+                    if len(unit) >= self.unit_records:
+                        full_units.append((partition, units.pop(partition)))
+                for partition, unit in full_units:
+                    await asyncio.to_thread(work_queue.enqueue, run, partition, unit)
+                enqueued += len(full_units)
+        for partition, unit in units.items():
+            await asyncio.to_thread(work_queue.enqueue, run, partition, unit)
+        enqueued += len(units)
+        return enqueued, latest
+
+    def wait_for_run(self, run: str) -> dict[str, int]:
+        """
+        Wait until every unit of the run is done or failed and return the status of the run.
+        The wait is given up when no unit finished for `stall_seconds`, as when no worker is running,
+        in which case the returned status still has pending or leased units.
+        """
+        finished = None
+        progressed_at = time.monotonic()
+        while True:
+            status = work_queue.run_status(run)
+            if not status['pending'] and not status['leased']:
+                return status
+            if status['done'] + status['failed'] != finished:
+                finished = status['done'] + status['failed']
+                progressed_at = time.monotonic()
+            elif time.monotonic() - progressed_at >= self.stall_seconds:
+                logger.error(
+                    f'Stopped waiting for run {run} after no work unit finished for {self.stall_seconds} seconds: {status}',
+                )
+                return status
+            time.sleep(self.poll_interval)
+
+    def __call__(self, wait: bool = True):
+        """
+        Enqueue one run and, unless `wait` is False, wait for the workers, move the watermarks forward
+        and complete the snapshot run and visualize the loaded data.
+        The watermarks are kept when any unit failed, did not finish or had write errors, and the watermark
+        of a source when its pages were not all fetched. The snapshot run is left incomplete when any unit
+        failed or did not finish.
+        """
+        started_at = time.perf_counter()
+        full_sync_started_at = datetime.now()
+        run = full_sync_started_at.strftime('%Y-%m-%dT%H-%M-%S-%f')
+        work_queue.purge(keep_run=run)
+        since = get_sync_watermarks()
+        incomplete = set()
+        try:
+            enqueued, latest = resources.run(self.enqueue_run(run, since, incomplete))
+        finally:
+            metrics.finish_run(time.perf_counter() - started_at)
+        logger.info(f'Enqueued {enqueued} work units of run {run}')
+        if not wait or not enqueued:
+            return
+        status = self.wait_for_run(run)
+        logger.info(f'Completed the work units of run {run}: {status}')
+        unfinished = status['pending'] + status['leased']
+        if status['failed'] or unfinished:
+            logger.error(
+                f'{status["failed"]} work units of run {run} failed and {unfinished} did not finish, keeping the sync watermarks',
+            )
+        else:
+            save_sync_watermarks(
+                latest, [{'write_errors': status['write_errors']}],
+                full_sync_started_at=full_sync_started_at if since is None else None,
+                incomplete=incomplete,
+            )
+            if settings.SNAPSHOT_ENABLED:
+                from snapshot import inventory_snapshot
+
+                inventory_snapshot.finish_run(run, full=since is None and not incomplete)
+        visualize_data()
+        logger.info(
+            f'Completed all the operations and took time of {time.perf_counter() - started_at:.2f} seconds',
+        )
+
+
+class Worker:
+    """
+    Class to normalize and load the work units leased from the work queue.
+    """
+
+    def __init__(self, name: str):
+        """
+        Initializing the Worker class with its lease owner name.
+        """
+        self.name = name
+        self.poll_interval = settings.WORK_POLL_INTERVAL
+        self.data_normalizer = DataNormalizer()
+        self.stopping = threading.Event()
+
+    def process(self, unit_id: int, run: str, unit: WorkUnit) -> list[dict[str, Any]]:
+        """
+        Normalize, deduplicate and load the hosts of the unit in this process, the workers being the unit
+        of parallelism, and write them to the snapshot part of the unit. Returns the per batch load results.
+        """
+        hosts = []
+        with metrics.stage('normalize'):
+            for source, records in unit.records.items():
+                hosts.extend(
+                    self.data_normalizer.normalize_records(
+                        source, records,
+                        locations=unit.locations if source_adapters[source].geo else None,
+                    ),
+                )
+        metrics.add_records('normalize', len(hosts))
+        with metrics.stage('dedup'):
+            unique_hosts = self.data_normalizer.remove_duplicates(hosts)
+        metrics.add_records('dedup', len(unique_hosts))
+        with metrics.stage('load'):
+            load_results = mongo_db.insert_data_operations(unique_hosts)
+        metrics.add_records('load', sum(result['operations'] for result in load_results))
+        if settings.SNAPSHOT_ENABLED:
+            # pyarrow is only imported when snapshots are enabled
+            from snapshot import inventory_snapshot
+
+            with metrics.stage('snapshot'):
+                inventory_snapshot.write_part(run, f'part-{unit_id:08d}', unique_hosts)
+            metrics.add_records('snapshot', len(unique_hosts))
+        return load_results
+
+    def keep_lease(self, unit_id: int, done: threading.Event):
+        """
+        Extend the lease of the unit until it is processed, so a slow unit is not taken over.
+        """
+        while not done.wait(work_queue.lease_seconds / 3):
+            if not work_queue.extend_lease(unit_id, self.name):
+                logger.error(f'Worker {self.name} lost the lease of work unit {unit_id}')
+                return
+
+    def run_once(self) -> bool:
+        """
+        Lease and process one unit. Returns False when there was nothing to lease.
+        The metrics file is written after every unit, each unit counting as a run of the worker.
+        """
+        leased = work_queue.lease(self.name)
+        if leased is None:
+            return False
+        started_at = time.perf_counter()
+        unit_id, run, unit = leased
+        done = threading.Event()
+        heartbeat = threading.Thread(target=self.keep_lease, args=(unit_id, done), daemon=True)
+        heartbeat.start()
+        try:
+            load_results = self.process(unit_id, run, unit)
+        except Exception as e:
+            logger.error(f'Worker {self.name} failed work unit {unit_id} due to reason: {e!r}')
+            work_queue.release(unit_id, self.name)
+            return True
+        finally:
+            done.set()
+            heartbeat.join()
+            metrics.finish_run(time.perf_counter() - started_at)
+        write_errors = sum(result['write_errors'] for result in load_results)
+        if work_queue.acknowledge(unit_id, self.name, write_errors):
+            logger.info(f'Worker {self.name} loaded work unit {unit_id} of {len(unit)} records')
+        return True
+
+    def run_forever(self):
+        """
+        Process units until SIGINT or SIGTERM. The unit in progress is finished first.
+        """
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signal_number, lambda *_: self.stopping.set())
+        logger.info(f'Worker {self.name} started')
+        while not self.stopping.is_set():
+            if not self.run_once():
+                self.stopping.wait(self.poll_interval)
+        resources.close()
+        logger.info(f'Worker {self.name} stopped')
+
+
+def run_worker(name: str):
+    """
+    Entry point of a worker process.
+    """
+    metrics.use_worker(name)
+    Worker(name).run_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    coordinator_parser = commands.add_parser('coordinator', help='enqueue one run and wait for the workers')
+    coordinator_parser.add_argument(
+        '--no-wait', action='store_true', help='only enqueue, without saving the watermarks and visualizing',
+    )
+    worker_parser = commands.add_parser('worker', help='process work units until stopped')
+    worker_parser.add_argument('--processes', type=int, default=1, help='worker processes to start on this machine')
+    worker_parser.add_argument('--name', default=f'{socket.gethostname()}-{os.getpid()}', help='lease owner name prefix')
+    args = parser.parse_args()
+
+    if args.command == 'coordinator':
+        mongo_db.ensure_indexes()
+        Coordinator()(wait=not args.no_wait)
+        resources.close()
+    elif args.processes <= 1:
+        run_worker(args.name)
+    else:
+        # Spawned instead of forked, so no worker inherits the Mongo client of this process
+        context = multiprocessing.get_context('spawn')
+        processes = [
+            context.Process(target=run_worker, args=(f'{args.name}-{number}',))
+            for number in range(args.processes)
+        ]
+        for process in processes:
+            process.start()
+
+        def stop_workers(*_):
+            for process in processes:
+                process.terminate()
+
+        # Every worker handles SIGINT and SIGTERM itself, the parent waits for them to finish their unit
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, stop_workers)
+        for process in processes:
+            process.join()
+
+
+if __name__ == '__main__':
+    main()